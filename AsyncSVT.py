@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Asyncio counterpart of the SVT class: same getters and setters, exposed
+# as coroutines so that one event loop can drive many thermostats.
+#
+# Import required Python libraries
+import asyncio
+import base64
+import json
+import logging
+import time
+import urllib.parse as parse
+
+from SVT import Constants, DISCOVERED_IDS, deviceIdx, parseDiscovery, \
+    apiVerb, API_CALLS, API_ERRORS, API_LATENCY
+from snipshelpers.http_pool import AsyncConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSVT:
+    'Asyncio client for SVT'
+
+    def __init__(self, ip, port=8080, username=None, password=None,
+                 poolSize=4, idleTimeout=30, timeout=5):
+        self.ip = ip
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = float(timeout) if timeout else None
+        for key in DISCOVERED_IDS:
+            setattr(self, key, None)
+
+        self._pool = AsyncConnectionPool.shared(
+            ip, port, poolSize, idleTimeout)
+        self._headers = {'Connection': 'keep-alive'}
+        if self.username:
+            credentials = ('%s:%s' % (self.username, self.password))
+            encoded_credentials = base64.b64encode(
+                credentials.encode('ascii'))
+            self._headers['Authorization'] = 'Basic %s' % \
+                encoded_credentials.decode("ascii")
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """ Build an AsyncSVT and discover its devices. """
+        thermostat = cls(*args, **kwargs)
+        await thermostat.discover()
+        return thermostat
+
+    async def discover(self):
+        """ Look for the SVT devices in Domoticz, the three discovery calls
+            being issued concurrently.
+
+            :return: the idx map, or None if Domoticz could not be queried.
+        """
+        switches, utilities, hardware = await asyncio.gather(
+            self.DomoticzAPI("type=command&param=getlightswitches"),
+            self.DomoticzAPI("type=devices&filter=utility&used=true&order=Name"),
+            self.DomoticzAPI("type=hardware"))
+        if switches is None or utilities is None or hardware is None:
+            return None
+        ids = parseDiscovery(switches, utilities, hardware)
+        for key in DISCOVERED_IDS:
+            setattr(self, key, ids.get(key))
+        return ids
+
+    async def read(self, *names):
+        """ Read several properties concurrently.
+
+            :param names: property names, e.g. 'mode', 'state',
+                          'setpointNormal'.
+            :return: a {name: value} dict.
+        """
+        values = await asyncio.gather(
+            *[getattr(self, name)() for name in names])
+        return dict(zip(names, values))
+
+    async def _device(self, idx):
+        idx = deviceIdx(idx)
+        if idx is None:
+            return None
+        devicesAPI = await self.DomoticzAPI("type=devices&rid={}".format(idx))
+        if devicesAPI and devicesAPI.get("result"):
+            return devicesAPI["result"][0]
+
+    async def _switchLevel(self, idx, level):
+        devicesAPI = await self.DomoticzAPI(
+            "type=command&param=switchlight&idx={}&switchcmd=Set Level&level={}"
+            .format(idx, level))
+        return devicesAPI is not None
+
+    async def mode(self):
+        res = await self._device(self.modeId)
+        if res and 'Level' in res:
+            return Constants.mode[res['Level']]
+
+    async def setMode(self, mode):
+        inv_mode = {value: key for key, value in Constants.mode.items()}
+        if type(mode) is str and mode in inv_mode:
+            mode = inv_mode[mode]
+        if type(mode) is not int or mode not in Constants.mode:
+            logger.error("mode not in {}".format(inv_mode.keys()))
+            return False
+        return await self._switchLevel(self.modeId, mode)
+
+    async def state(self):
+        res = await self._device(self.controlId)
+        if res and 'Level' in res:
+            return Constants.control[res['Level']]
+
+    async def setState(self, v):
+        inv_control = {value: key for key, value in Constants.control.items()}
+        if type(v) is str and v in inv_control:
+            v = inv_control[v]
+        if type(v) is not int or v not in Constants.control:
+            logger.error("state not in {}".format(inv_control.keys()))
+            return False
+        return await self._switchLevel(self.controlId, v)
+
+    async def pause(self):
+        res = await self._device(self.pauseId)
+        if res and 'Status' in res:
+            return res['Status'] == 'On'
+
+    async def setPause(self, v):
+        inv = {value: key for key, value in Constants.switchState.items()}
+        if type(v) is bool:
+            v = 'On' if v else 'Off'
+        elif type(v) is int and v in Constants.switchState:
+            v = Constants.switchState[v]
+        if v not in inv:
+            logger.error("Pause value not in {}".format(inv.keys()))
+            return False
+        devicesAPI = await self.DomoticzAPI(
+            "type=command&param=switchlight&idx={}&switchcmd={}"
+            .format(self.pauseId, v))
+        return devicesAPI is not None
+
+    async def indoorTemp(self):
+        res = await self._device(self.indoorProbeId)
+        if res and 'Temp' in res:
+            return res['Temp']
+
+    async def outdoorTemp(self):
+        res = await self._device(self.outdoorProbeId)
+        if res and 'Temp' in res:
+            return res['Temp']
+
+    async def setpointNormal(self):
+        res = await self._device(self.setpointNormalId)
+        if res and 'SetPoint' in res:
+            return res['SetPoint']
+
+    async def setSetpointNormal(self, v):
+        return await self._setSetpoint(self.setpointNormalId, v)
+
+    async def setpointEconomy(self):
+        res = await self._device(self.setpointEconomyId)
+        if res and 'SetPoint' in res:
+            return res['SetPoint']
+
+    async def setSetpointEconomy(self, v):
+        return await self._setSetpoint(self.setpointEconomyId, v)
+
+    async def _setSetpoint(self, idx, v):
+        if not isinstance(v, (int, float)):
+            return False
+        devicesAPI = await self.DomoticzAPI(
+            "type=command&param=setsetpoint&idx={}&setpoint={}".format(idx, v))
+        return devicesAPI is not None
+
+    async def isOn(self):
+        res = await self._device(self.switchId)
+        if res and 'Status' in res:
+            return res['Status'] == 'On'
+
+    async def isNight(self):
+        """ Whether the Mode is night mode
+
+            :rtype: bool
+        """
+        return await self.mode() == 'nuit'
+
+    async def isDay(self):
+        """ Whether the runningMode is Day mode
+
+            :rtype: bool
+        """
+        return not await self.isNight()
+
+    async def getProbes(self):
+        logger.debug("getProbes")
+        devicesAPI = await self.DomoticzAPI(
+            "type=devices&filter=temp&used=true&order=ID")
+        if devicesAPI:
+            return devicesAPI["result"]
+
+    async def DomoticzAPI(self, APICall):
+        resultJson = None
+        verb = apiVerb(APICall)
+        error = None
+        path = "/json.htm?{}".format(parse.quote(APICall, safe="&="))
+        logger.debug("Calling domoticz API: http://{}:{}{}".format(
+            self.ip, self.port, path))
+
+        start = time.monotonic()
+        try:
+            # The body is read whole from the asyncio stream and decoded at
+            # once: unlike DomoticzClient.select(), device lists are not
+            # parsed while received
+            status, body = await asyncio.wait_for(
+                self._pool.request('GET', path, self._headers), self.timeout)
+            if status == 200:
+                resultJson = json.loads(body.decode('utf-8'))
+                if resultJson["status"] != "OK":
+                    logger.error("Domoticz API returned an error: status = {}".format(
+                        resultJson["status"]))
+                    resultJson = None
+                    error = 'status'
+            else:
+                logger.error(
+                    "Domoticz API: http error = {}".format(status))
+                error = 'http'
+        except (OSError, ValueError, KeyError, asyncio.IncompleteReadError,
+                asyncio.TimeoutError) as e:
+            logger.error("Error calling 'http://{}:{}{}': {}".format(
+                self.ip, self.port, path, e))
+            error = type(e).__name__
+        API_LATENCY.observe(time.monotonic() - start, {'verb': verb})
+        API_CALLS.inc({'verb': verb})
+        if error is not None:
+            API_ERRORS.inc({'verb': verb, 'error': error})
+        return resultJson
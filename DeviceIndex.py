@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Index of the Domoticz devices by name, name prefix, type and room.
+#
+# The whole catalog is read once, then only the devices updated since the
+# previous sync are fetched, using the 'lastupdate' parameter of the
+# 'type=devices' API. Domoticz does not report deleted devices nor, as
+# renaming does not change the last update time, renamed ones that way:
+# the catalog is read again in full every fullInterval seconds, or when
+# asked to.
+#
+# Import required Python libraries
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Fields kept for each device
+INDEX_FIELDS = ('idx', 'Name', 'Type', 'SubType', 'PlanIDs')
+
+
+def namePrefixes(name):
+    """ The prefixes of a name ending at a word boundary, the name itself
+        included: 'SVT - Mode' gives 'SVT', 'SVT -' and 'SVT - Mode'.
+    """
+    prefixes = [name[:i] for i, c in enumerate(name) if c == ' ' and i and
+                name[i - 1] != ' ']
+    prefixes.append(name)
+    return prefixes
+
+
+class DeviceIndex:
+    'Name, type and room index of the devices of a Domoticz server'
+
+    def __init__(self, select, fullInterval=3600):
+        """ :param select: DomoticzClient.select.
+            :param fullInterval: seconds between two full reads of the
+                                 catalog.
+        """
+        self.select = select
+        self.fullInterval = float(fullInterval)
+        # Monotonic time of the last full sync
+        self.lastFull = None
+        self._actTime = None
+        self._devices = {}
+        self._byName = {}
+        self._byPrefix = {}
+        self._byType = {}
+        self._byRoom = {}
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._syncLock = threading.Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def sync(self, full=False):
+        """ Bring the index up to date. Only the devices updated since the
+            previous sync are fetched, unless full is True, the index is
+            empty or the last full sync is older than fullInterval.
+
+            :return: the number of devices fetched, or None if Domoticz
+                     could not be queried.
+        """
+        with self._syncLock:
+            full = full or self._actTime is None or \
+                time.monotonic() - self.lastFull > self.fullInterval
+            query = "type=devices&filter=all&used=true"
+            if not full:
+                # Domoticz returns the devices updated strictly after
+                # lastupdate, with a one second resolution: the devices
+                # of the last second are fetched again rather than missed.
+                query += "&lastupdate={}".format(self._actTime - 1)
+            start = time.monotonic()
+            devicesAPI = self.select(query, INDEX_FIELDS)
+            if devicesAPI is None:
+                return None
+            rooms = None
+            if full:
+                plans = self.select("type=plans&order=name&used=true",
+                                    ('idx', 'Name'))
+                if plans is not None:
+                    rooms = {int(plan["idx"]): plan["Name"]
+                             for plan in plans.get("result", [])}
+
+            devices = devicesAPI.get("result", [])
+            with self._lock:
+                if full:
+                    self._clear()
+                    self.lastFull = start
+                if rooms is not None:
+                    self._rooms = rooms
+                for device in devices:
+                    self._add(device)
+            actTime = devicesAPI.get("ActTime")
+            self._actTime = int(actTime) if actTime is not None else \
+                int(time.time())
+            logger.debug("Device index {}: {} devices fetched, {} known".format(
+                'rebuilt' if full else 'synced', len(devices),
+                len(self._devices)))
+            return len(devices)
+
+    def get(self, idx):
+        """ Return the indexed fields of a device, or None. """
+        return self._devices.get(int(idx))
+
+    def find(self, name):
+        """ Return the idx of the device called name, or None. When several
+            devices share the name, the most recent one is returned.
+        """
+        with self._lock:
+            idxs = self._byName.get(name)
+            return max(idxs) if idxs else None
+
+    def byName(self, name):
+        """ Return the devices called name. """
+        return self._lookup(self._byName, name)
+
+    def byPrefix(self, prefix):
+        """ Return the devices whose name starts with prefix. Only prefixes
+            ending at a word boundary are indexed: 'SVT Zone' matches
+            'SVT Zone 1 - Mode' but 'SVT Zo' does not.
+        """
+        return self._lookup(self._byPrefix, prefix.rstrip())
+
+    def byType(self, dtype):
+        """ Return the devices of a Domoticz type, e.g. 'Temp'. """
+        return self._lookup(self._byType, dtype)
+
+    def byRoom(self, room):
+        """ Return the devices of a room, given by name or idx. """
+        with self._lock:
+            plan = self._plan(room)
+        return self._lookup(self._byRoom, plan)
+
+    def rooms(self):
+        """ Return the {idx: name} map of the rooms. """
+        return dict(self._rooms)
+
+    def _plan(self, room):
+        if isinstance(room, int) or str(room).isdigit():
+            return int(room)
+        room = str(room).lower()
+        for plan, name in self._rooms.items():
+            if name.lower() == room:
+                return plan
+        return None
+
+    def _lookup(self, table, key):
+        with self._lock:
+            return sorted((self._devices[idx] for idx in table.get(key, ())),
+                          key=lambda device: int(device["idx"]))
+
+    def _keys(self, device):
+        # (table, key) pairs under which a device is indexed
+        name = device.get("Name", "")
+        keys = [(self._byName, name), (self._byType, device.get("Type"))]
+        keys.extend((self._byPrefix, prefix) for prefix in namePrefixes(name))
+        keys.extend((self._byRoom, int(plan))
+                    for plan in device.get("PlanIDs") or ())
+        return keys
+
+    def _add(self, device):
+        idx = int(device["idx"])
+        previous = self._devices.get(idx)
+        if previous is not None:
+            self._remove(idx, previous)
+        self._devices[idx] = device
+        for table, key in self._keys(device):
+            table.setdefault(key, set()).add(idx)
+
+    def _remove(self, idx, device):
+        for table, key in self._keys(device):
+            idxs = table.get(key)
+            if idxs is not None:
+                idxs.discard(idx)
+                if not idxs:
+                    del table[key]
+
+    def _clear(self):
+        self._devices = {}
+        self._byName = {}
+        self._byPrefix = {}
+        self._byType = {}
+        self._byRoom = {}
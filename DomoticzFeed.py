@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Push based device state: Domoticz publishes every device update on the
+# domoticz/out MQTT topic. The feed copies the updates of the tracked
+# devices into the devices snapshots, which then stop polling the JSON API
+# until the feed goes quiet.
+#
+# Requires paho-mqtt: pip3 install paho-mqtt
+#
+# Import required Python libraries
+import json
+import logging
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    mqtt = None
+
+logger = logging.getLogger(__name__)
+
+
+def feedFields(message):
+    """ Translate a domoticz/out message into the fields of the JSON API
+        device it updates.
+    """
+    dtype = message.get('dtype', '')
+    svalue = message.get('svalue1')
+    if message.get('switchType') == 'Selector':
+        return {'Level': int(svalue or 0)}
+    if dtype.startswith('Light'):
+        return {'Status': 'On' if message.get('nvalue') else 'Off'}
+    if dtype == 'Thermostat':
+        return {'SetPoint': svalue}
+    if dtype.startswith('Temp'):
+        return {'Temp': float(svalue)}
+    return {}
+
+
+class DomoticzFeed:
+    'Device updates pushed by Domoticz over MQTT'
+
+    def __init__(self, host='localhost', port=1883, topic='domoticz/out',
+                 quiet=120):
+        """ :param quiet: seconds of silence after which the snapshots fall
+                          back to polling.
+        """
+        self.host = host
+        self.port = int(port)
+        self.topic = topic
+        self.quiet = float(quiet)
+        self._snapshots = []
+        self._client = None
+
+    def attach(self, snapshot):
+        """ Feed a DeviceSnapshot. """
+        snapshot.feedTimeout = self.quiet
+        self._snapshots.append(snapshot)
+
+    def start(self):
+        """ Connect to the broker in the background.
+
+            :return: False if paho-mqtt is not installed.
+        """
+        if mqtt is None:
+            logger.warning("paho-mqtt is not installed, {} is ignored".format(
+                self.topic))
+            return False
+        try:
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+        except AttributeError:
+            # paho-mqtt < 2.0
+            client = mqtt.Client()
+        client.on_connect = self._onConnect
+        client.on_message = self._onMessage
+        client.connect_async(self.host, self.port)
+        client.loop_start()
+        self._client = client
+        return True
+
+    def stop(self):
+        if self._client is not None:
+            self._client.loop_stop()
+            self._client.disconnect()
+            self._client = None
+
+    def handle(self, payload):
+        """ Apply one domoticz/out message to the snapshots. """
+        try:
+            message = json.loads(payload)
+            fields = feedFields(message)
+            idx = message['idx']
+        except (ValueError, KeyError, TypeError) as e:
+            logger.debug("Ignoring {} message: {}".format(self.topic, e))
+            for snapshot in self._snapshots:
+                snapshot.heartbeat()
+            return
+        for snapshot in self._snapshots:
+            if fields:
+                snapshot.push(idx, fields)
+            else:
+                snapshot.heartbeat()
+
+    def _onConnect(self, client, userdata, flags, rc):
+        # Subscribe again after every reconnection
+        logger.info("Connected to {}:{}, subscribing to {}".format(
+            self.host, self.port, self.topic))
+        client.subscribe(self.topic)
+
+    def _onMessage(self, client, userdata, msg):
+        self.handle(msg.payload)
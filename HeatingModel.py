@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Heating and cooling model of an SVT zone, learned from the temperature
+# logs of Domoticz ('type=graph&sensor=temp').
+#
+# The indoor temperature is assumed to follow
+#     dT/dt = power + loss * (outdoor - T)
+# where loss is how fast the zone cools towards the outdoor temperature and
+# power how fast the heater warms it up. Both are fitted by least squares,
+# loss on the cooling periods and power on the heating ones. The periods
+# are read from the log of the heater switch ('type=lightlog'), or guessed
+# from the temperature going up or down when the switch has no log.
+#
+# Requires numpy: pip3 install numpy
+#
+# Import required Python libraries
+import logging
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from SVT import DomoticzUnavailable, deviceIdx
+from snipshelpers.thread_handler import ThreadHandler
+
+logger = logging.getLogger(__name__)
+
+# Records converted to arrays at once while ingesting a log
+GRAPH_BATCH = 4096
+
+# Consecutive samples further apart, in seconds, are not used for rates
+MAX_GAP = 900
+
+# Gap allowed for each log range: the short log has a sample every 5
+# minutes, the month and year logs one a day
+MAX_GAPS = {'day': MAX_GAP, 'month': 2 * 86400, 'year': 2 * 86400}
+
+
+def ingestGraph(thermostat, idx, graphRange='day'):
+    """ Stream the temperature log of a sensor into columnar arrays.
+
+        Records are decoded one at a time and their dates parsed by
+        batches, so memory grows with the samples only, never with the
+        JSON text.
+
+        :param graphRange: 'day' for the short log (one sample every 5
+                           minutes), 'month' or 'year' for daily averages.
+        :return: the (times, temperatures) arrays, times in seconds since
+                 the epoch of the log dates, local time read as UTC.
+        :raise DomoticzUnavailable: when the log cannot be read.
+    """
+    times = array('q')
+    temps = array('f')
+    dates = []
+
+    def flush():
+        parsed = numpy.array(dates, dtype='datetime64[s]').astype(numpy.int64)
+        times.frombytes(parsed.tobytes())
+        del dates[:]
+
+    for record in thermostat.client.stream(
+            "type=graph&sensor=temp&idx={}&range={}".format(idx, graphRange)):
+        # 'ta' is the daily average of the month and year logs, where 'te'
+        # is the daily maximum, and 'te' the temperature of the short log
+        value = record.get('ta', record.get('te'))
+        if value is None or 'd' not in record:
+            continue
+        dates.append(record['d'].replace(' ', 'T'))
+        temps.append(float(value))
+        if len(dates) >= GRAPH_BATCH:
+            flush()
+    if dates:
+        flush()
+    return (numpy.frombuffer(times, dtype=numpy.int64),
+            numpy.frombuffer(temps, dtype=numpy.float32))
+
+
+def ingestSwitch(thermostat, idx):
+    """ Read the log of a switch.
+
+        :return: the (times, on) arrays, oldest first, times as in
+                 ingestGraph.
+        :raise DomoticzUnavailable: when the log cannot be read.
+    """
+    dates = []
+    states = []
+    for record in thermostat.client.stream(
+            "type=lightlog&idx={}".format(idx)):
+        if 'Date' not in record or 'Status' not in record:
+            continue
+        dates.append(record['Date'].replace(' ', 'T'))
+        states.append(record['Status'] != 'Off')
+    times = numpy.array(dates, dtype='datetime64[s]').astype(numpy.int64)
+    on = numpy.array(states, dtype=bool)
+    # Domoticz gives the newest first
+    order = numpy.argsort(times, kind='stable')
+    return times[order], on[order]
+
+
+class HeatingModel:
+    'Heating and cooling rates of a zone'
+
+    def __init__(self, loss, power, samples=0):
+        """ :param loss: cooling rate, per hour and °C of difference with
+                         the outdoor temperature.
+            :param power: heating rate in °C per hour, outdoor losses
+                          excluded.
+            :param samples: number of rates the model was fitted on.
+        """
+        self.loss = loss
+        self.power = power
+        self.samples = samples
+
+    @classmethod
+    def fit(cls, times, indoor, outdoorTimes, outdoor, maxGap=MAX_GAP,
+            heaterTimes=None, heaterOn=None):
+        """ Fit a model on indoor and outdoor temperature logs.
+
+            :param maxGap: seconds between two samples above which their
+                           rate is not used.
+            :param heaterTimes: times the heater switch changed, oldest
+                                first. The zone is taken as heating when the
+                                temperature goes up without them.
+            :param heaterOn: the state of the heater at each of heaterTimes.
+            :return: the HeatingModel, or None without enough data.
+        """
+        if len(times) < 3 or len(outdoorTimes) < 1:
+            return None
+        indoor = numpy.asarray(indoor, dtype=numpy.float64)
+        hours = numpy.diff(times) / 3600.0
+        valid = (hours > 0) & (hours <= maxGap / 3600.0)
+        rate = numpy.zeros_like(hours)
+        rate[valid] = numpy.diff(indoor)[valid] / hours[valid]
+        # Outdoor difference at the start of each interval
+        gap = numpy.interp(times[:-1], outdoorTimes, outdoor) - indoor[:-1]
+
+        if heaterTimes is not None and len(heaterTimes):
+            # State of the heater at the start of each interval, unknown
+            # before its first change
+            last = numpy.searchsorted(heaterTimes, times[:-1],
+                                      side='right') - 1
+            known = last >= 0
+            on = numpy.asarray(heaterOn, dtype=bool)[numpy.maximum(last, 0)]
+            cooling = valid & known & ~on & (gap < 0)
+            heating = valid & known & on
+        else:
+            cooling = valid & (rate < 0) & (gap < 0)
+            heating = valid & (rate > 0)
+        if cooling.sum() < 2 or not heating.any():
+            return None
+        loss = numpy.dot(rate[cooling], gap[cooling]) / \
+            numpy.dot(gap[cooling], gap[cooling])
+        if loss <= 0:
+            return None
+        power = numpy.mean(rate[heating] - loss * gap[heating])
+        return cls(float(loss), float(power),
+                   int(cooling.sum() + heating.sum()))
+
+    def rate(self, indoor, outdoor, heating=True):
+        """ Indoor temperature change in °C per hour. """
+        return (self.power if heating else 0) + self.loss * (outdoor - indoor)
+
+    def hoursTo(self, target, indoor, outdoor):
+        """ Hours until the zone reaches target, heating if it is above the
+            indoor temperature, cooling otherwise, the outdoor temperature
+            being constant.
+
+            :return: the hours, or None if target is never reached.
+        """
+        heating = target > indoor
+        # Temperature the zone tends to
+        limit = outdoor + (self.power if heating else 0) / self.loss
+        if (target - limit) * (indoor - limit) <= 0 or \
+                abs(target - limit) > abs(indoor - limit):
+            return None
+        return math.log((indoor - limit) / (target - limit)) / self.loss
+
+    def preheatStart(self, target, at, indoor, outdoor):
+        """ When heating must start to reach target at the given time.
+
+            :param at: the time, in seconds since the epoch.
+            :return: the time to start heating, at itself if the zone is
+                     already warm enough, or None if target cannot be
+                     reached.
+        """
+        if indoor >= target:
+            return at
+        hours = self.hoursTo(target, indoor, outdoor)
+        if hours is not None:
+            return at - hours * 3600
+
+
+def preheat(thermostat, model, schedule, after=None):
+    """ When heating must start for the zone to be at its day setpoint
+        when the schedule next goes to day mode.
+
+        :return: the (start, change) times, or None.
+    """
+    upcoming = schedule.nextChange('jour', after)
+    indoor = thermostat.indoorTemp
+    outdoor = thermostat.outdoorTemp
+    target = thermostat.setpointNormal
+    if upcoming is None or None in (indoor, outdoor, target):
+        return None
+    change = upcoming[0]
+    start = model.preheatStart(float(target), change, float(indoor),
+                               float(outdoor))
+    if start is not None:
+        return start, change
+
+
+def fitZone(thermostat, graphRange='day'):
+    """ Learn the model of a zone from its indoor and outdoor sensors logs.
+
+        :return: the HeatingModel, or None.
+        :raise DomoticzUnavailable: when the logs cannot be read.
+    """
+    if numpy is None:
+        logger.warning("numpy is not installed, heating model is disabled")
+        return None
+    # Probes are given as in the SVT hardware, e.g. "12,13"
+    indoorId = deviceIdx(thermostat.indoorProbeId)
+    outdoorId = deviceIdx(thermostat.outdoorProbeId)
+    if indoorId is None or outdoorId is None:
+        return None
+    times, indoor = ingestGraph(thermostat, indoorId, graphRange)
+    outdoorTimes, outdoor = ingestGraph(thermostat, outdoorId, graphRange)
+    heaterTimes = heaterOn = None
+    # The switch state is only meaningful for the 5 minutes samples, the
+    # heater changes many times between two daily averages
+    heaterId = deviceIdx(thermostat.switchId)
+    if heaterId is not None and graphRange == 'day':
+        heaterTimes, heaterOn = ingestSwitch(thermostat, heaterId)
+    model = HeatingModel.fit(times, indoor, outdoorTimes, outdoor,
+                             MAX_GAPS.get(graphRange, MAX_GAP),
+                             heaterTimes, heaterOn)
+    if model is not None:
+        logger.info("{} heating model: loss {:.3f}/h, power {:.2f}°C/h, "
+                    "{} samples".format(thermostat.name, model.loss,
+                                        model.power, model.samples))
+    return model
+
+
+class ModelLearner:
+    'Learns the heating model of every zone of a registry, periodically'
+
+    def __init__(self, registry, models, refresh=24, graphRange='day'):
+        """ :param models: the {thermostat: HeatingModel} dict to fill.
+            :param refresh: hours between two learnings.
+        """
+        self.registry = registry
+        self.models = models
+        self.refresh = float(refresh)
+        self.graphRange = graphRange
+        self._job = None
+        self._stopped = False
+
+    def start(self):
+        """ Learn now, then every refresh hours, on the thread handler. """
+        self._job = ThreadHandler().every(self.refresh * 3600, self.learn,
+                                          delay=0)
+
+    def stop(self):
+        self._stopped = True
+        if self._job is not None:
+            self._job.cancel()
+
+    def learn(self):
+        """ Learn the model of every zone now. """
+        for thermostat in self.registry.zones().values():
+            try:
+                model = fitZone(thermostat, self.graphRange)
+            except DomoticzUnavailable as e:
+                logger.error("Unable to learn heating model: {}".format(e))
+                continue
+            if model is not None and not self._stopped:
+                self.models[thermostat] = model
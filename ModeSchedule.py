@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Day/night schedule of an SVT zone, read from the timers of its Mode
+# device ('type=timers&idx=<modeId>').
+#
+# The timers are read once and expanded into a timeline of the mode changes
+# of the next days, so that the mode at a given time, or the next change,
+# is found without calling Domoticz. Between two changes the mode is the
+# one last seen on the Mode device: a mode set by hand holds until the next
+# scheduled change, as in Domoticz.
+#
+# Only the timers at a fixed time are expanded (on time, fixed date, odd or
+# even days and weeks). Timers relative to sunrise or sunset, monthly and
+# yearly ones, and randomized ones make the timeline inexact: it still
+# answers the questions, but isNight and isDay ask Domoticz.
+#
+# Import required Python libraries
+import bisect
+import datetime
+import logging
+import threading
+import time
+
+from SVT import Constants
+from snipshelpers.thread_handler import ThreadHandler
+
+logger = logging.getLogger(__name__)
+
+# Domoticz timer types expanded
+TIMER_ON_TIME = 2
+TIMER_FIXED_DATE = 5
+TIMER_ODD_DAYS = 6
+TIMER_EVEN_DAYS = 7
+TIMER_ODD_WEEKS = 8
+TIMER_EVEN_WEEKS = 9
+
+# Days bit mask of the timers, other values are a bit per weekday, Monday
+# first
+DAYS_EVERYDAY = 0x80
+DAYS_WEEKDAYS = 0x100
+DAYS_WEEKENDS = 0x200
+
+# Off command of a timer, the Mode device then goes to level 0
+TIMER_CMD_OFF = 1
+
+# Days of mode changes expanded ahead
+HORIZON_DAYS = 8
+
+# Seconds after a scheduled change during which a read of the previous mode
+# is ignored: Domoticz runs the timer a little late, and snapshots lag.
+CHANGE_GRACE = 120
+
+
+def timerDays(days, date):
+    """ Whether the days mask of a timer includes a date. """
+    if days & DAYS_EVERYDAY:
+        return True
+    weekday = date.weekday()
+    if days & DAYS_WEEKDAYS and weekday < 5:
+        return True
+    if days & DAYS_WEEKENDS and weekday >= 5:
+        return True
+    return bool(days & (1 << weekday))
+
+
+def timerDate(value):
+    """ Date of a fixed date timer: 'YYYY-MM-DD', or 'MM-DD-YYYY' as older
+        Domoticz versions write it. None if unreadable.
+    """
+    for layout in ('%Y-%m-%d', '%m-%d-%Y'):
+        try:
+            return datetime.datetime.strptime(value, layout).date()
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def timerRuns(timer, date):
+    """ Whether an expanded timer runs on a date. """
+    kind = int(timer.get('Type', -1))
+    if kind == TIMER_FIXED_DATE:
+        return timerDate(timer.get('Date')) == date
+    if not timerDays(int(timer.get('Days', DAYS_EVERYDAY)), date):
+        return False
+    if kind in (TIMER_ODD_DAYS, TIMER_EVEN_DAYS):
+        return date.day % 2 == (kind == TIMER_ODD_DAYS)
+    if kind in (TIMER_ODD_WEEKS, TIMER_EVEN_WEEKS):
+        return date.isocalendar()[1] % 2 == (kind == TIMER_ODD_WEEKS)
+    return kind == TIMER_ON_TIME
+
+
+def expand(timers, start, days=HORIZON_DAYS):
+    """ Expand Domoticz timers into mode changes.
+
+        :param timers: the 'result' list of 'type=timers'.
+        :param start: epoch time to expand from, the day before is
+                      included so that the mode at start is known.
+        :return: the ([(epoch, level)] changes sorted by time, whether
+                 every active timer could be expanded).
+    """
+    exact = True
+    expanded = []
+    for timer in timers:
+        if str(timer.get('Active', 'true')).lower() != 'true':
+            continue
+        if int(timer.get('Type', -1)) not in (
+                TIMER_ON_TIME, TIMER_FIXED_DATE, TIMER_ODD_DAYS,
+                TIMER_EVEN_DAYS, TIMER_ODD_WEEKS, TIMER_EVEN_WEEKS):
+            logger.debug("Timer {} not expanded, type {}".format(
+                timer.get('idx'), timer.get('Type')))
+            exact = False
+            continue
+        if str(timer.get('Randomness', 'false')).lower() == 'true':
+            exact = False
+        try:
+            hour, minute = (int(part) for part in timer['Time'].split(':'))
+        except (KeyError, ValueError):
+            exact = False
+            continue
+        level = 0 if int(timer.get('Cmd', 0)) == TIMER_CMD_OFF else \
+            int(timer.get('Level', 0))
+        expanded.append((timer, hour, minute, level))
+
+    first = datetime.date.fromtimestamp(start) - datetime.timedelta(days=1)
+    changes = []
+    for day in range(days + 1):
+        date = first + datetime.timedelta(days=day)
+        for timer, hour, minute, level in expanded:
+            if timerRuns(timer, date):
+                when = datetime.datetime.combine(
+                    date, datetime.time(hour, minute)).timestamp()
+                changes.append((when, level))
+    changes.sort(key=lambda change: change[0])
+    return changes, exact
+
+
+class ModeSchedule:
+    'Timeline of the scheduled mode changes of an SVT zone'
+
+    def __init__(self, thermostat, refresh=24):
+        """ :param thermostat: the SVT whose Mode device timers are read.
+            :param refresh: hours between two reads of the timers.
+        """
+        self.thermostat = thermostat
+        self.refresh = float(refresh)
+        self.exact = False
+        self._times = []
+        self._levels = []
+        self._until = None
+        # Last mode seen on the device: (epoch, level)
+        self._seen = None
+        self._lock = threading.Lock()
+        self._job = None
+
+    def start(self):
+        """ Read the timers now, then every refresh hours, and predict the
+            mode of the thermostat with them.
+        """
+        self.thermostat.schedule = self
+        self._job = ThreadHandler().every(self.refresh * 3600, self.load,
+                                          delay=0)
+
+    def stop(self):
+        if self.thermostat.schedule is self:
+            self.thermostat.schedule = None
+        if self._job is not None:
+            self._job.cancel()
+
+    def load(self, timers=None, now=None):
+        """ Expand the timers of the Mode device, read from Domoticz unless
+            given.
+
+            :return: False if the timers could not be read.
+        """
+        if timers is None:
+            if self.thermostat.modeId is None:
+                return False
+            timersAPI = self.thermostat.client.DomoticzAPI(
+                "type=timers&idx={}".format(self.thermostat.modeId))
+            if timersAPI is None:
+                logger.error("Unable to read the timers of {}".format(
+                    self.thermostat.name))
+                return False
+            timers = timersAPI.get("result", [])
+            # The mode read now anchors the timeline
+            self.thermostat.mode
+        now = time.time() if now is None else now
+        changes, exact = expand(timers, now)
+        # Only the changes of level are kept
+        times, levels = [], []
+        for when, level in changes:
+            if not levels or levels[-1] != level:
+                times.append(when)
+                levels.append(level)
+        with self._lock:
+            self._times, self._levels = times, levels
+            self._until = now + (HORIZON_DAYS - 1) * 86400
+            self.exact = exact
+        logger.debug("{} schedule: {} mode changes until {}{}".format(
+            self.thermostat.name, len(times), time.strftime(
+                '%Y-%m-%d %H:%M', time.localtime(self._until)),
+            '' if exact else ', approximate'))
+        return True
+
+    def observe(self, level, when=None, written=False):
+        """ Record the mode read from, or written to, the Mode device.
+
+            :param written: the mode was written, it is recorded even right
+                            after a scheduled change.
+        """
+        when = time.time() if when is None else when
+        with self._lock:
+            last = bisect.bisect_right(self._times, when) - 1
+            if not written and last >= 0 and \
+                    when - self._times[last] < CHANGE_GRACE and \
+                    level != self._levels[last]:
+                # Most likely read before the timer ran
+                return
+            self._seen = (when, level)
+
+    def levelAt(self, when):
+        """ Mode level at an epoch time, or None when unknown. """
+        with self._lock:
+            if self._until is None or when > self._until:
+                return None
+            last = bisect.bisect_right(self._times, when) - 1
+            seen = self._seen
+            if seen is not None and when >= seen[0] and (
+                    last < 0 or self._times[last] <= seen[0]):
+                return seen[1]
+            if last >= 0:
+                return self._levels[last]
+            return None
+
+    def modeAt(self, when):
+        """ Mode name at an epoch time, e.g. 'nuit', or None. """
+        level = self.levelAt(when)
+        return Constants.mode.get(level) if level is not None else None
+
+    def current(self):
+        """ Mode name now, or None unless known for sure without asking
+            Domoticz.
+        """
+        if not self.exact or self._seen is None:
+            return None
+        return self.modeAt(time.time())
+
+    def nextChange(self, mode=None, after=None):
+        """ Next scheduled change, to mode only if given.
+
+            :return: the (epoch, mode name) of the change, or None.
+        """
+        after = time.time() if after is None else after
+        with self._lock:
+            first = bisect.bisect_right(self._times, after)
+            changes = list(zip(self._times[first:], self._levels[first:]))
+        current = self.levelAt(after)
+        for when, level in changes:
+            if level != current:
+                name = Constants.mode.get(level)
+                if mode is None or name == mode:
+                    return when, name
+            current = level
+        return None
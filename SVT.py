@@ -12,8 +12,23 @@
 import logging
 import json
 import urllib.parse as parse
-import urllib.request as request
 import base64
+import http.client
+import os
+import random
+import threading
+import time
+
+from DeviceIndex import DeviceIndex
+from snipshelpers.http_pool import ConnectionPool
+from snipshelpers.json_stream import iter_array
+from snipshelpers.metrics import metrics, api_calls
+from snipshelpers.profiler import profiler
+from snipshelpers.single_flight import SingleFlight
+from snipshelpers.thread_handler import ThreadHandler, Job, HIGH, NORMAL
+from snipshelpers import shared_state
+from snipshelpers.resilience import CircuitBreaker, DeadlineExceeded, \
+    backoff_delay, deadlines
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -53,247 +68,1322 @@ class Constants:
     }
 
 
+# idx map resolved by the SVT discovery
+DISCOVERED_IDS = ('controlId', 'pauseId', 'modeId', 'setpointNormalId',
+                  'setpointEconomyId', 'indoorProbeId', 'outdoorProbeId',
+                  'switchId')
+
+# Fields kept from the hardware list by the discovery
+HARDWARE_FIELDS = ('Name', 'Mode1', 'Mode2', 'Mode3')
+
+# Names of the SVT devices, after the hardware name
+DEVICE_NAMES = {
+    'controlId': ' - Thermostat Control',
+    'pauseId': ' - Thermostat Pause',
+    'modeId': ' - Thermostat Mode',
+    'setpointNormalId': ' - Setpoint Normal',
+    'setpointEconomyId': ' - Setpoint Economy'
+}
+
+# A device missing from the index triggers a full sync, at most once per
+# RESYNC_DELAY seconds
+RESYNC_DELAY = 60
+
+# Fields written by SVT.set
+WRITABLE_FIELDS = ('mode', 'state', 'pause', 'setpointNormal',
+                   'setpointEconomy')
+
+# Device and Domoticz field holding each writable field
+FIELD_DEVICES = {
+    'state': ('controlId', 'Level'),
+    'mode': ('modeId', 'Level'),
+    'pause': ('pauseId', 'Status'),
+    'setpointNormal': ('setpointNormalId', 'SetPoint'),
+    'setpointEconomy': ('setpointEconomyId', 'SetPoint')
+}
+
+# Order of the writes of SVT.apply: the setpoints are in place before the
+# thermostat is started, and it is resumed last. Pausing comes first.
+WRITE_ORDER = ('setpointNormal', 'setpointEconomy', 'state', 'mode', 'pause')
+
+# Results of SVT.apply, per field
+UNCHANGED = 'unchanged'
+WRITTEN = 'written'
+FAILED = 'failed'
+UNDONE = 'undone'
+SKIPPED = 'skipped'
+
+# Setpoint names accepted by SVT.shiftSetpoint
+SETPOINT_IDS = {
+    'normal': 'setpointNormalId',
+    'economy': 'setpointEconomyId'
+}
+
+# Domoticz API metrics, per verb
+API_CALLS = metrics.counter(
+    'domoticz_api_calls_total', 'Domoticz API calls')
+API_ERRORS = metrics.counter(
+    'domoticz_api_errors_total', 'Failed Domoticz API calls')
+API_LATENCY = metrics.histogram(
+    'domoticz_api_latency_seconds', 'Domoticz API call duration')
+API_RETRIES = metrics.counter(
+    'domoticz_api_retries_total', 'Domoticz API calls sent again')
+API_REJECTED = metrics.counter(
+    'domoticz_api_rejected_total',
+    'Domoticz API calls refused while the circuit was open')
+API_COALESCED = metrics.counter(
+    'domoticz_api_coalesced_total',
+    'Domoticz API reads served by an identical call in progress')
+
+# Verbs that change a device, they are never sent twice
+WRITE_VERBS = ('switchlight', 'setsetpoint')
+
+# Backoff bounds, in seconds, when discovery fails
+DISCOVERY_RETRY_MIN = 2
+DISCOVERY_RETRY_MAX = 300
+
+
+class DomoticzUnavailable(Exception):
+    """ Domoticz did not answer in time, or is known to be down. """
+
+
+def apiVerb(APICall):
+    """ Short name of an API call: 'switchlight', 'setsetpoint',
+        'devices&rid', 'devices', 'hardware'...
+    """
+    query = dict(item.partition('=')[::2] for item in APICall.split('&'))
+    if query.get('type') == 'command':
+        return query.get('param', 'command')
+    if query.get('type') == 'devices' and 'rid' in query:
+        return 'devices&rid'
+    return query.get('type', 'unknown')
+
+
+def apiReads(APICall, idx):
+    """ Whether the response of a read API call includes device idx: its
+        'rid' or 'idx' (timers, logs), or any device list.
+    """
+    query = dict(item.partition('=')[::2] for item in APICall.split('&'))
+    for param in ('rid', 'idx'):
+        if param in query:
+            return deviceIdx(query[param]) == idx
+    return query.get('type') == 'devices' or \
+        query.get('param') == 'getlightswitches'
+
+
+def deviceIdx(idx):
+    """ Normalize a device idx as found in the Domoticz json (int, "12" or
+        "12,13" for SVT probe lists) to the int used as snapshot key.
+    """
+    if idx is None:
+        return None
+    try:
+        return int(str(idx).split(',')[0])
+    except ValueError:
+        return None
+
+
+def parseDiscovery(switches, utilities, hardware, name='SVT'):
+    """ Build the idx map of the SVT hardware called name from the
+        getlightswitches, utility devices and hardware API results.
+    """
+    ids = dict.fromkeys(DISCOVERED_IDS)
+
+    # Looking for all SVT devices
+    for device in switches.get("result", []):  # parse the switch device
+        idx = int(device["idx"])
+        #logger.debug("Processing device {} {}".format(device["Name"], idx))
+        if "Name" in device:
+            if device["Name"] == name + " - Thermostat Control":
+                ids['controlId'] = idx
+                logger.debug(
+                    "{} - Thermostat Control idx: {}".format(name, idx))
+            elif device["Name"] == name + " - Thermostat Pause":
+                ids['pauseId'] = idx
+                logger.debug(
+                    "{} - Thermostat Pause idx: {}".format(name, idx))
+            elif device["Name"] == name + " - Thermostat Mode":
+                ids['modeId'] = idx
+                logger.debug(
+                    "{} - Thermostat Mode idx: {}".format(name, idx))
+
+    # Looking for SVT Setpoints
+    for device in utilities.get("result", []):  # parse the switch device
+        idx = int(device["idx"])
+        if "Name" in device:
+            if device["Name"] == name + " - Setpoint Normal":
+                ids['setpointNormalId'] = idx
+                logger.debug(
+                    "{} - Setpoint Normal idx: {}".format(name, idx))
+            elif device["Name"] == name + " - Setpoint Economy":
+                ids['setpointEconomyId'] = idx
+                logger.debug(
+                    "{} - Setpoint Economy idx: {}".format(name, idx))
+
+    # Looking for SVT hardware
+    for device in hardware.get("result", []):  # parse the switch device
+        if device["Name"] == name:
+            ids['indoorProbeId'] = device["Mode1"]
+            ids['outdoorProbeId'] = device["Mode2"]
+            ids['switchId'] = device["Mode3"]
+    return ids
+
+
+def indexDiscovery(index, hardware, name='SVT'):
+    """ Build the idx map of the SVT hardware called name from a device
+        index and the hardware API result. When devices are missing, e.g.
+        renamed ones, the index is read again in full first.
+
+        :return: the idx map, or None if Domoticz could not be queried.
+    """
+    def lookup():
+        ids = dict.fromkeys(DISCOVERED_IDS)
+        for key, suffix in DEVICE_NAMES.items():
+            ids[key] = index.find(name + suffix)
+        return ids
+
+    ids = lookup()
+    if None in (ids[key] for key in DEVICE_NAMES) and \
+            time.monotonic() - index.lastFull > RESYNC_DELAY:
+        if index.sync(full=True) is None:
+            return None
+        ids = lookup()
+    for key in DEVICE_NAMES:
+        logger.debug("{}{} idx: {}".format(name, DEVICE_NAMES[key], ids[key]))
+
+    for device in hardware.get("result", []):
+        if device["Name"] == name:
+            ids['indoorProbeId'] = device["Mode1"]
+            ids['outdoorProbeId'] = device["Mode2"]
+            ids['switchId'] = device["Mode3"]
+    return ids
+
+
+def loadDiscoveryCache(cacheFile, ip, port):
+    """ Return the {hardware name: idx map} saved for ip:port by a previous
+        run.
+    """
+    if not cacheFile:
+        return {}
+    try:
+        with open(cacheFile, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    zones = cache.get('{}:{}'.format(ip, port), {})
+    return {name: {key: ids.get(key) for key in DISCOVERED_IDS}
+            for name, ids in zones.items()}
+
+
+_cacheLock = threading.Lock()
+
+
+def saveDiscoveryCache(cacheFile, ip, port, zones):
+    """ Save the {hardware name: idx map} of ip:port for the next run, along
+        with those already saved.
+    """
+    if not cacheFile:
+        return
+    with _cacheLock:
+        try:
+            with open(cacheFile, encoding='utf-8') as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            cache = {}
+        key = '{}:{}'.format(ip, port)
+        cache.setdefault(key, {}).update(zones)
+        tmpFile = cacheFile + '.tmp'
+        try:
+            with open(tmpFile, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(tmpFile, cacheFile)
+        except (IOError, OSError) as e:
+            logger.error("Unable to save discovery cache: {}".format(e))
+
+
+def retryWithBackoff(attempt, background, what='SVT discovery'):
+    """ Call attempt() until it returns True, waiting longer after each
+        failure.
+
+        :param background: True to make every attempt on the thread
+                           handler, False to make the first one right now.
+        :return: a Job, whose cancel() stops the retries.
+    """
+    scheduler = ThreadHandler()
+    retries = Job(attempt, (), NORMAL)
+
+    def later(delay):
+        if retries.cancelled:
+            return
+        logger.warning("{} failed, retrying in {:.0f}s".format(what, delay))
+        scheduler.schedule(delay * random.uniform(0.8, 1.2), retry,
+                           (min(delay * 2, DISCOVERY_RETRY_MAX), ))
+
+    def retry(delay):
+        # delay is the wait before the next attempt if this one fails
+        if not retries.cancelled and not attempt():
+            later(delay)
+
+    if background:
+        scheduler.run(retry, (DISCOVERY_RETRY_MIN, ))
+    elif not attempt():
+        later(DISCOVERY_RETRY_MIN)
+    return retries
+
+
+def sameValue(a, b):
+    """ Compare a Domoticz field with a written value, "20.5" == 20.5. """
+    try:
+        return float(a) == float(b)
+    except (TypeError, ValueError):
+        return a == b
+
+
+class DeviceSnapshot:
+    """ Cached state of the tracked Domoticz devices.
+
+        Every tracked device is fetched in one bulk 'type=devices' call and
+        kept for ttl seconds. While a push feed (see DomoticzFeed) keeps the
+        devices up to date, the snapshot is not fetched again.
+
+        With a shared devices table, a single process fetches every device
+        each ttl seconds into the table and the other ones read it.
+    """
+
+    def __init__(self, api, ttl=2, select=None, serveStale=False,
+                 shared=None):
+        """ :param api: DomoticzClient.DomoticzAPI.
+            :param select: DomoticzClient.select, to keep only the tracked
+                           devices while the bulk response is parsed.
+            :param serveStale: once a snapshot was fetched, serve it even
+                               when expired, fetching the next one in the
+                               background.
+            :param shared: a SharedDeviceTable.
+        """
+        self.api = api
+        self.select = select
+        self.ttl = float(ttl)
+        self.serveStale = serveStale
+        self._revalidating = False
+        # The table is taken over once its owner was silent that long
+        self.shared = shared
+        self.sharedTimeout = max(3 * self.ttl, 5)
+        self._sharedSequence = None
+        self._sharedComplete = False
+        self._publisher = None
+        self._tracked = set()
+        self._devices = {}
+        self._time = None
+        # Monotonic time the last successful fetch was sent at
+        self._fetched = None
+        self._stale = False
+        self._invalidated = None
+        self._lock = threading.Lock()
+        # Concurrent fetches of the owner write the table one at a time
+        self._publishLock = threading.Lock()
+        # Called with the devices map after each change
+        self.listeners = []
+        # The feed is considered down when silent for feedTimeout seconds
+        self.feedTimeout = None
+        self._pushTime = None
+        # The first process to start owns the table, once fully built as
+        # its publisher starts right away
+        if shared is not None and shared.acquire():
+            self._publish()
+
+    def track(self, *idxs):
+        """ Add devices to the snapshot. """
+        for idx in idxs:
+            idx = deviceIdx(idx)
+            if idx is not None and idx not in self._tracked:
+                self._tracked.add(idx)
+                self._time = None
+                self._sharedSequence = None
+
+    def invalidate(self):
+        """ Make the next read fetch a fresh snapshot, unless the push feed
+            is live.
+        """
+        self._stale = True
+        self._invalidated = time.monotonic()
+
+    def feedAlive(self):
+        """ Whether the push feed sent something recently. """
+        return self.feedTimeout is not None and self._pushTime is not None \
+            and time.monotonic() - self._pushTime < self.feedTimeout
+
+    def heartbeat(self):
+        """ Record that the push feed is alive. """
+        self._pushTime = time.monotonic()
+
+    def push(self, idx, fields):
+        """ Update a device with fields received from the push feed. """
+        idx = deviceIdx(idx)
+        self.heartbeat()
+        if idx not in self._tracked:
+            return
+        with self._lock:
+            device = dict(self._devices.get(idx, {'idx': str(idx)}))
+            device.update(fields)
+            # Readers keep the map they got, a new one is built
+            devices = dict(self._devices)
+            devices[idx] = device
+            self._devices = devices
+        for listener in self.listeners:
+            listener(devices)
+
+    def get(self, fresh=False):
+        """ Return the {idx: device} map of the tracked devices.
+
+        :param fresh: fetch a new snapshot even if the cached one is still
+                      within its ttl. A snapshot fetched by another thread
+                      since the call, and not invalidated, is fresh enough.
+        """
+        asked = time.monotonic()
+        with self._lock:
+            if fresh and self._fetched is not None and \
+                    self._fetched >= asked and not self._stale:
+                fresh = False
+            if self.shared is not None and not fresh and self._readShared():
+                return self._devices
+            if not fresh and self._time is not None and (
+                    self.feedAlive() or not self._stale and
+                    time.monotonic() - self._time <= self.ttl):
+                return self._devices
+            if not fresh and self._time is not None and self.serveStale:
+                # Answered right away, never waiting for a fetch
+                if not self._revalidating:
+                    self._revalidating = True
+                    ThreadHandler().run(self._revalidate, priority=HIGH)
+                return self._devices
+        # Fetched without the lock, so that the readers served from the
+        # cached snapshot meanwhile do not wait
+        self._refresh()
+        return self._devices
+
+    def close(self):
+        """ Stop using the shared devices table, if any. """
+        # Reads in progress finish with the table
+        with self._lock:
+            shared, self.shared = self.shared, None
+        if self._publisher is not None:
+            self._publisher.cancel()
+        if shared is not None:
+            with self._publishLock:
+                shared.close()
+
+    def _publish(self):
+        # Owner of the table: fetch every device into it each ttl seconds
+        self._publisher = ThreadHandler().every(
+            max(self.ttl, 1), self.get, (True, ), HIGH, delay=0)
+
+    def _readShared(self):
+        # Serve the table written by the owner, unless it is stale. Return
+        # False to fetch the devices from Domoticz instead.
+        shared = self.shared
+        if shared.owner:
+            return False
+        if shared.age() > self.sharedTimeout:
+            if shared.acquire():
+                self._publish()
+            return False
+        if shared.sequence() == self._sharedSequence:
+            return self._sharedComplete
+        content = shared.read(self._tracked)
+        if content is None:
+            return False
+        devices, _, self._sharedSequence = content
+        # Devices left out of a full table are fetched from Domoticz
+        self._sharedComplete = self._tracked <= set(devices)
+        if not self._sharedComplete:
+            logger.debug("Devices {} not in the shared table".format(
+                sorted(self._tracked - set(devices))))
+            return False
+        self._devices = devices
+        self._time = time.monotonic()
+        self._stale = False
+        for listener in self.listeners:
+            listener(self._devices)
+        return True
+
+    def _revalidate(self):
+        try:
+            self._refresh()
+        finally:
+            self._revalidating = False
+
+    def device(self, idx, fresh=False):
+        """ Return the device dict of idx, or None. """
+        idx = deviceIdx(idx)
+        if idx is None:
+            return None
+        return self.get(fresh).get(idx)
+
+    def _refresh(self):
+        started = time.monotonic()
+        tracked = set(self._tracked)
+        shared = self.shared
+        owner = shared is not None and shared.owner
+        if owner and self.select is not None:
+            # Every device goes to the table, the other processes may
+            # track other ones
+            devicesAPI = self.select("type=devices&filter=all&used=true",
+                                     shared_state.FIELDS)
+        elif self.select is not None:
+            devicesAPI = self.select(
+                "type=devices&filter=all&used=true",
+                match=lambda device: deviceIdx(device.get("idx")) in tracked)
+        else:
+            devicesAPI = self.api("type=devices&filter=all&used=true")
+        if devicesAPI is None:
+            # Keep serving the previous snapshot, it will be fetched again
+            # on next read.
+            logger.error("Unable to refresh devices snapshot")
+            return
+        if owner:
+            with self._publishLock:
+                if shared.owner:
+                    shared.publish(devicesAPI.get("result", []))
+        devices = {}
+        for device in devicesAPI.get("result", []):
+            idx = deviceIdx(device.get("idx"))
+            if idx in tracked:
+                devices[idx] = device
+        with self._lock:
+            if self._fetched is not None and self._fetched > started:
+                # A fetch sent later already answered
+                return
+            self._devices = devices
+            self._time = time.monotonic()
+            self._fetched = started
+            # Still stale if invalidated while being fetched
+            self._stale = self._invalidated is not None and \
+                self._invalidated >= started
+        for listener in self.listeners:
+            listener(devices)
+
+
+class DomoticzClient:
+    """ Access to one Domoticz server: keep-alive connections,
+        authentication headers and devices snapshot, shared by every SVT
+        of that server.
+    """
+
+    _shared = {}
+    _sharedLock = threading.Lock()
+
+    def __init__(self, ip, port=8080, username=None, password=None,
+                 poolSize=4, idleTimeout=30, snapshotTTL=2, timeout=5,
+                 retries=2, breakerFailures=5, breakerReset=30,
+                 indexFullSync=24, serveStale=False, sharedState=False):
+        self.ip = ip
+        self.port = port
+        self.username = username
+
+        # Headers are built once per client
+        self._pool = ConnectionPool.shared(ip, port, poolSize, idleTimeout)
+        self._headers = {'Connection': 'keep-alive'}
+        if username:
+            credentials = ('%s:%s' % (username, password))
+            encoded_credentials = base64.b64encode(
+                credentials.encode('ascii'))
+            self._headers['Authorization'] = 'Basic %s' % \
+                encoded_credentials.decode("ascii")
+
+        # Every call is bounded by timeout seconds, and by the deadline of
+        # the intent being handled. Reads are retried, and calls are refused
+        # once Domoticz failed breakerFailures times in a row.
+        self.timeout = float(timeout) if timeout else None
+        self.retries = int(retries)
+        self.breaker = CircuitBreaker(breakerFailures, breakerReset)
+        # Identical reads sent at the same time share one request
+        self._flights = SingleFlight()
+
+        # Every property is served from a single bulk snapshot, fetched by
+        # one of the processes using that server with sharedState
+        shared = None
+        if sharedState and shared_state.available():
+            shared = shared_state.SharedDeviceTable(
+                shared_state.table_name(ip, port))
+        elif sharedState:
+            logger.warning("Shared devices state needs Python 3.8 on a "
+                           "POSIX system, not shared")
+        self.snapshot = DeviceSnapshot(self.DomoticzAPI, snapshotTTL,
+                                       self.select, serveStale, shared)
+        # Devices catalog, read in full every indexFullSync hours and
+        # incrementally in between
+        self.index = DeviceIndex(self.select, float(indexFullSync) * 3600)
+
+    @classmethod
+    def shared(cls, ip, port=8080, *args, **kwargs):
+        """ Return the client shared by every SVT of ip:port, creating it on
+            first use.
+        """
+        key = (ip, str(port))
+        with cls._sharedLock:
+            client = cls._shared.get(key)
+            if client is None:
+                client = cls(ip, port, *args, **kwargs)
+                cls._shared[key] = client
+            return client
+
+    @classmethod
+    def reset(cls, clients=None):
+        """ Forget the shared clients, so that the next SVT instances get new
+            ones, e.g. after a configuration change. The SVT instances
+            already built keep theirs until they are closed.
+
+            :param clients: the clients to share instead, as returned by a
+                            previous reset.
+            :return: the {(ip, port): client} map forgotten.
+        """
+        with cls._sharedLock:
+            forgotten, cls._shared = cls._shared, dict(clients or {})
+        # New pools pick up a changed pool size and idle timeout
+        ConnectionPool.reset()
+        return forgotten
+
+    def close(self):
+        """ Stop using the shared devices table and the idle connections. """
+        self.snapshot.close()
+        self._pool.close()
+
+    def DomoticzAPI(self, APICall):
+        """ Call the Domoticz JSON API.
+
+            :return: the decoded response, or None on failure.
+            :raise DomoticzUnavailable: when Domoticz cannot be reached while
+                                        a deadline is set, e.g. while handling
+                                        an intent.
+        """
+        verb = apiVerb(APICall)
+        path = "/json.htm?{}".format(parse.quote(APICall, safe="&="))
+        url = "http://{}:{}{}".format(self.ip, self.port, path)
+
+        if not self.breaker.allow():
+            API_REJECTED.inc({'verb': verb})
+            return self._unavailable(
+                "Domoticz {}:{} is down, '{}' not sent".format(
+                    self.ip, self.port, verb))
+
+        with profiler.phase('domoticz'):
+            if verb not in WRITE_VERBS:
+                return self._coalesce(
+                    verb, url, ('api', APICall),
+                    lambda: self._retry(verb, url, lambda timeout: self._call(
+                        verb, path, url, timeout)))
+            try:
+                return self._retry(verb, url, lambda timeout: self._call(
+                    verb, path, url, timeout))
+            finally:
+                # The reads in progress may return the previous value
+                idx = deviceIdx(dict(item.partition('=')[::2] for item in
+                                     APICall.split('&')).get('idx'))
+                self._flights.forget(lambda key: apiReads(key[1], idx))
+
+    def select(self, APICall, fields=None, match=None):
+        """ Call the Domoticz JSON API for a device list, keeping only what
+            is needed. The response is parsed while it is received: each
+            device is decoded on its own and dropped unless match accepts
+            it, so memory does not grow with the number of devices.
+
+            :param fields: the names of the fields to keep, all by default.
+            :param match: a function called with each device dict, True to
+                          keep it. All devices are kept by default.
+            :return: the response, e.g. {'status': 'OK', 'ActTime': ...,
+                     'result': [device, ...]}, or None on failure.
+            :raise DomoticzUnavailable: as DomoticzAPI.
+        """
+        verb = apiVerb(APICall)
+        path = "/json.htm?{}".format(parse.quote(APICall, safe="&="))
+        url = "http://{}:{}{}".format(self.ip, self.port, path)
+
+        if not self.breaker.allow():
+            API_REJECTED.inc({'verb': verb})
+            return self._unavailable(
+                "Domoticz {}:{} is down, '{}' not sent".format(
+                    self.ip, self.port, verb))
+        def call():
+            return self._retry(verb, url, lambda timeout: self._select(
+                verb, path, url, timeout, fields, match))
+
+        with profiler.phase('domoticz'):
+            if match is not None:
+                # Filters cannot be told apart
+                return call()
+            return self._coalesce(verb, url, ('select', APICall, tuple(
+                fields) if fields is not None else None), call)
+
+    def stream(self, APICall, key='result'):
+        """ Call the Domoticz JSON API and yield the objects of its key
+            array as they are received, for responses too large to be
+            decoded at once. Calls are not retried.
+
+            :raise DomoticzUnavailable: when the call fails.
+        """
+        verb = apiVerb(APICall)
+        path = "/json.htm?{}".format(parse.quote(APICall, safe="&="))
+        url = "http://{}:{}{}".format(self.ip, self.port, path)
+        if not self.breaker.allow():
+            API_REJECTED.inc({'verb': verb})
+            raise DomoticzUnavailable(
+                "Domoticz {}:{} is down, '{}' not sent".format(
+                    self.ip, self.port, verb))
+        try:
+            timeout = deadlines.timeout(self.timeout)
+        except DeadlineExceeded:
+            self.breaker.abort()
+            raise DomoticzUnavailable("No time left to call '{}'".format(url))
+        logger.debug("Streaming domoticz API: {}".format(url))
+
+        api_calls.add()
+        start = time.monotonic()
+        error = None
+        try:
+            for item in iter_array(self._pool.stream(
+                    'GET', path, self._headers, timeout), key):
+                yield item
+            self.breaker.success()
+        except (OSError, http.client.HTTPException) as e:
+            error = type(e).__name__
+            self.breaker.failure()
+            raise DomoticzUnavailable(
+                "Error streaming '{}': {}".format(url, e))
+        except ValueError as e:
+            error = type(e).__name__
+            raise DomoticzUnavailable(
+                "Error streaming '{}': {}".format(url, e))
+        finally:
+            # Also when the caller stops reading: no outcome for the breaker
+            self.breaker.abort()
+            API_LATENCY.observe(time.monotonic() - start, {'verb': verb})
+            API_CALLS.inc({'verb': verb})
+            if error is not None:
+                API_ERRORS.inc({'verb': verb, 'error': error})
+
+    def _coalesce(self, verb, url, key, call):
+        # Run call(), or wait for the identical one in progress
+        deadline = deadlines.current()
+        try:
+            result, shared = self._flights.do(
+                key, call, deadline.remaining() if deadline else None)
+        except TimeoutError:
+            return self._unavailable("No time left to call '{}'".format(url))
+        except DomoticzUnavailable as e:
+            # Raised with the deadline of the first caller
+            return self._unavailable(str(e))
+        finally:
+            self.breaker.abort()
+        if shared:
+            API_COALESCED.inc({'verb': verb})
+        return result
+
+    def _retry(self, verb, url, call):
+        # Run call(timeout), which returns the result and whether Domoticz
+        # failed to answer, retrying reads within the deadline.
+        try:
+            return self._attempt(verb, url, call)
+        finally:
+            # The trial call of the breaker may not have been sent
+            self.breaker.abort()
+
+    def _attempt(self, verb, url, call):
+        attempts = 1 if verb in WRITE_VERBS else 1 + self.retries
+        for attempt in range(attempts):
+            if attempt:
+                delay = backoff_delay(attempt - 1)
+                deadline = deadlines.current()
+                if deadline is not None and deadline.remaining() <= delay:
+                    break
+                time.sleep(delay)
+                # Other threads may have opened the circuit meanwhile
+                if not self.breaker.allow():
+                    API_REJECTED.inc({'verb': verb})
+                    return self._unavailable(
+                        "Domoticz {}:{} is down, '{}' not retried".format(
+                            self.ip, self.port, verb))
+                API_RETRIES.inc({'verb': verb})
+            try:
+                timeout = deadlines.timeout(self.timeout)
+            except DeadlineExceeded:
+                return self._unavailable(
+                    "No time left to call '{}'".format(url))
+            result, failed = call(timeout)
+            if not failed:
+                self.breaker.success()
+                return result
+            if self.breaker.failure():
+                logger.error("Domoticz {}:{} is down, calls are suspended "
+                             "for {:.0f}s".format(self.ip, self.port,
+                                                  self.breaker.reset_timeout))
+                break
+        return self._unavailable("Domoticz {}:{} did not answer '{}'".format(
+            self.ip, self.port, verb))
+
+    def _select(self, verb, path, url, timeout, fields, match):
+        # Streaming counterpart of _call
+        result = None
+        error = None
+        failed = False
+        logger.debug("Selecting from domoticz API: {}".format(url))
+
+        api_calls.add()
+        start = time.monotonic()
+        members = {}
+        try:
+            devices = []
+            for device in iter_array(self._pool.stream(
+                    'GET', path, self._headers, timeout), members=members):
+                if match is not None and not match(device):
+                    continue
+                if fields is not None:
+                    device = {field: device[field] for field in fields
+                              if field in device}
+                devices.append(device)
+            if members.get("status") == "OK":
+                result = dict(members, result=devices)
+            else:
+                logger.error("Domoticz API returned an error: status = {}".format(
+                    members.get("status")))
+                error = 'status'
+        except (OSError, http.client.HTTPException) as e:
+            logger.error("Error calling '{}': {}".format(url, e))
+            error = type(e).__name__
+            failed = True
+        except (ValueError, KeyError) as e:
+            logger.error("Error calling '{}': {}".format(url, e))
+            error = type(e).__name__
+        API_LATENCY.observe(time.monotonic() - start, {'verb': verb})
+        API_CALLS.inc({'verb': verb})
+        if error is not None:
+            API_ERRORS.inc({'verb': verb, 'error': error})
+        return result, failed
+
+    def _call(self, verb, path, url, timeout):
+        # Return the decoded response, or None, and whether Domoticz failed
+        # to answer at all.
+        resultJson = None
+        error = None
+        failed = False
+        logger.debug("Calling domoticz API: {}".format(url))
+
+        api_calls.add()
+        start = time.monotonic()
+        try:
+            status, body = self._pool.request(
+                'GET', path, self._headers, timeout)
+            if status == 200:
+                with profiler.phase('parse'):
+                    resultJson = json.loads(body.decode('utf-8'))
+                if resultJson["status"] != "OK":
+                    logger.error("Domoticz API returned an error: status = {}".format(
+                        resultJson["status"]))
+                    resultJson = None
+                    error = 'status'
+            else:
+                logger.error(
+                    "Domoticz API: http error = {}".format(status))
+                error = 'http'
+                failed = status >= 500
+        except (OSError, http.client.HTTPException) as e:
+            logger.error("Error calling '{}': {}".format(url, e))
+            error = type(e).__name__
+            failed = True
+        except (ValueError, KeyError) as e:
+            logger.error("Error calling '{}': {}".format(url, e))
+            error = type(e).__name__
+        API_LATENCY.observe(time.monotonic() - start, {'verb': verb})
+        API_CALLS.inc({'verb': verb})
+        if error is not None:
+            API_ERRORS.inc({'verb': verb, 'error': error})
+        return resultJson, failed
+
+    @staticmethod
+    def _unavailable(message):
+        logger.error(message)
+        # Intents fail fast with an explanation, other callers get None
+        if deadlines.current() is not None:
+            raise DomoticzUnavailable(message)
+        return None
+
+
 class SVT:
     'Common base class for SVT'
 
-    def __init__(self, ip, port=8080):
+    def __init__(self, ip, port=8080, username=None, password=None,
+                 poolSize=4, idleTimeout=30, snapshotTTL=2, cacheFile=None,
+                 reconcileTimeout=10, coalesceWindow=1.5, name='SVT',
+                 revalidate=True, timeout=5, retries=2, breakerFailures=5,
+                 breakerReset=30, indexFullSync=24, serveStale=False,
+                 sharedState=False):
         self.ip = ip
         self.port = port
+        self.name = name
         self.switchId = None
         self.indoorProbeId = None
         self.outdoorProbeId = None
         self.stateId = None
         self.modeId = None
         self.controlId = None
+        self.pauseId = None
         self.setpointNormalId = None
         self.setpointEconomyId = None
         self.indoorTempId = None
         self.outdoorTempId = None
-        self.username = None
-        self.password = None
+        self.username = username
+        self.password = password
 
-        # Looking for all SVT devices
-        devicesAPI = self.DomoticzAPI("type=command&param=getlightswitches")
-        if devicesAPI:
-            for device in devicesAPI["result"]:  # parse the switch device
-                idx = int(device["idx"])
-                #logger.debug("Processing device {} {}".format(device["Name"], idx))
-                if "Name" in device:
-                    if device["Name"] == "SVT - Thermostat Control":
-                        self.controlId = idx
-                        logger.debug(
-                            "SVT - Thermostat Control idx: {}".format(idx))
-                    elif device["Name"] == "SVT - Thermostat Pause":
-                        self.pauseId = idx
-                        logger.debug(
-                            "SVT - Thermostat Pause idx: {}".format(idx))
-                    elif device["Name"] == "SVT - Thermostat Mode":
-                        self.modeId = idx
-                        logger.debug(
-                            "SVT - Thermostat Mode idx: {}".format(idx))
-
-        # Looking for SVT Setpoints
-        devicesAPI = self.DomoticzAPI(
-            "type=devices&filter=utility&used=true&order=Name")
-        if devicesAPI:
-            for device in devicesAPI["result"]:  # parse the switch device
-                idx = int(device["idx"])
-                if "Name" in device:
-                    if device["Name"] == "SVT - Setpoint Normal":
-                        self.setpointNormalId = idx
-                        logger.debug(
-                            "SVT - Setpoint Normal idx: {}".format(idx))
-                    elif device["Name"] == "SVT - Setpoint Economy":
-                        self.setpointEconomyId = idx
-                        logger.debug(
-                            "SVT - Setpoint Economy idx: {}".format(idx))
-
-        # Looking for SVT hardware
-        devicesAPI = self.DomoticzAPI("type=hardware")
-        if devicesAPI:
-            for device in devicesAPI["result"]:  # parse the switch device
-                if device["Name"] == "SVT":
-                    self.indoorProbeId = device["Mode1"]
-                    self.outdoorProbeId = device["Mode2"]
-                    self.switchId = device["Mode3"]
+        # Connections and devices snapshot are shared by every SVT talking
+        # to the same Domoticz server.
+        self.client = DomoticzClient.shared(
+            ip, port, username, password, poolSize, idleTimeout, snapshotTTL,
+            timeout, retries, breakerFailures, breakerReset, indexFullSync,
+            serveStale, sharedState)
+        self._snapshot = self.client.snapshot
+
+        # Values written by this client: {idx: (field, value, deadline)}
+        self.reconcileTimeout = float(reconcileTimeout)
+        self._written = {}
+        self._writtenLock = threading.Lock()
+        self._snapshot.listeners.append(self._reconcile)
+
+        # Day/night timeline of the Mode device timers, see ModeSchedule
+        self.schedule = None
+
+        # Setpoint shifts waiting to be written: {idx: (target, job)}
+        self.coalesceWindow = float(coalesceWindow)
+        self._shifts = {}
+        self._shiftLock = threading.RLock()
+
+        # Start from the cached idx map when there is one and check it in
+        # the background, otherwise discover the devices right now.
+        # Without revalidate, discovery is left to the caller.
+        self.cacheFile = cacheFile
+        self.discovered = threading.Event()
+        ids = self.loadDiscoveryCache()
+        if ids is not None:
+            self.applyIds(ids)
+        if revalidate:
+            retryWithBackoff(self._revalidate, background=ids is not None)
+
+    def discover(self):
+        """ Look for the SVT devices in Domoticz.
+
+            :return: the idx map, or None if Domoticz could not be queried.
+        """
+        # Only the devices updated since the last discovery are fetched
+        if self.client.index.sync() is None:
+            return None
+        hardware = self.client.select(
+            "type=hardware", HARDWARE_FIELDS,
+            lambda device: device.get("Name") == self.name)
+        if hardware is None:
+            return None
+        return indexDiscovery(self.client.index, hardware, self.name)
+
+    def loadDiscoveryCache(self):
+        """ Return the idx map saved by a previous run, or None. """
+        return loadDiscoveryCache(
+            self.cacheFile, self.ip, self.port).get(self.name)
+
+    def saveDiscoveryCache(self, ids):
+        """ Save the idx map for the next run. """
+        saveDiscoveryCache(self.cacheFile, self.ip, self.port, {self.name: ids})
+
+    def applyIds(self, ids):
+        """ Use the devices of an idx map. """
+        for key in DISCOVERED_IDS:
+            setattr(self, key, ids.get(key))
+        self._snapshot.track(*[ids.get(key) for key in DISCOVERED_IDS])
+        self.discovered.set()
+
+    def _revalidate(self):
+        ids = self.discover()
+        if ids is None:
+            return False
+        if ids != {key: getattr(self, key) for key in DISCOVERED_IDS}:
+            logger.info("{} devices discovered: {}".format(self.name, ids))
+        self.applyIds(ids)
+        self.saveDiscoveryCache(ids)
+        return True
+
+    def snapshot(self, fresh=False):
+        """ Return the {idx: device} map of all SVT devices.
+
+        :param fresh: True to fetch it from Domoticz now, False to accept
+                      a cached snapshot younger than snapshotTTL.
+        """
+        return self._snapshot.get(fresh)
+
+    def refresh(self):
+        """ Fetch a fresh snapshot of all SVT devices. """
+        return self._snapshot.get(fresh=True)
+
+    def _device(self, idx):
+        return self._snapshot.device(idx)
+
+    def _command(self, APICall):
+        # A write makes the cached snapshot stale
+        devicesAPI = self.DomoticzAPI(APICall)
+        self._snapshot.invalidate()
+        return devicesAPI
+
+    def _read(self, idx, field):
+        # Values written by this client are served locally until Domoticz
+        # reports them back or reconcileTimeout expires.
+        idx = deviceIdx(idx)
+        with self._writtenLock:
+            written = self._written.get(idx)
+            if written is not None and written[0] == field:
+                if time.monotonic() < written[2]:
+                    return written[1]
+                del self._written[idx]
+        res = self._device(idx)
+        if res and field in res:
+            return res[field]
+
+    def _remember(self, idx, field, value):
+        with self._writtenLock:
+            self._written[deviceIdx(idx)] = (
+                field, value, time.monotonic() + self.reconcileTimeout)
+
+    def _reconcile(self, devices):
+        # Drop the written values that Domoticz now reports
+        with self._writtenLock:
+            for idx, (field, value, _) in list(self._written.items()):
+                device = devices.get(idx)
+                if device is not None and sameValue(device.get(field), value):
+                    del self._written[idx]
 
     @property
     def mode(self):
-        devicesAPI = self.DomoticzAPI(
-            "type=devices&rid={}".format(self.modeId))
-        if devicesAPI:
-            res = devicesAPI["result"][0]
-            if 'Level' in res:
-                level = res['Level']
-                self._mode = level
-                return Constants.mode[level]
+        level = self._read(self.modeId, 'Level')
+        if level is not None:
+            self._mode = level
+            if self.schedule is not None:
+                self.schedule.observe(level)
+            return Constants.mode[level]
 
     @mode.setter
     def mode(self, mode):
+        self._setMode(mode)
+
+    def _setMode(self, mode):
         inv_mode = {value: key for key, value in Constants.mode.items()}
         if type(mode) is str and mode in inv_mode:
-            devicesAPI = self.DomoticzAPI(
-                "type=command&param=switchlight&idx={}&switchcmd=Set Level&level={}"
-                .format(self.modeId, inv_mode[mode]))
-            if devicesAPI:
-                self._mode = inv_mode[mode]
-            else:
-                logger.error("mode not in {}".format(inv_mode.keys()))
-        elif type(mode) is int and mode in Constants.mode:
-            devicesAPI = self.DomoticzAPI(
+            mode = inv_mode[mode]
+        if type(mode) is int and mode in Constants.mode:
+            devicesAPI = self._command(
                 "type=command&param=switchlight&idx={}&switchcmd=Set Level&level={}"
                 .format(self.modeId, mode))
             if devicesAPI:
                 self._mode = mode
-            else:
-                logger.error("mode not in {}".format(Constants.mode.keys()))
+                self._remember(self.modeId, 'Level', mode)
+                if self.schedule is not None:
+                    self.schedule.observe(mode, written=True)
+            return devicesAPI is not None
+        logger.error("mode not in {}".format(inv_mode.keys()))
+        return False
 
     @property
     def state(self):
-        devicesAPI = self.DomoticzAPI(
-            "type=devices&rid={}".format(self.controlId))
-        if devicesAPI:
-            res = devicesAPI["result"][0]
-            if 'Level' in res:
-                level = res['Level']
-                self._mode = level
-                return Constants.control[level]
+        level = self._read(self.controlId, 'Level')
+        if level is not None:
+            self._state = level
+            return Constants.control[level]
 
     @state.setter
     def state(self, v):
+        self._setState(v)
+
+    def _setState(self, v):
         inv_control = {value: key for key, value in Constants.control.items()}
         if type(v) is str and v in inv_control:
-            devicesAPI = self.DomoticzAPI(
-                "type=command&param=switchlight&idx={}&switchcmd=Set Level&level={}"
-                .format(self.controlId, inv_control[v]))
-            if devicesAPI:
-                self._state = inv_control[v]
-            else:
-                logger.error("state not in {}".format(inv_control.keys()))
-        elif type(v) is int and v in Constants.control:
-            devicesAPI = self.DomoticzAPI(
+            v = inv_control[v]
+        if type(v) is int and v in Constants.control:
+            devicesAPI = self._command(
                 "type=command&param=switchlight&idx={}&switchcmd=Set Level&level={}"
                 .format(self.controlId, v))
             if devicesAPI:
                 self._state = v
-            else:
-                logger.error("state not in {}".format(
-                    Constants.control.keys()))
+                self._remember(self.controlId, 'Level', v)
+            return devicesAPI is not None
+        logger.error("state not in {}".format(inv_control.keys()))
+        return False
 
     @property
     def pause(self):
-        devicesAPI = self.DomoticzAPI(
-            "type=devices&rid={}".format(self.pauseId))
-        if devicesAPI:
-            res = devicesAPI["result"][0]
-            if "Status" in res:
-                inv = {value: key for key,
-                       value in Constants.switchState.items()}
-                status = res['Status']
-                self._pause = inv[status]
-                return self._pause > 0
+        status = self._read(self.pauseId, 'Status')
+        if status is not None:
+            inv = {value: key for key,
+                   value in Constants.switchState.items()}
+            self._pause = inv[status]
+            return self._pause > 0
 
     @pause.setter
     def pause(self, v):
+        self._setPause(v)
+
+    def _setPause(self, v):
         inv = {value: key for key, value in Constants.switchState.items()}
         if type(v) is bool:
-            if v is True:
-                devicesAPI = self.DomoticzAPI(
-                    "type=command&param=switchlight&idx={}&switchcmd={}"
-                    .format(self.pauseId, 'On'))
-            else:
-                devicesAPI = self.DomoticzAPI(
-                    "type=command&param=switchlight&idx={}&switchcmd={}"
-                    .format(self.pauseId, 'Off'))
-            if devicesAPI:
-                self._pause = v
-            else:
-                logger.error("Pause value not in {}".format(inv.keys()))
-
+            v = 'On' if v else 'Off'
         elif type(v) is int and v in Constants.switchState:
-            devicesAPI = self.DomoticzAPI(
-                "type=command&param=switchlight&idx={}&switchcmd={}"
-                .format(self.pauseId, inv[v]))
-            if devicesAPI:
-                self._pause = v
-            else:
-                logger.error("Pause value not in {}".format(inv.keys()))
-        elif type(v) is str and v in inv:
-            devicesAPI = self.DomoticzAPI(
+            v = Constants.switchState[v]
+        if type(v) is str and v in inv:
+            devicesAPI = self._command(
                 "type=command&param=switchlight&idx={}&switchcmd={}"
                 .format(self.pauseId, v))
             if devicesAPI:
                 self._pause = inv[v]
-            else:
-                logger.error("Pause value not in {}".format(inv.keys()))
+                self._remember(self.pauseId, 'Status', v)
+            return devicesAPI is not None
+        logger.error("Pause value not in {}".format(inv.keys()))
+        return False
 
     @property
     def indoorTemp(self):
-        devicesAPI = self.DomoticzAPI(
-            "type=devices&rid={}".format(self.indoorProbeId))
-        if devicesAPI:
-            res = devicesAPI["result"][0]
-            if 'Temp' in res:
-                self._indoorTemp = res['Temp']
-                return res['Temp']
+        temp = self._read(self.indoorProbeId, 'Temp')
+        if temp is not None:
+            self._indoorTemp = temp
+            return temp
 
     @property
     def outdoorTemp(self):
-        devicesAPI = self.DomoticzAPI(
-            "type=devices&rid={}".format(self.outdoorProbeId))
-        if devicesAPI:
-            res = devicesAPI["result"][0]
-            if 'Temp' in res:
-                return res['Temp']
+        return self._read(self.outdoorProbeId, 'Temp')
 
     @property
     def setpointNormal(self):
-        devicesAPI = self.DomoticzAPI(
-            "type=devices&rid={}".format(self.setpointNormalId))
-        if devicesAPI:
-            res = devicesAPI["result"][0]
-            if 'SetPoint' in res:
-                return res['SetPoint']
+        return self._read(self.setpointNormalId, 'SetPoint')
 
     @setpointNormal.setter
     def setpointNormal(self, v):
+        self._setSetpointNormal(v)
+
+    def _setSetpointNormal(self, v):
         logger.debug(v)
+        if isinstance(v, str):
+            # As read from Domoticz, e.g. when restoring a setpoint
+            v = float(v)
         if isinstance(v, int) or isinstance(v, float):
-            self.DomoticzAPI(
-                "type=command&param=setsetpoint&idx={}&setpoint={}".format(self.setpointNormalId, v))
+            self._cancelShift(self.setpointNormalId)
+            return self._setSetpoint(self.setpointNormalId, v)
+        return False
 
     @property
     def setpointEconomy(self):
-        devicesAPI = self.DomoticzAPI(
-            "type=devices&rid={}".format(self.setpointEconomyId))
-        if devicesAPI:
-            res = devicesAPI["result"][0]
-            if 'SetPoint' in res:
-                self._setpointEconomy = res['SetPoint']
-                return res['SetPoint']
+        setpoint = self._read(self.setpointEconomyId, 'SetPoint')
+        if setpoint is not None:
+            self._setpointEconomy = setpoint
+            return setpoint
 
     @setpointEconomy.setter
     def setpointEconomy(self, v):
+        self._setSetpointEconomy(v)
+
+    def _setSetpointEconomy(self, v):
+        if isinstance(v, str):
+            v = float(v)
         if isinstance(v, int) or isinstance(v, float):
-            self.DomoticzAPI(
-                "type=command&param=setsetpoint&idx={}&setpoint={}".format(self.setpointEconomyId, v))
+            self._cancelShift(self.setpointEconomyId)
+            return self._setSetpoint(self.setpointEconomyId, v)
+        return False
+
+    def plan(self, **fields):
+        """ Writes needed to bring the thermostat to an end state, known
+            values left out, in the order they must be made. Current values
+            are read from the snapshot, in one call at most.
+
+            :param fields: state, mode, pause, setpointNormal or
+                           setpointEconomy, None for no change.
+            :return: [(field, current value, target value)], values as
+                     Domoticz reports them: levels, 'On' or 'Off', °C.
+            :raise ValueError: for an unknown field or value.
+        """
+        changes = {}
+        for field, value in fields.items():
+            if value is None:
+                continue
+            target = self._normalize(field, value)
+            idAttr, deviceField = FIELD_DEVICES[field]
+            current = self._read(getattr(self, idAttr), deviceField)
+            if current is not None and sameValue(current, target):
+                continue
+            changes[field] = (current, target)
+        order = list(WRITE_ORDER)
+        if 'pause' in changes and changes['pause'][1] == 'On':
+            order.insert(0, order.pop(order.index('pause')))
+        return [(field,) + changes[field] for field in order
+                if field in changes]
+
+    def apply(self, **fields):
+        """ Bring the thermostat to an end state, e.g.
+            apply(state='automatique', mode='jour').
+
+            Only the values that differ from the known state are written,
+            in the order of plan(). When a write fails, the next ones are
+            not made and the ones already made are undone.
+
+            :return: the {field: result} map, result being UNCHANGED,
+                     WRITTEN, FAILED, UNDONE or SKIPPED.
+            :raise ValueError: for an unknown field or value.
+        """
+        changes = self.plan(**fields)
+        results = {field: UNCHANGED for field, value in fields.items()
+                   if value is not None}
+        done = []
+        for i, (field, current, target) in enumerate(changes):
+            try:
+                written = self.set(field, target)
+            except DomoticzUnavailable as e:
+                logger.error("Unable to set {}: {}".format(field, e))
+                written = False
+            if written:
+                results[field] = WRITTEN
+                done.append((field, current))
+                continue
+            results[field] = FAILED
+            for skipped, _, _ in changes[i + 1:]:
+                results[skipped] = SKIPPED
+            # Newest first, back to the state before the plan
+            for doneField, previous in reversed(done):
+                if previous is None:
+                    continue
+                try:
+                    if self.set(doneField,
+                                self._normalize(doneField, previous)):
+                        results[doneField] = UNDONE
+                except DomoticzUnavailable as e:
+                    logger.error("Unable to restore {}: {}".format(
+                        doneField, e))
+            break
+        return results
+
+    def _normalize(self, field, value):
+        # A value of a writable field as Domoticz reports it
+        if field in ('state', 'mode'):
+            names = Constants.control if field == 'state' else Constants.mode
+            levels = {name: level for level, name in names.items()}
+            if isinstance(value, str):
+                value = levels.get(value, int(value) if value.isdigit()
+                                   else None)
+            if value in names:
+                return value
+        elif field == 'pause':
+            if isinstance(value, bool) or value in Constants.switchState:
+                return Constants.switchState[int(value)]
+            if value in Constants.switchState.values():
+                return value
+        elif field in FIELD_DEVICES:
+            return round(float(value), 1)
+        raise ValueError("Invalid {} value {!r}".format(field, value))
+
+    def set(self, field, value):
+        """ Write a field as its property setter does, telling whether it
+            was written.
+
+            :param field: 'mode', 'state', 'pause', 'setpointNormal' or
+                          'setpointEconomy'.
+            :return: True if Domoticz accepted the value.
+            :raise DomoticzUnavailable: as DomoticzAPI.
+        """
+        if field not in WRITABLE_FIELDS:
+            raise ValueError("{} cannot be set".format(field))
+        return getattr(self, '_set' + field[0].upper() + field[1:])(value)
+
+    def _setSetpoint(self, idx, v):
+        devicesAPI = self._command(
+            "type=command&param=setsetpoint&idx={}&setpoint={}".format(idx, v))
+        if devicesAPI:
+            self._remember(idx, 'SetPoint', v)
+        return devicesAPI is not None
+
+    def shiftSetpoint(self, setpoint, delta, onError=None):
+        """ Shift the 'normal' or 'economy' setpoint by delta.
+
+            Shifts of the same setpoint received less than coalesceWindow
+            seconds apart are written to Domoticz once, as their cumulated
+            target.
+
+            :param setpoint: 'normal' or 'economy'.
+            :param delta: the shift in °C.
+            :param onError: called with the target if its write fails.
+            :return: the new setpoint, or None if the current one is unknown.
+        """
+        idx = deviceIdx(getattr(self, SETPOINT_IDS[setpoint]))
+        with self._shiftLock:
+            pending = self._shifts.pop(idx, None)
+            if pending is not None:
+                pending[1].cancel()
+                current = pending[0]
+            else:
+                current = self._read(idx, 'SetPoint')
+                if current is None:
+                    return None
+            target = round(float(current) + delta, 1)
+            if self.coalesceWindow <= 0:
+                self._flushShift(idx, target, onError)
+                return target
+            # Next reads see the target before it is written
+            self._remember(idx, 'SetPoint', target)
+            job = ThreadHandler().schedule(
+                self.coalesceWindow, self._flushShift, (idx, target, onError),
+                HIGH)
+            self._shifts[idx] = (target, job)
+        return target
+
+    def flush(self):
+        """ Write the pending setpoint shifts now. """
+        with self._shiftLock:
+            shifts, self._shifts = self._shifts, {}
+        for idx, (target, job) in shifts.items():
+            job.cancel()
+            self._flushShift(idx, target, None)
+
+    def _cancelShift(self, idx):
+        with self._shiftLock:
+            pending = self._shifts.pop(deviceIdx(idx), None)
+        if pending is not None:
+            pending[1].cancel()
+
+    def _flushShift(self, idx, target, onError):
+        with self._shiftLock:
+            pending = self._shifts.get(idx)
+            if pending is not None and pending[0] == target:
+                del self._shifts[idx]
+        devicesAPI = self._command(
+            "type=command&param=setsetpoint&idx={}&setpoint={}".format(idx, target))
+        with self._shiftLock:
+            # A newer shift already owns the value served to readers
+            superseded = idx in self._shifts
+        if devicesAPI is not None:
+            if not superseded:
+                self._remember(idx, 'SetPoint', target)
+            return
+        logger.error("Unable to set setpoint {} to {}".format(idx, target))
+        if not superseded:
+            with self._writtenLock:
+                self._written.pop(idx, None)
+        if onError is not None:
+            onError(target)
 
     @property
     def isOn(self):
-        devicesAPI = self.DomoticzAPI(
-            "type=devices&rid={}".format(self.switchId))
-        if devicesAPI:
-            res = devicesAPI["result"][0]
-            if 'Status' in res:
-                level = res['Status']
-                return level == 'On'
+        status = self._read(self.switchId, 'Status')
+        if status is not None:
+            return status == 'On'
 
     @property
     def isNight(self):
-        """ Whether the Mode is night mode
+        """ Whether the Mode is night mode, predicted by the schedule when
+            there is one.
 
             :rtype: bool
         """
+        if self.schedule is not None:
+            mode = self.schedule.current()
+            if mode is not None:
+                return mode == 'nuit'
         return self.mode == 'nuit'
 
     @property
@@ -304,40 +1394,17 @@ class SVT:
         """
         return not self.isNight
 
-    def getProbes(self):
+    def getProbes(self, fields=None):
+        """ Return the temperature sensors of Domoticz.
+
+            :param fields: the names of the fields to keep, e.g.
+                           ('idx', 'Name', 'Temp'), all by default.
+        """
         logger.debug("getProbes")
-        devicesAPI = self.DomoticzAPI(
-            "type=devices&filter=temp&used=true&order=ID")
+        devicesAPI = self.client.select(
+            "type=devices&filter=temp&used=true&order=ID", fields)
         if devicesAPI:
             return devicesAPI["result"]
 
     def DomoticzAPI(self, APICall):
-        resultJson = None
-        url = "http://{}:{}/json.htm?{}".format(
-            self.ip, self.port, parse.quote(APICall, safe="&="))
-        logger.debug("Calling domoticz API: {}".format(url))
-
-        try:
-            req = request.Request(url)
-            if self.username != "":
-                logger.debug(
-                    "Add authentification for user {}".format(self.username))
-                credentials = ('%s:%s' % (self.username, self.password))
-                encoded_credentials = base64.b64encode(
-                    credentials.encode('ascii'))
-                req.add_header('Authorization', 'Basic %s' %
-                               encoded_credentials.decode("ascii"))
-
-            response = request.urlopen(req)
-            if response.status == 200:
-                resultJson = json.loads(response.read().decode('utf-8'))
-                if resultJson["status"] != "OK":
-                    logger.error("Domoticz API returned an error: status = {}".format(
-                        resultJson["status"]))
-                    resultJson = None
-            else:
-                logger.error(
-                    "Domoticz API: http error = {}".format(response.status))
-        except:
-            logger.error("Error calling '{}'".format(url))
-        return resultJson
+        return self.client.DomoticzAPI(APICall)
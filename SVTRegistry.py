@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Registry of the SVT zones found on one or several Domoticz servers.
+# Every SVT hardware whose name starts with the configured prefix, or is
+# listed explicitly, becomes a zone. The zone of 'SVT Salon' is 'salon',
+# the zone of a hardware called just 'SVT' is the default zone ''.
+#
+# Import required Python libraries
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from SVT import SVT, DomoticzClient, DISCOVERED_IDS, HARDWARE_FIELDS, \
+    indexDiscovery, loadDiscoveryCache, saveDiscoveryCache, retryWithBackoff
+from snipshelpers.resilience import deadlines
+
+logger = logging.getLogger(__name__)
+
+# Key of the SVT python plugin, reported in the 'Extra' field of its hardware
+SVT_PLUGIN_KEY = 'SVT'
+
+
+def zoneName(hardwareName, prefix='SVT'):
+    """ Zone name of an SVT hardware: its name without prefix, lower case. """
+    name = hardwareName
+    if prefix and name.startswith(prefix):
+        name = name[len(prefix):]
+    return name.strip(' -_').lower()
+
+
+class SVTRegistry:
+    'Registry of SVT zones'
+
+    def __init__(self, hosts, prefix='SVT', names=None, cacheFile=None,
+                 fanout=8, **options):
+        """ Discover the SVT zones of every host.
+
+            :param hosts: list of dicts with the 'ip', 'port', 'username'
+                          and 'password' of each Domoticz server.
+            :param prefix: SVT hardware names start with this prefix.
+            :param names: explicit list of SVT hardware names.
+            :param cacheFile: discovery cache file shared by all hosts.
+            :param fanout: maximum number of zones driven concurrently.
+            :param options: other SVT parameters (poolSize, snapshotTTL...).
+        """
+        self.hosts = hosts
+        self.prefix = prefix
+        self.names = set(names or [])
+        self.cacheFile = cacheFile
+        self.options = options
+        self._zones = {}
+        # Called with the (zone name, SVT) of each zone added
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=fanout)
+        # Set once replaced, e.g. by a configuration reload
+        self.closed = False
+        self._retries = []
+
+        for host in hosts:
+            # Zones known from the cache are usable right away, the host is
+            # then discovered again in the background.
+            cached = loadDiscoveryCache(cacheFile, host['ip'], host['port'])
+            for name, ids in cached.items():
+                self._addZone(host, name, ids)
+            self._retries.append(retryWithBackoff(
+                lambda host=host: self._discoverHost(host),
+                background=bool(cached),
+                what='SVT discovery of {}'.format(host['ip'])))
+
+    def __len__(self):
+        return len(self._zones)
+
+    def zones(self):
+        """ Return the {zone name: SVT} map. """
+        return dict(self._zones)
+
+    def route(self, zone=None):
+        """ Return the SVT of a zone, or None if there is no such zone.
+
+            Without zone, return the default zone, or the only one.
+        """
+        zones = self._zones
+        if zone:
+            return zones.get(zoneName(zone, self.prefix))
+        if '' in zones:
+            return zones['']
+        if len(zones) == 1:
+            return next(iter(zones.values()))
+        return None
+
+    def each(self, function):
+        """ Call function(svt) on every zone concurrently.
+
+            :return: the {zone name: result} map.
+        """
+        zones = self._zones
+        # Every zone shares the deadline of the caller
+        deadline = deadlines.current()
+
+        def call(thermostat):
+            if deadline is None:
+                return function(thermostat)
+            deadlines.begin(deadline)
+            try:
+                return function(thermostat)
+            finally:
+                deadlines.end()
+
+        futures = {zone: self._executor.submit(call, thermostat)
+                   for zone, thermostat in zones.items()}
+        return {zone: future.result() for zone, future in futures.items()}
+
+    def rediscover(self):
+        """ Discover every host again, adding the new zones and updating the
+            devices of the known ones.
+        """
+        for host in self.hosts:
+            self._discoverHost(host)
+
+    def onZoneAdded(self, listener):
+        """ Call listener(zone name, SVT) for every zone: now for the known
+            ones, and for the next ones as soon as discovery finds them.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            zones = dict(self._zones)
+        for zone, thermostat in sorted(zones.items()):
+            listener(zone, thermostat)
+
+    def close(self):
+        """ Stop discovering, release the fan-out threads, and forget the
+            listeners.
+        """
+        with self._lock:
+            self.closed = True
+            self._listeners = []
+        for retries in self._retries:
+            retries.cancel()
+        self._executor.shutdown(wait=False)
+
+    def isSVT(self, hardware):
+        """ Whether a hardware of the Domoticz 'type=hardware' list is one of
+            the registered SVT.
+        """
+        name = hardware.get('Name', '')
+        if self.names:
+            return name in self.names
+        return hardware.get('Extra') == SVT_PLUGIN_KEY or \
+            name.startswith(self.prefix)
+
+    def _discoverHost(self, host):
+        # The hardware list and the device index are read once for all the
+        # zones of host
+        if self.closed:
+            # Done, as far as the retries are concerned
+            return True
+        client = DomoticzClient.shared(
+            host['ip'], host['port'], host.get('username'),
+            host.get('password'), self.options.get('poolSize', 4),
+            self.options.get('idleTimeout', 30),
+            self.options.get('snapshotTTL', 2),
+            self.options.get('timeout', 5), self.options.get('retries', 2),
+            self.options.get('breakerFailures', 5),
+            self.options.get('breakerReset', 30),
+            self.options.get('indexFullSync', 24),
+            self.options.get('serveStale', False),
+            self.options.get('sharedState', False))
+        hardware = client.select("type=hardware", HARDWARE_FIELDS + ('Extra',),
+                                 self.isSVT)
+        if hardware is None:
+            return False
+        # Only the devices updated since the last discovery are fetched
+        if client.index.sync() is None:
+            return False
+
+        zones = {}
+        for device in hardware.get("result", []):
+            name = device.get("Name", "")
+            ids = indexDiscovery(client.index, hardware, name)
+            if ids is None:
+                return False
+            zones[name] = ids
+        for name, ids in zones.items():
+            self._addZone(host, name, ids)
+        saveDiscoveryCache(self.cacheFile, host['ip'], host['port'], zones)
+        logger.info("SVT zones of {}: {}".format(
+            host['ip'], ', '.join(sorted(zones)) or 'none'))
+        return True
+
+    def _addZone(self, host, name, ids):
+        zone = zoneName(name, self.prefix)
+        listeners = []
+        with self._lock:
+            if self.closed:
+                return
+            thermostat = self._zones.get(zone)
+            if thermostat is None:
+                thermostat = SVT(
+                    host['ip'], host['port'], host.get('username'),
+                    host.get('password'), cacheFile=self.cacheFile,
+                    name=name, revalidate=False, **self.options)
+                # Readers get a new dict, never one being modified
+                zones = dict(self._zones)
+                zones[zone] = thermostat
+                self._zones = zones
+                listeners = list(self._listeners)
+        if ids != {key: getattr(thermostat, key) for key in DISCOVERED_IDS}:
+            thermostat.applyIds(ids)
+        for listener in listeners:
+            try:
+                listener(zone, thermostat)
+            except Exception:
+                logger.exception("Zone {} listener failed".format(zone))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Temperature history of an SVT zone: indoor and outdoor temperatures and
+# setpoints are sampled in the background into fixed size ring buffers, so
+# memory stays constant however long the action runs. Trends are computed
+# on the buffers with numpy, without calling Domoticz.
+#
+# Requires numpy: pip3 install numpy
+#
+# Import required Python libraries
+import logging
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from snipshelpers.thread_handler import ThreadHandler
+
+logger = logging.getLogger(__name__)
+
+# Sampled series: {name: SVT property}
+SERIES = {
+    'indoor': 'indoorTemp',
+    'outdoor': 'outdoorTemp',
+    'setpointNormal': 'setpointNormal',
+    'setpointEconomy': 'setpointEconomy'
+}
+
+
+class RingBuffer:
+    'Fixed size buffer of (timestamp, value) samples'
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._times = numpy.zeros(self.capacity, dtype=numpy.float64)
+        self._values = numpy.zeros(self.capacity, dtype=numpy.float32)
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp, value):
+        """ Add a sample, overwriting the oldest one when full. Samples are
+            expected in chronological order.
+        """
+        with self._lock:
+            self._times[self._next] = timestamp
+            self._values[self._next] = value
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def since(self, start=None):
+        """ Return the (times, values) arrays of the samples taken at or
+            after start, oldest first.
+        """
+        with self._lock:
+            if self._size < self.capacity:
+                times = self._times[:self._size].copy()
+                values = self._values[:self._size].copy()
+            else:
+                # Oldest sample is the next one to be overwritten
+                times = numpy.concatenate(
+                    (self._times[self._next:], self._times[:self._next]))
+                values = numpy.concatenate(
+                    (self._values[self._next:], self._values[:self._next]))
+        if start is not None:
+            first = numpy.searchsorted(times, start)
+            times, values = times[first:], values[first:]
+        return times, values
+
+
+class TemperatureHistory:
+    'Sampled temperatures and setpoints of an SVT zone'
+
+    def __init__(self, thermostat, interval=300, hours=48):
+        """ :param thermostat: the SVT to sample.
+            :param interval: seconds between two samples.
+            :param hours: hours of history kept.
+        """
+        self.thermostat = thermostat
+        self.interval = float(interval)
+        self.hours = float(hours)
+        self.series = {}
+        if numpy is not None:
+            capacity = max(2, int(self.hours * 3600 / self.interval))
+            self.series = {name: RingBuffer(capacity) for name in SERIES}
+        self._job = None
+
+    def start(self):
+        """ Sample periodically on the thread handler, starting now.
+
+            :return: False if numpy is not installed.
+        """
+        if numpy is None:
+            logger.warning("numpy is not installed, temperature history "
+                           "is disabled")
+            return False
+        self._job = ThreadHandler().every(self.interval, self.sample, delay=0)
+        return True
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+
+    def sample(self, timestamp=None):
+        """ Record the current values of the thermostat. """
+        timestamp = time.time() if timestamp is None else timestamp
+        for name, prop in SERIES.items():
+            value = getattr(self.thermostat, prop)
+            if value is None or name not in self.series:
+                continue
+            try:
+                self.series[name].append(timestamp, float(value))
+            except (TypeError, ValueError):
+                logger.debug("Ignoring {} value {!r}".format(name, value))
+
+    def window(self, name, hours):
+        """ Return the (times, values) samples of the last hours. """
+        if name not in self.series:
+            return (), ()
+        return self.series[name].since(time.time() - hours * 3600)
+
+    def latest(self, name):
+        """ Last sampled value, or None. """
+        _, values = self.window(name, self.hours)
+        if len(values):
+            return float(values[-1])
+
+    def minMax(self, name, hours=24):
+        """ Lowest and highest values of the last hours, or None. """
+        _, values = self.window(name, hours)
+        if len(values):
+            return float(values.min()), float(values.max())
+
+    def rate(self, name, hours=1):
+        """ Trend of the last hours in °C per hour, from a least squares
+            fit, or None with less than two samples.
+        """
+        times, values = self.window(name, hours)
+        if len(values) < 2:
+            return None
+        times = times - times.mean()
+        spread = numpy.dot(times, times)
+        if spread == 0:
+            return None
+        return float(numpy.dot(times, values - values.mean()) / spread * 3600)
+
+    def isWarmingUp(self, hours=1, threshold=0.1):
+        """ Whether the indoor temperature rises by more than threshold °C
+            per hour, or None when unknown.
+        """
+        rate = self.rate('indoor', hours)
+        if rate is not None:
+            return rate > threshold
@@ -6,18 +6,36 @@
 #
 #
 # Import required Python libraries
+import datetime
 import os
+import queue
+import signal
+import threading
+import time
 import logging
 import logging.config
 from hermes_python.hermes import Hermes
 from snipshelpers.config_parser import SnipsConfigParser
+from snipshelpers.config_watcher import ConfigWatcher
+from snipshelpers.intent_recorder import IntentRecorder
+from snipshelpers.thread_handler import ThreadHandler
+from snipshelpers.worker_pool import KeyedWorkerPool
+from snipshelpers.metrics import metrics, api_calls
+from snipshelpers.profiler import profiler
+from snipshelpers.resilience import deadlines
 
 # Fixing utf-8 issues when sending Snips intents in French with accents
 import sys
-from SVT import SVT
-from SVT import Constants
+from SVT import Constants, DomoticzClient, DomoticzUnavailable, FAILED, \
+    UNCHANGED, WRITTEN
+from DomoticzFeed import DomoticzFeed
+from SVTRegistry import SVTRegistry
+from TemperatureHistory import TemperatureHistory
+from HeatingModel import ModelLearner, preheat
+from ModeSchedule import ModeSchedule
 
 CONFIG_INI = "config.ini"
+DISCOVERY_CACHE = "svt_discovery.json"
 MQTT_IP_ADDR = "localhost"
 MQTT_PORT = 1883
 MQTT_ADDR = "{}:{}".format(MQTT_IP_ADDR, str(MQTT_PORT))
@@ -25,17 +43,68 @@ MQTT_ADDR = "{}:{}".format(MQTT_IP_ADDR, str(MQTT_PORT))
 THERMOSTATSHIFT = 'ericvde31830:thermostatShift'
 THERMOSTATTURNOFF = 'ericvde31830:thermostatTurnOff'
 THERMOSTATMODE = 'ericvde31830:thermostatMode'
+THERMOSTATTREND = 'ericvde31830:thermostatTrend'
+THERMOSTATWHEN = 'ericvde31830:thermostatWhen'
+THERMOSTATSCHEDULE = 'ericvde31830:thermostatSchedule'
+
+# Slot naming the thermostat zone, e.g. 'salon' for the 'SVT Salon' hardware
+ZONE_SLOT = 'house_room'
+
+# Seconds the MQTT callback waits for room in the intent queue
+SUBMIT_TIMEOUT = 2
+# Queue fill ratio above which saturation is reported
+QUEUE_HIGH_WATERMARK = 0.75
+
+# Seconds an intent may spend calling domoticz, across all its calls
+INTENT_DEADLINE = 5
+# Seconds given to running jobs to finish when the action stops
+SHUTDOWN_TIMEOUT = 5
+# Answer from the cached state and write to domoticz afterwards
+OPTIMISTIC = False
+
+# Intent metrics, per intent name
+INTENTS = metrics.counter('intents_total', 'Intents received')
+INTENT_REJECTED = metrics.counter(
+    'intents_rejected_total', 'Intents refused because the queue was full')
+INTENT_ERRORS = metrics.counter(
+    'intent_errors_total', 'Intent handlers that raised an exception')
+INTENT_LATENCY = metrics.histogram(
+    'intent_latency_seconds', 'Intent handling duration')
+INTENT_API_CALLS = metrics.histogram(
+    'intent_api_calls', 'Domoticz API calls made per intent',
+    (0, 1, 2, 3, 4, 5, 6, 8, 10, 15))
+INTENT_CORRECTIONS = metrics.counter(
+    'intent_corrections_total',
+    'Answers corrected because a write failed after they were spoken')
+
+# Field of each setpoint shifted by thermostat_shift
+SETPOINT_FIELDS = {
+    'normal': 'setpointNormal',
+    'economy': 'setpointEconomy'
+}
+
+# Week days, as spoken
+WEEKDAYS = ('lundi', 'mardi', 'mercredi', 'jeudi', 'vendredi', 'samedi',
+            'dimanche')
+
+# Field names, as spoken in corrections
+FIELD_NAMES = {
+    'mode': 'le mode',
+    'state': "l'état",
+    'pause': 'la pause',
+    'setpointNormal': 'la consigne de jour',
+    'setpointEconomy': 'la consigne de nuit'
+}
 
 # os.path.realpath returns the canonical path of the specified filename,
 # eliminating any symbolic links encountered in the path.
 path = os.path.dirname(os.path.realpath(sys.argv[0]))
 configPath = path + '/' + CONFIG_INI
 
-logging.config.fileConfig(configPath)
 logger = logging.getLogger(__name__)
 
 
-def open_thermostat(config):
+def open_registry(config):
     # Set my own lan domoticz server ip address as default
     ip = config.get(
         'global', {
@@ -46,162 +115,774 @@ def open_thermostat(config):
         'global', {
             "port": "8080"}).get(
         'port', '8080')
+    hosts = [{'ip': ip, 'port': port,
+              'username': config.get('secret', {}).get('username'),
+              'password': config.get('secret', {}).get('password')}]
+    # Other domoticz servers are described in [domoticz_<name>] sections
+    for section in sorted(config):
+        if section.startswith('domoticz_'):
+            hosts.append({'ip': config[section].get('ip_domoticz'),
+                          'port': config[section].get('port', '8080'),
+                          'username': config[section].get('username'),
+                          'password': config[section].get('password')})
+    # SVT hardware to look for, by name prefix or explicit names
+    prefix = config.get('global', {}).get('svt_prefix', 'SVT')
+    names = [name.strip() for name in config.get('global', {}).get(
+        'svt_names', '').split(',') if name.strip()]
+    # Keep-alive connection pool shared by every SVT instance
+    poolSize = int(config.get('global', {}).get('pool_size', 4))
+    idleTimeout = float(config.get('global', {}).get('pool_idle_timeout', 30))
+    # Devices state is fetched in one call and cached for snapshot_ttl seconds
+    snapshotTTL = float(config.get('global', {}).get('snapshot_ttl', 2))
+    # Devices idx found by discovery are kept for next start
+    cacheFile = os.path.join(path, config.get('global', {}).get(
+        'discovery_cache', DISCOVERY_CACHE))
+    # Written values are trusted until domoticz reports them back
+    reconcileTimeout = float(config.get('global', {}).get(
+        'reconcile_timeout', 10))
+    # Setpoint shifts closer than coalesce_window seconds are written once
+    coalesceWindow = float(config.get('global', {}).get(
+        'coalesce_window', 1.5))
+    # Each call waits at most api_timeout seconds, reads are retried
+    # api_retries times, and calls are refused for breaker_reset seconds
+    # after breaker_failures failures in a row.
+    timeout = float(config.get('global', {}).get('api_timeout', 5))
+    retries = int(config.get('global', {}).get('api_retries', 2))
+    breakerFailures = int(config.get('global', {}).get('breaker_failures', 5))
+    breakerReset = float(config.get('global', {}).get('breaker_reset', 30))
+    # Discovery only fetches the devices updated since the previous one,
+    # the whole devices list is read every index_full_sync hours.
+    indexFullSync = float(config.get('global', {}).get('index_full_sync', 24))
+    # Optimistic answers are computed from the snapshot even when expired,
+    # a new one being fetched in the background.
+    serveStale = optimistic(config)
+    # Action processes of the same host share the devices state, only one of
+    # them fetching it.
+    sharedState = config.get('global', {}).get(
+        'shared_state', 'false').lower() == 'true'
     # Initialize the all stuff
-    thermostat = SVT(ip, port)
-
-    logger.debug(" UrlBase domoticz:{}:{}".format(ip, port))
-    logger.debug(" Indoor Temperature:{}°C".format(thermostat.indoorTemp))
-    logger.debug(" Outdoor Temperature:{}°C".format(thermostat.outdoorTemp))
-    logger.debug(" Thermostat Mode:{}".format(thermostat.mode))
-    logger.debug(" Thermostat Pause:{}".format(thermostat.pause))
-    logger.debug(" Thermostat State:{}".format(thermostat.state))
-    logger.debug(" setpoint Day:  {}°C".format(thermostat.setpointNormal))
-    logger.debug(" setpoint Night:{}°C".format(thermostat.setpointEconomy))
+    registry = SVTRegistry(hosts, prefix, names, cacheFile,
+                           poolSize=poolSize, idleTimeout=idleTimeout,
+                           snapshotTTL=snapshotTTL,
+                           reconcileTimeout=reconcileTimeout,
+                           coalesceWindow=coalesceWindow,
+                           timeout=timeout, retries=retries,
+                           breakerFailures=breakerFailures,
+                           breakerReset=breakerReset,
+                           indexFullSync=indexFullSync,
+                           serveStale=serveStale,
+                           sharedState=sharedState)
+
+    # Only what discovery found: reading the devices here would hold the
+    # start while domoticz does not answer
+    for zone, thermostat in sorted(registry.zones().items()):
+        logger.debug(" Zone '{}' UrlBase domoticz:{}:{}".format(
+            zone, thermostat.ip, thermostat.port))
+        logger.debug(" Thermostat Mode idx:{} Control idx:{} Pause idx:{}".format(
+            thermostat.modeId, thermostat.controlId, thermostat.pauseId))
+        logger.debug(" setpoint Day idx:{} Night idx:{}".format(
+            thermostat.setpointNormalId, thermostat.setpointEconomyId))
+    return registry
+
+
+def open_feed(config, registry):
+    """ Devices state pushed by domoticz on the MQTT broker replaces polling.
+
+        :return: the started DomoticzFeed, or None.
+    """
+    if config.get('global', {}).get('mqtt_sync', 'false').lower() != 'true':
+        return None
+    feed = DomoticzFeed(MQTT_IP_ADDR, MQTT_PORT,
+                        config['global'].get('mqtt_topic', 'domoticz/out'),
+                        float(config['global'].get('mqtt_quiet', 120)))
+    # The local broker carries the devices of the primary domoticz server
+    # only, the other servers keep polling.
+    primary = registry.hosts[0]
+    attached = set()
+
+    def added(zone, thermostat):
+        snapshot = thermostat.client.snapshot
+        if (thermostat.ip, str(thermostat.port)) == \
+                (primary['ip'], str(primary['port'])) and \
+                id(snapshot) not in attached:
+            attached.add(id(snapshot))
+            feed.attach(snapshot)
+
+    registry.onZoneAdded(added)
+    feed.start()
+    return feed
+
+
+def open_histories(config, registry):
+    """ Sample the temperatures of every zone, including the ones found
+        later, every history_interval seconds (0 disables it), into the
+        histories dict.
+    """
+    interval = float(config.get('global', {}).get('history_interval', 300))
+    hours = float(config.get('global', {}).get('history_hours', 48))
+    if interval <= 0:
+        return
+
+    def added(zone, thermostat):
+        history = TemperatureHistory(thermostat, interval, hours)
+        if history.start():
+            histories[thermostat] = history
+
+    registry.onZoneAdded(added)
+
+
+def open_schedules(config, registry):
+    """ Read the day/night timers of every zone, including the ones found
+        later, in the background, and again every schedule_refresh hours
+        (0 disables it), into the schedules dict.
+    """
+    refresh = float(config.get('global', {}).get('schedule_refresh', 24))
+    if refresh <= 0:
+        return
+
+    def added(zone, thermostat):
+        schedule = ModeSchedule(thermostat, refresh)
+        schedule.start()
+        schedules[thermostat] = schedule
+
+    registry.onZoneAdded(added)
+
+
+def open_models(config, registry):
+    """ Learn the heating model of every zone from the domoticz logs, in
+        the background, and again every heating_model_refresh hours
+        (0 disables it). Models are stored in the models dict.
+
+        :return: the started ModelLearner, or None.
+    """
+    refresh = float(config.get('global', {}).get('heating_model_refresh', 24))
+    graphRange = config.get('global', {}).get('heating_model_range', 'day')
+    if refresh <= 0:
+        return None
+    learner = ModelLearner(registry, models, refresh, graphRange)
+    learner.start()
+    return learner
+
+
+def apply_config(config):
+    """ Build the zones described by config and swap them in.
+
+        Everything is built while the current zones keep serving intents.
+        Routing switches to the new zones with a single assignment of
+        registry; intents already running finish with the old ones.
+    """
+    global registry, feed, learner, discovery, recorder, INTENT_DEADLINE, \
+        OPTIMISTIC
+    # New clients pick up changed addresses, credentials and options, the
+    # current zones keep theirs until the swap is over.
+    oldClients = DomoticzClient.reset()
+    newRegistry = newDiscovery = newFeed = newLearner = None
+    try:
+        newRegistry = open_registry(config)
+        # New zones and changed devices are looked for every
+        # discovery_refresh hours (0 disables it)
+        refresh = float(config.get('global', {}).get('discovery_refresh', 1))
+        newDiscovery = ThreadHandler().every(
+            refresh * 3600, newRegistry.rediscover) if refresh > 0 else None
+        # Histories and schedules of the new zones join the ones of the
+        # current zones, lookups are by thermostat
+        newFeed = open_feed(config, newRegistry)
+        open_histories(config, newRegistry)
+        open_schedules(config, newRegistry)
+        newLearner = open_models(config, newRegistry)
+        deadline = float(config.get('global', {}).get(
+            'intent_deadline', INTENT_DEADLINE))
+    except Exception as e:
+        logger.error("Configuration not applied, keeping the current one: "
+                     "{}".format(e))
+        stop_zones(newRegistry, newDiscovery, newFeed, newLearner)
+        for client in DomoticzClient.reset(oldClients).values():
+            client.close()
+        return False
+    INTENT_DEADLINE = deadline
+    OPTIMISTIC = optimistic(config)
+    configure_profiler(config)
+    # Intents received are appended to intent_capture, for tests/replay.py
+    capture = config.get('global', {}).get('intent_capture')
+    capture = os.path.join(path, capture) if capture else None
+    if capture != (recorder.path if recorder else None):
+        oldRecorder = recorder
+        recorder = IntentRecorder(capture) if capture else None
+        if oldRecorder is not None:
+            oldRecorder.close()
+
+    oldRegistry, oldFeed, oldLearner = registry, feed, learner
+    oldDiscovery = discovery
+    registry, feed, learner = newRegistry, newFeed, newLearner
+    discovery = newDiscovery
+
+    stop_zones(oldRegistry, oldDiscovery, oldFeed, oldLearner)
+    # Shared devices tables and idle connections of the old zones
+    for client in oldClients.values():
+        client.close()
+    return True
+
+
+def stop_zones(registry, discovery, feed, learner):
+    """ Stop the jobs of zones no longer routed to. """
+    if feed is not None:
+        feed.stop()
+    if learner is not None:
+        learner.stop()
+    if discovery is not None:
+        discovery.cancel()
+    if registry is not None:
+        # No zone is added to the histories and schedules from now on
+        registry.close()
+        for thermostat in registry.zones().values():
+            history = histories.pop(thermostat, None)
+            if history is not None:
+                history.stop()
+            schedule = schedules.pop(thermostat, None)
+            if schedule is not None:
+                schedule.stop()
+            models.pop(thermostat, None)
+
+
+def reload_config(config):
+    """ Apply a changed config.ini, in the config watcher thread. """
+    try:
+        logging.config.fileConfig(configPath, disable_existing_loggers=False)
+    except (KeyError, ValueError, RuntimeError) as e:
+        logger.error("Invalid logging configuration: {}".format(e))
+    if apply_config(config):
+        logger.info('Thermostat configuration reloaded')
+
+
+def configure_profiler(config):
+    """ Time the phases of every intent while profile_sample_rate is
+        positive, and profile that fraction of them into profile_dir.
+        SIGUSR2 switches profiling on and off.
+    """
+    directory = config.get('global', {}).get('profile_dir', 'profiles')
+    profiler.configure(
+        os.path.join(path, directory) if directory else None,
+        float(config.get('global', {}).get('profile_sample_rate', 0)),
+        int(config.get('global', {}).get('profile_slowest', 10)),
+        int(config.get('global', {}).get('profile_keep', 20)),
+        config.get('global', {}).get(
+            'profile_memory', 'true').lower() == 'true')
+
+
+def optimistic(config):
+    """ Whether intents are answered before domoticz is written to. """
+    return config.get('global', {}).get(
+        'optimistic_response', 'false').lower() == 'true'
+
+
+def spoken(value):
+    """ A temperature as said in French: 20.46 -> '20,5'. """
+    return str(round(value, 1)).replace('.', ',')
+
+
+def spoken_time(when):
+    """ An epoch time as said in French: 'demain à 7 heures 30'. """
+    moment = time.localtime(when)
+    days = (datetime.date.fromtimestamp(when) - datetime.date.today()).days
+    if days == 0:
+        day = "aujourd'hui"
+    elif days == 1:
+        day = 'demain'
+    else:
+        day = WEEKDAYS[moment.tm_wday]
+    return "{} à {} heures {:02d}".format(day, moment.tm_hour, moment.tm_min)
+
+
+def slot_time(slot):
+    """ Epoch time of a snips/datetime slot value, e.g.
+        '2019-01-20 22:00:00 +01:00', or None.
+    """
+    try:
+        return time.mktime(time.strptime(str(slot)[:19], '%Y-%m-%d %H:%M:%S'))
+    except (ValueError, OverflowError):
+        return None
+
+
+def zone_of(intent_message):
+    """ Zone named in the intent, or None. """
+    slot = getattr(intent_message.slots, ZONE_SLOT, None)
+    if slot:
+        return slot.first().value
+
+
+def route(hermes, intent_message):
+    """ Return the thermostat of the intent zone, or end the session when
+        there is none.
+    """
+    zone = zone_of(intent_message)
+    thermostat = registry.route(zone) if registry else None
+    if thermostat is None:
+        if zone:
+            sentence = "Désolée, je ne connais pas de thermostat {}.".format(zone)
+        else:
+            sentence = "Désolée, je ne sais pas de quel thermostat tu parles."
+        hermes.publish_end_session(intent_message.session_id, sentence)
     return thermostat
 
 
-def intent_received(hermes, intent_message):
-    intentName = intent_message.intent.intent_name
+# Changes of the intent handled by the current thread, made once it has
+# been answered when OPTIMISTIC: {thermostat: {field: value}}
+deferred = threading.local()
+
+
+def change(thermostat, plans=None, **fields):
+    """ Bring a thermostat to an end state (see SVT.apply) now or, when
+        answering optimistically, once the answer has been spoken.
+
+        :param plans: the deferred changes of the intent, when called from
+                      another thread, e.g. by registry.each.
+        :return: the {field: result} map, deferred writes being WRITTEN.
+        :raise DomoticzUnavailable: when a write failed.
+    """
+    if plans is None:
+        plans = getattr(deferred, 'plans', None)
+    if plans is None:
+        results = thermostat.apply(**fields)
+        failed = [field for field, result in results.items()
+                  if result == FAILED]
+        if failed:
+            raise DomoticzUnavailable("Unable to set {}".format(
+                ', '.join(failed)))
+        return results
+    writes = [field for field, _, _ in thermostat.plan(**fields)]
+    plans.setdefault(thermostat, {}).update(fields)
+    return {field: WRITTEN if field in writes else UNCHANGED
+            for field in fields}
+
+
+def shift(hermes, intent_message, thermostat, setpoint, delta):
+    """ Shift a setpoint, correcting the answer if its delayed write fails. """
+    field = SETPOINT_FIELDS[setpoint]
+    return thermostat.shiftSetpoint(
+        setpoint, delta,
+        onError=lambda target: correct(hermes, intent_message, field))
+
+
+def shifted(hermes, intent_message, thermostat, setpoint, delta, sentence):
+    """ Shift a setpoint and return sentence with its new value, or an
+        apology if the current setpoint is unknown.
+    """
+    target = shift(hermes, intent_message, thermostat, setpoint, delta)
+    if target is None:
+        return "Désolée, je ne connais pas {} du thermostat.".format(
+            FIELD_NAMES[SETPOINT_FIELDS[setpoint]])
+    return sentence.format(str(target).replace('.', ','))
+
+
+def correct(hermes, intent_message, field):
+    """ Tell the user that a change already announced was not made. """
+    INTENT_CORRECTIONS.inc({'intent': intent_message.intent.intent_name})
+    sentence = "Désolée, domoticz n'a pas pu changer {} du thermostat.".format(
+        FIELD_NAMES[field])
+    logger.warning(sentence)
+    hermes.publish_start_session_notification(
+        intent_message.site_id, sentence, None)
+
+
+def apply_plans(hermes, intent_message, plans):
+    """ Make the changes deferred by an optimistic answer, telling the user
+        about those that failed, and were undone.
+
+        :return: True if every change was made.
+    """
+    done = True
+    for thermostat, fields in plans.items():
+        results = thermostat.apply(**fields)
+        failed = [field for field, result in results.items()
+                  if result == FAILED]
+        if failed:
+            correct(hermes, intent_message, failed[0])
+            done = False
+    return done
+
+
+def thermostat_mode(hermes, intent_message):
     sentence = 'Voilà c\'est fait.'
-    logger.debug(intentName)
-
-    for (slot_value, slot) in intent_message.slots.items():
-        logger.debug('Slot {} -> \n\tRaw: {} \tValue: {}'
-                     .format(slot_value, slot[0].raw_value, slot[0].slot_value.value.value))
-
-    if intentName == THERMOSTATMODE:
-        logger.debug("Change thermostat mode")
-        if intent_message.slots.thermostat_mode:
-            tmode = intent_message.slots.thermostat_mode.first().value
-            logger.debug(
-                "Je dois passer le thermostat en mode {}".format(tmode))
-            sentence = "OK, je passe le thermostat en mode {}".format(tmode)
-
-            # Invert Thermostat.mode dict first
-            inv_mode = {value: key for key,
-                        value in Constants.mode.items()}
-            inv_control = {value: key for key,
-                           value in Constants.control.items()}
-
-            if tmode in inv_mode:
-                # mode is 'jour' or 'nuit'
-                if thermostat.state != 'automatique':
-                    thermostat.state = 'automatique'
-                logger.debug(inv_mode)
-                thermostat.mode = inv_mode[tmode]
-            elif tmode in inv_control:
-                # 'automatique' or 'forcé' or 'stop'
-                logger.debug(inv_control)
-                thermostat.state = tmode
-            else:
-                sentence = 'Désolée mais je ne connais pas le mode {}'.format(
-                    tmode)
-
-            hermes.publish_end_session(intent_message.session_id, sentence)
+    logger.debug("Change thermostat mode")
+    if intent_message.slots.thermostat_mode:
+        thermostat = route(hermes, intent_message)
+        if thermostat is None:
             return
-
-    if intentName == THERMOSTATTURNOFF:
-        logger.debug("Thermostat turnOff")
-        if intent_message.slots.temperature_device:
-            thermostat.state = 'stop'  # Turn economy mode on
+        tmode = intent_message.slots.thermostat_mode.first().value
+        logger.debug(
+            "Je dois passer le thermostat en mode {}".format(tmode))
+        sentence = "OK, je passe le thermostat en mode {}".format(tmode)
+
+        # Invert Thermostat.mode dict first
+        inv_mode = {value: key for key,
+                    value in Constants.mode.items()}
+        inv_control = {value: key for key,
+                       value in Constants.control.items()}
+
+        if tmode in inv_mode:
+            # mode is 'jour' or 'nuit'
+            logger.debug(inv_mode)
+            results = change(thermostat, state='automatique', mode=tmode)
+        elif tmode in inv_control:
+            # 'automatique' or 'forcé' or 'stop'
+            logger.debug(inv_control)
+            results = change(thermostat, state=tmode)
+        else:
+            results = None
+            sentence = 'Désolée mais je ne connais pas le mode {}'.format(
+                tmode)
+        if results and all(result == UNCHANGED
+                            for result in results.values()):
+            sentence = "Le thermostat est déjà en mode {}.".format(tmode)
+
+        hermes.publish_end_session(intent_message.session_id, sentence)
+
+
+def thermostat_turn_off(hermes, intent_message):
+    logger.debug("Thermostat turnOff")
+    if intent_message.slots.temperature_device:
+        if zone_of(intent_message) is None and registry and len(registry) > 1:
+            # Every zone is turned off at once
+            plans = getattr(deferred, 'plans', None)
+            registry.each(
+                lambda thermostat: change(thermostat, plans, state='stop'))
+            sentence = "Ok, je coupe tous les thermostats."
+        else:
+            thermostat = route(hermes, intent_message)
+            if thermostat is None:
+                return
+            change(thermostat, state='stop')  # Turn economy mode on
             sentence = "Ok, je coupe le thermostat."
-            logger.debug(sentence)
-            hermes.publish_end_session(intent_message.session_id, sentence)
-            return
+        logger.debug(sentence)
+        hermes.publish_end_session(intent_message.session_id, sentence)
 
-    if intentName == THERMOSTATSHIFT:
-        if intent_message.slots.up_down:
-            up_down = intent_message.slots.up_down.first().value
-            action = up_down
-
-            if action is not None:
-
-                setPoint = None
-                mode = thermostat.mode
-                state = thermostat.state
-                logger.debug("statut: {}, Mode: {}, Action: {}".format(
-                    state, mode, action
-                ))
-
-                if mode == 'Off':
-                    sentence = "Désolée mais nous sommes en mode {}. Je ne fais rien dans ce cas.".format(
-                        mode)
-                elif action == 'down':
-                    if state == 'forcé' or state == 'stop':
-                        thermostat.state = 'automatique'
-
-                    elif mode == 'jour':
-                        # Need to use the setpoint variable, because domotics takes
-                        # a while to update its setpoint
-                        setpoint = round(
-                            float(thermostat.setpointNormal) - 0.1, 1)
-                        thermostat.setpointNormal = setpoint
-                        setPoint = str(setpoint).replace('.', ',')
-                        sentence = "Nous sommes en mode {}, je descends donc la consigne de jour à {} degrés.".format(
-                            mode, setPoint)
-                    else:
-                        # Need to use the setpoint variable, because domotics takes
-                        # a while to update its setpoint
-                        setpoint = round(
-                            float(thermostat.setpointEconomy) - 0.1, 1)
-                        thermostat.setpointEconomy = setpoint
-                        setPoint = str(setpoint).replace('.', ',')
-                        sentence = "Nous sommes en mode {}, je descends donc la consigne de nuit à {} degrés.".format(
-                            mode, setPoint)
-
-                elif action == "up":
-                    if state == 'stop':
-                        thermostat.state = 'automatique'
-                        sentence = "Le thermostat est arrêté, je le passe donc en mode automatique."
-
-                    elif 'jour' in mode:
-                        # Need to use the setpoint variable, because domotics takes
-                        # a while to update its setpoint
-                        setpoint = round(
-                            float(thermostat.setpointNormal) + 0.1, 1)
-                        thermostat.setpointNormal = setpoint
-                        setPoint = str(
-                            setpoint).replace('.', ',')
-                        sentence = "Nous sommes en mode {}, je monte la consigne de jour à {} degrés.".format(
-                            mode, setPoint)
-                    else:
-                        if thermostat.state == 'automatique' and mode == 'nuit':
-                            sentence = "Nous sommes en mode économique, je passe donc en mode forcé".format(
-                                mode)
-                            thermostat.state = 'forcé'
-
-                    logger.debug("After action-> state: {} , mode: {}".format(
-                        thermostat.state, thermostat.mode))
 
+def thermostat_shift(hermes, intent_message):
+    sentence = 'Voilà c\'est fait.'
+    if intent_message.slots.up_down:
+        up_down = intent_message.slots.up_down.first().value
+        action = up_down
+
+        if action is not None:
+            thermostat = route(hermes, intent_message)
+            if thermostat is None:
+                return
+
+            mode = thermostat.mode
+            state = thermostat.state
+            logger.debug("statut: {}, Mode: {}, Action: {}".format(
+                state, mode, action
+            ))
+
+            if mode == 'Off':
+                sentence = "Désolée mais nous sommes en mode {}. Je ne fais rien dans ce cas.".format(
+                    mode)
+            elif action == 'down':
+                if state == 'forcé' or state == 'stop':
+                    change(thermostat, state='automatique')
+
+                elif mode == 'jour':
+                    # Consecutive shifts are written once to domoticz,
+                    # the cumulated setpoint is returned right away
+                    sentence = shifted(
+                        hermes, intent_message, thermostat, 'normal', -0.1,
+                        "Nous sommes en mode " + mode + ", je descends donc la consigne de jour à {} degrés.")
                 else:
-                    sentence = "Je n'ai pas compris s'il fait froid ou s'il fait chaud."
+                    sentence = shifted(
+                        hermes, intent_message, thermostat, 'economy', -0.1,
+                        "Nous sommes en mode " + mode + ", je descends donc la consigne de nuit à {} degrés.")
+
+            elif action == "up":
+                if state == 'stop':
+                    change(thermostat, state='automatique')
+                    sentence = "Le thermostat est arrêté, je le passe donc en mode automatique."
+
+                elif 'jour' in mode:
+                    sentence = shifted(
+                        hermes, intent_message, thermostat, 'normal', 0.1,
+                        "Nous sommes en mode " + mode + ", je monte la consigne de jour à {} degrés.")
+                else:
+                    if thermostat.state == 'automatique' and mode == 'nuit':
+                        sentence = "Nous sommes en mode économique, je passe donc en mode forcé".format(
+                            mode)
+                        change(thermostat, state='forcé')
 
-            else:
-                sentence = "Je ne comprends pas l'action à effectuer avec le thermostat."
+                logger.debug("After action-> state: {} , mode: {}".format(
+                    thermostat.state, thermostat.mode))
 
-            logger.debug(sentence)
-            hermes.publish_end_session(intent_message.session_id, sentence)
-            return
+            else:
+                sentence = "Je n'ai pas compris s'il fait froid ou s'il fait chaud."
+
+        else:
+            sentence = "Je ne comprends pas l'action à effectuer avec le thermostat."
+
+        logger.debug(sentence)
+        hermes.publish_end_session(intent_message.session_id, sentence)
+
+
+def thermostat_trend(hermes, intent_message):
+    logger.debug("Thermostat trend")
+    thermostat = route(hermes, intent_message)
+    if thermostat is None:
+        return
+    # Answered from the sampled history, without calling domoticz
+    history = histories.get(thermostat)
+    indoor = history.latest('indoor') if history else None
+    # No sample in the last 24 hours: the latest one is too old to tell
+    extremes = history.minMax('indoor', 24) if history else None
+    if indoor is None or extremes is None:
+        sentence = "Désolée, je n'ai pas encore de relevés de température."
+    else:
+        sentence = "Il fait {} degrés.".format(spoken(indoor))
+        rate = history.rate('indoor', 1)
+        if rate is not None:
+            if history.isWarmingUp():
+                sentence += " La température monte de {} degrés par heure.".format(
+                    spoken(rate))
+            elif rate < -0.1:
+                sentence += " La température baisse de {} degrés par heure.".format(
+                    spoken(-rate))
+            else:
+                sentence += " La température est stable."
+        low, high = extremes
+        if high - low >= 0.1:
+            sentence += " Sur les dernières 24 heures, elle est allée de {} à {} degrés.".format(
+                spoken(low), spoken(high))
+    logger.debug(sentence)
+    hermes.publish_end_session(intent_message.session_id, sentence)
+
+
+def thermostat_when(hermes, intent_message):
+    logger.debug("Thermostat when")
+    if not intent_message.slots.temperature:
+        return
+    thermostat = route(hermes, intent_message)
+    if thermostat is None:
+        return
+    target = float(intent_message.slots.temperature.first().value)
+    model = models.get(thermostat)
+    indoor = thermostat.indoorTemp
+    outdoor = thermostat.outdoorTemp
+    hours = None
+    if model is not None and indoor is not None and outdoor is not None:
+        hours = model.hoursTo(target, float(indoor), float(outdoor))
+    if hours is None:
+        sentence = "Désolée, je ne sais pas quand il fera {} degrés.".format(
+            spoken(target))
+    elif hours < 1 / 60:
+        sentence = "Il fait déjà {} degrés.".format(spoken(target))
+    else:
+        when = time.localtime(time.time() + hours * 3600)
+        sentence = "Il fera {} degrés vers {} heures {:02d}.".format(
+            spoken(target), when.tm_hour, when.tm_min)
+    logger.debug(sentence)
+    hermes.publish_end_session(intent_message.session_id, sentence)
+
+
+def thermostat_schedule(hermes, intent_message):
+    logger.debug("Thermostat schedule")
+    thermostat = route(hermes, intent_message)
+    if thermostat is None:
+        return
+    # Answered from the timeline of the Mode timers, without calling
+    # domoticz, but for the setpoints
+    schedule = schedules.get(thermostat)
+    if schedule is None or schedule.levelAt(time.time()) is None:
+        sentence = "Désolée, je ne connais pas la programmation du thermostat."
+    elif intent_message.slots.schedule_time:
+        when = slot_time(intent_message.slots.schedule_time.first().value)
+        mode = schedule.modeAt(when) if when is not None else None
+        if mode is None:
+            sentence = "Désolée, je ne sais pas dans quel mode sera le thermostat."
+        else:
+            setpoint = {'jour': thermostat.setpointNormal,
+                        'nuit': thermostat.setpointEconomy}.get(mode)
+            sentence = "{}, le thermostat sera en mode {}".format(
+                spoken_time(when).capitalize(), mode)
+            if setpoint is not None:
+                sentence += ", avec une consigne de {} degrés".format(
+                    spoken(float(setpoint)))
+            sentence += "."
+    else:
+        mode = None
+        if intent_message.slots.thermostat_mode:
+            mode = intent_message.slots.thermostat_mode.first().value
+        upcoming = schedule.nextChange(mode)
+        if upcoming is not None:
+            when, mode = upcoming
+            sentence = "Le thermostat passera en mode {} {}.".format(
+                mode, spoken_time(when))
+            model = models.get(thermostat)
+            if mode == 'jour' and model is not None:
+                # Heating ahead of the schedule to be warm at the change
+                start = preheat(thermostat, model, schedule)
+                if start is not None and start[0] < start[1]:
+                    sentence += " Pour être à {} degrés, le chauffage " \
+                        "devra démarrer {}.".format(
+                            spoken(float(thermostat.setpointNormal)),
+                            spoken_time(start[0]))
+        elif mode is not None:
+            sentence = "Aucun passage en mode {} n'est programmé.".format(mode)
+        else:
+            sentence = "Aucun changement de mode n'est programmé."
+    logger.debug(sentence)
+    hermes.publish_end_session(intent_message.session_id, sentence)
+
+
+INTENT_HANDLERS = {
+    THERMOSTATMODE: thermostat_mode,
+    THERMOSTATTURNOFF: thermostat_turn_off,
+    THERMOSTATSHIFT: thermostat_shift,
+    THERMOSTATTREND: thermostat_trend,
+    THERMOSTATWHEN: thermostat_when,
+    THERMOSTATSCHEDULE: thermostat_schedule
+}
+
+
+def run_intent(handler, hermes, intent_message, queued=None):
+    """ Run an intent handler within INTENT_DEADLINE seconds, recording its
+        duration, errors and number of domoticz calls.
+
+        :param queued: monotonic time the intent was queued at.
+    """
+    labels = {'intent': intent_message.intent.intent_name}
+    # Time spent in domoticz, hermes and the handler, when profiling
+    profiler.begin(labels['intent'], intent_message.session_id,
+                   time.monotonic() - queued if queued else 0.0)
+    hermes = profiler.timed(hermes, 'hermes')
+    api_calls.begin()
+    deadlines.begin(INTENT_DEADLINE)
+    deferred.plans = {} if OPTIMISTIC else None
+    start = time.monotonic()
+    try:
+        handler(hermes, intent_message)
+        if deferred.plans:
+            # Answered already, the writes get a deadline of their own
+            deadlines.begin(INTENT_DEADLINE)
+            apply_plans(hermes, intent_message, deferred.plans)
+    except DomoticzUnavailable as e:
+        INTENT_ERRORS.inc(labels)
+        logger.error("Intent {} aborted: {}".format(labels['intent'], e))
+        hermes.publish_end_session(intent_message.session_id,
+                                   "Désolée, Domoticz ne répond pas.")
+    except Exception:
+        INTENT_ERRORS.inc(labels)
+        raise
+    finally:
+        deadlines.end()
+        deferred.plans = None
+        INTENT_LATENCY.observe(time.monotonic() - start, labels)
+        INTENT_API_CALLS.observe(api_calls.end(), labels)
+        profiler.end()
 
 
-with Hermes(MQTT_ADDR) as h:
+def intent_received(hermes, intent_message):
+    intentName = intent_message.intent.intent_name
+    logger.debug(intentName)
 
-    try:
-        config = SnipsConfigParser.read_configuration_file(configPath)
+    for (slot_value, slot) in intent_message.slots.items():
+        logger.debug('Slot {} -> \n\tRaw: {} \tValue: {}'
+                     .format(slot_value, slot[0].raw_value, slot[0].slot_value.value.value))
 
-    except BaseException:
-        config = None
+    if recorder is not None:
+        recorder.record(intent_message)
 
-    thermostat = None
+    handler = INTENT_HANDLERS.get(intentName)
+    if handler is None:
+        return
+    INTENTS.inc({'intent': intentName})
 
+    # Domoticz calls run on the worker pool, not on the MQTT callback thread.
+    # Intents of a same session keep their order.
     try:
-        thermostat = open_thermostat(config)
-        logger.info('Thermostat initialization: OK')
-
-    except Exception as e:
-        logger.error('Error Thermostat {}'.format(e))
-
-    h.subscribe_intent(THERMOSTATMODE, intent_received)\
-        .subscribe_intent(THERMOSTATTURNOFF, intent_received)\
-        .subscribe_intent(THERMOSTATSHIFT, intent_received)\
-        .start()
+        workers.submit(intent_message.session_id, run_intent,
+                       (handler, hermes, intent_message, time.monotonic()),
+                       timeout=SUBMIT_TIMEOUT)
+    except queue.Full:
+        logger.error("Intent queue full, dropping {}".format(intentName))
+        INTENT_REJECTED.inc({'intent': intentName})
+        hermes.publish_end_session(intent_message.session_id,
+                                   "Désolée, je suis occupée. Réessaie dans un instant.")
+        return
+
+    depth = workers.depth()
+    logger.debug("Intent queue depth: {}".format(depth))
+    if depth >= workers.capacity() * QUEUE_HIGH_WATERMARK:
+        logger.warning("Intent queue is saturating: {}/{} pending".format(
+            depth, workers.capacity()))
+
+
+# Set up by the main program, or by a test harness driving the handlers
+registry = None
+workers = None
+feed = None
+learner = None
+discovery = None
+recorder = None
+# {thermostat: TemperatureHistory}, {thermostat: HeatingModel} and
+# {thermostat: ModeSchedule}, updated in place when the configuration is
+# reloaded
+histories = {}
+models = {}
+schedules = {}
+
+if __name__ == '__main__':
+    # The module loggers already exist, they must stay enabled
+    logging.config.fileConfig(configPath, disable_existing_loggers=False)
+
+    with Hermes(MQTT_ADDR) as h:
+
+        try:
+            config = SnipsConfigParser.read_configuration_file(configPath)
+
+        except BaseException:
+            config = None
+
+        # Workers, metrics and MQTT settings are read once, a restart is
+        # needed to change them.
+        # Background jobs (sampling, learning, discovery, config checks) run
+        # on the thread handler.
+        ThreadHandler(int(config.get('global', {}).get(
+            'scheduler_workers', 4)) if config else 4)
+        workers = KeyedWorkerPool(
+            int(config.get('global', {}).get('workers', 4)) if config else 4,
+            int(config.get('global', {}).get('queue_size', 16)) if config else 16,
+            'intent')
+        metrics.gauge('intent_queue_depth', workers.depth,
+                      'Intents waiting for a worker')
+
+        # Metrics are exposed on a local port and/or logged periodically
+        metricsPort = config.get('global', {}).get('metrics_port') if config else None
+        if metricsPort:
+            metrics.serve(int(metricsPort))
+        metricsInterval = config.get('global', {}).get(
+            'metrics_dump_interval') if config else None
+        if metricsInterval:
+            metrics.dump_every(float(metricsInterval))
+
+        # kill -USR2 <pid> switches intent profiling on and off
+        signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.toggle())
+
+        if apply_config(config or {}):
+            logger.info('Thermostat initialization: OK')
+
+        # Changes of config.ini are applied without restarting
+        interval = float(config.get('global', {}).get(
+            'config_check_interval', 5)) if config else 5
+        if interval > 0:
+            ConfigWatcher(configPath, reload_config, interval).start(config)
+
+        try:
+            h.subscribe_intent(THERMOSTATMODE, intent_received)\
+                .subscribe_intent(THERMOSTATTURNOFF, intent_received)\
+                .subscribe_intent(THERMOSTATSHIFT, intent_received)\
+                .subscribe_intent(THERMOSTATTREND, intent_received)\
+                .subscribe_intent(THERMOSTATWHEN, intent_received)\
+                .subscribe_intent(THERMOSTATSCHEDULE, intent_received)\
+                .start()
+        finally:
+            # Pending setpoint shifts are written before leaving
+            if registry is not None:
+                registry.each(lambda thermostat: thermostat.flush())
+            workers.stop(SHUTDOWN_TIMEOUT)
+            ThreadHandler().stop(SHUTDOWN_TIMEOUT)
@@ -3,7 +3,7 @@ import io
 
 CONFIGURATION_ENCODING_FORMAT = "utf-8"
 
-class SnipsConfigParser(configparser.SafeConfigParser):
+class SnipsConfigParser(configparser.ConfigParser):
     def to_dict(self):
         return {section: {option_name : option for option_name, option in self.items(section)} for section in self.sections()}
 
@@ -12,9 +12,9 @@ class SnipsConfigParser(configparser.SafeConfigParser):
         try:
             with io.open(configuration_file, encoding=CONFIGURATION_ENCODING_FORMAT) as f:
                 conf_parser = SnipsConfigParser()
-                conf_parser.readfp(f)
+                conf_parser.read_file(f)
                 return conf_parser.to_dict()
-        except (IOError, ConfigParser.Error) as e:
+        except (IOError, configparser.Error) as e:
             print(e)
             return dict()
 
@@ -28,6 +28,6 @@ class SnipsConfigParser(configparser.SafeConfigParser):
         try:
             with open(configuration_file, 'w') as f:
                 conf_parser.write(f)
-        except (IOError, ConfigParser.Error) as e:
+        except (IOError, configparser.Error) as e:
             print(e)
             return False
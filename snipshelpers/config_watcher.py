@@ -0,0 +1,79 @@
+# -*-: coding utf-8 -*-
+""" Configuration file watcher. """
+
+import logging
+import os
+
+from .config_parser import SnipsConfigParser
+from .thread_handler import ThreadHandler
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigWatcher(object):
+    """ Call a function with the new configuration when the configuration
+    file changes.
+
+    The file is only stat'ed every interval seconds, and parsed when its
+    modification time or size changed and then stayed the same for one
+    interval.
+    """
+
+    def __init__(self, path, on_change, interval=5):
+        """ Initialisation.
+
+        :param path: the configuration file.
+        :param on_change: called with the configuration dict when it
+                          changed.
+        :param interval: seconds between two checks.
+        """
+        self.path = path
+        self.on_change = on_change
+        self.interval = float(interval)
+        self._signature = self._stat()
+        self._pending = None
+        self._config = None
+        self._job = None
+
+    def start(self, config=None):
+        """ Watch the file on the thread handler.
+
+        :param config: the configuration already applied, if any.
+        """
+        self._config = config
+        self._job = ThreadHandler().every(self.interval, self.check)
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+
+    def check(self):
+        """ Apply the configuration if the file changed.
+
+        :return: True if on_change was called.
+        """
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        if signature != self._pending:
+            # The file may still be being written, it is read once it
+            # stayed the same for one interval.
+            self._pending = signature
+            return False
+        self._signature = signature
+        self._pending = None
+        config = SnipsConfigParser.read_configuration_file(self.path)
+        if not config or config == self._config:
+            # Unreadable, or saved without any change
+            return False
+        logger.info("{} changed, applying it".format(self.path))
+        self._config = config
+        self.on_change(config)
+        return True
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
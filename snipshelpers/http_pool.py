@@ -0,0 +1,356 @@
+# -*-: coding utf-8 -*-
+""" Keep-alive HTTP connection pool. """
+
+import asyncio
+import http.client
+import socket
+import threading
+import time
+import weakref
+
+
+# Errors raised when a kept-alive connection has been closed by the server
+# while it was sitting idle in the pool.
+STALE_ERRORS = (http.client.BadStatusLine, ConnectionResetError,
+                ConnectionAbortedError, BrokenPipeError)
+
+# Same for the asyncio streams
+ASYNC_STALE_ERRORS = (ConnectionResetError, ConnectionAbortedError,
+                      BrokenPipeError, asyncio.IncompleteReadError)
+
+
+class ConnectionPool(object):
+    """ Pool of persistent HTTP/1.1 connections to a single host. """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, host, port, size=4, idle_timeout=30):
+        """ Initialisation.
+
+        :param host: the server host name or ip address.
+        :param port: the server port.
+        :param size: the maximum number of simultaneous connections.
+        :param idle_timeout: seconds after which an idle connection is
+                             closed instead of being reused.
+        """
+        self.host = host
+        self.port = int(port)
+        self.size = int(size)
+        self.idle_timeout = float(idle_timeout)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    @classmethod
+    def shared(cls, host, port, size=4, idle_timeout=30):
+        """ Return the pool shared by every client of host:port, creating
+            it on first use.
+        """
+        key = (host, int(port))
+        with cls._shared_lock:
+            pool = cls._shared.get(key)
+            if pool is None:
+                pool = cls(host, port, size, idle_timeout)
+                cls._shared[key] = pool
+            return pool
+
+    @classmethod
+    def reset(cls):
+        """ Forget the shared pools, so that the next clients get new ones.
+            The clients already built keep theirs.
+        """
+        with cls._shared_lock:
+            cls._shared = {}
+
+    def request(self, method, path, headers=None, timeout=None):
+        """ Send a request and read the whole response.
+
+        A connection taken from the pool that turns out to have been closed
+        by the server is replaced by a fresh one and the request is sent
+        again, once.
+
+        :param method: the HTTP method.
+        :param path: the request path, including the query string.
+        :param headers: a dict of request headers.
+        :param timeout: seconds allowed to wait for a free connection, to
+                        connect and for each socket read, None for no limit.
+        :return: a (status, body) tuple.
+        :raise socket.timeout: when timeout is exceeded.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise socket.timeout('No free connection to {}:{}'.format(
+                self.host, self.port))
+        try:
+            conn, reused = self._checkout()
+            try:
+                status, body, keep = self._send(
+                    conn, method, path, headers, timeout)
+            except STALE_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                conn = self._connect()
+                status, body, keep = self._send(
+                    conn, method, path, headers, timeout)
+            except BaseException:
+                conn.close()
+                raise
+            if keep:
+                self._checkin(conn)
+            else:
+                conn.close()
+            return status, body
+        finally:
+            self._slots.release()
+
+    def stream(self, method, path, headers=None, timeout=None,
+               chunk_size=65536):
+        """ Send a request and yield its response body in chunks, so that
+        a large response is never held in memory as a whole.
+
+        The connection goes back to the pool once the body has been read
+        entirely; it is closed if the generator is not exhausted.
+
+        :param timeout: seconds allowed to wait for a free connection, to
+                        connect and for each socket read, None for no limit.
+        :raise http.client.HTTPException: when the status is not 200.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise socket.timeout('No free connection to {}:{}'.format(
+                self.host, self.port))
+        try:
+            conn, reused = self._checkout()
+            try:
+                response = self._begin(conn, method, path, headers, timeout)
+            except STALE_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                conn = self._connect()
+                response = self._begin(conn, method, path, headers, timeout)
+            except BaseException:
+                conn.close()
+                raise
+            done = False
+            try:
+                if response.status != 200:
+                    response.read()
+                    raise http.client.HTTPException(
+                        'HTTP status {}'.format(response.status))
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+                done = True
+            finally:
+                if done and not response.will_close:
+                    self._checkin(conn)
+                else:
+                    conn.close()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """ Close every idle connection. """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def _connect(self):
+        return http.client.HTTPConnection(self.host, self.port)
+
+    def _checkout(self):
+        now = time.monotonic()
+        expired = []
+        conn = None
+        with self._lock:
+            while self._idle:
+                candidate, last_used = self._idle.pop()
+                if now - last_used < self.idle_timeout:
+                    conn = candidate
+                    break
+                expired.append(candidate)
+        for candidate in expired:
+            candidate.close()
+        if conn is None:
+            return self._connect(), False
+        return conn, True
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    @classmethod
+    def _send(cls, conn, method, path, headers, timeout=None):
+        response = cls._begin(conn, method, path, headers, timeout)
+        body = response.read()
+        return response.status, body, not response.will_close
+
+    @staticmethod
+    def _begin(conn, method, path, headers, timeout=None):
+        # Used by connect() for a new connection, applied to the socket of
+        # a reused one.
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        conn.request(method, path, headers=headers or {})
+        return conn.getresponse()
+
+
+class AsyncConnectionPool(object):
+    """ Pool of persistent HTTP/1.1 connections built on asyncio streams.
+
+    Connections belong to the event loop that opened them: a loop only
+    reuses its own, and the idle ones of a loop that is gone are dropped.
+    """
+
+    _shared = {}
+
+    def __init__(self, host, port, size=4, idle_timeout=30):
+        """ Initialisation.
+
+        :param host: the server host name or ip address.
+        :param port: the server port.
+        :param size: the maximum number of simultaneous connections.
+        :param idle_timeout: seconds after which an idle connection is
+                             closed instead of being reused.
+        """
+        self.host = host
+        self.port = int(port)
+        self.size = int(size)
+        self.idle_timeout = float(idle_timeout)
+        # [((reader, writer), last used, loop)]
+        self._idle = []
+        self._slots = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def shared(cls, host, port, size=4, idle_timeout=30):
+        """ Return the pool shared by every client of host:port, creating
+            it on first use.
+        """
+        key = (host, int(port))
+        pool = cls._shared.get(key)
+        if pool is None:
+            pool = cls(host, port, size, idle_timeout)
+            cls._shared[key] = pool
+        return pool
+
+    async def request(self, method, path, headers=None):
+        """ Send a request and read the whole response.
+
+        :param method: the HTTP method.
+        :param path: the request path, including the query string.
+        :param headers: a dict of request headers.
+        :return: a (status, body) tuple.
+        """
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots[loop] = asyncio.Semaphore(self.size)
+        async with slots:
+            conn, reused = await self._checkout(loop)
+            keep = False
+            try:
+                try:
+                    status, body, keep = await self._send(
+                        conn, method, path, headers)
+                except ASYNC_STALE_ERRORS:
+                    if not reused:
+                        raise
+                    # Closed by the server while idle, sent again once
+                    self._close(conn)
+                    conn = await self._connect()
+                    status, body, keep = await self._send(
+                        conn, method, path, headers)
+            finally:
+                # Errors and cancellations, e.g. by wait_for, leave the
+                # connection in an unknown state
+                if keep:
+                    self._idle.append((conn, time.monotonic(), loop))
+                else:
+                    self._close(conn)
+            return status, body
+
+    def close(self):
+        """ Close every idle connection. """
+        idle, self._idle = self._idle, []
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    async def _connect(self):
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def _checkout(self, loop):
+        now = time.monotonic()
+        idle = []
+        conn = None
+        for entry in reversed(self._idle):
+            other, last_used, owner = entry
+            if owner is not loop:
+                if owner.is_closed():
+                    self._close(other)
+                else:
+                    idle.append(entry)
+            elif now - last_used >= self.idle_timeout or other[0].at_eof():
+                self._close(other)
+            elif conn is None:
+                conn = other
+            else:
+                idle.append(entry)
+        self._idle = idle[::-1]
+        if conn is not None:
+            return conn, True
+        return await self._connect(), False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn[1].close()
+        except RuntimeError:
+            # Its event loop is closed, and so is the socket
+            pass
+
+    async def _send(self, conn, method, path, headers):
+        reader, writer = conn
+        lines = ['{} {} HTTP/1.1'.format(method, path),
+                 'Host: {}:{}'.format(self.host, self.port)]
+        for name, value in (headers or {}).items():
+            lines.append('{}: {}'.format(name, value))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+        version, status = status_line.split(None, 2)[:2]
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        keep = version == b'HTTP/1.1' and \
+            response_headers.get('connection', '').lower() != 'close'
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                body += await reader.readexactly(size)
+                await reader.readexactly(2)
+            body = bytes(body)
+        elif 'content-length' in response_headers:
+            body = await reader.readexactly(
+                int(response_headers['content-length']))
+        else:
+            body = await reader.read()
+            keep = False
+        return int(status), body, keep
@@ -0,0 +1,66 @@
+# -*-: coding utf-8 -*-
+""" Recording of the intents received, to replay them later. """
+
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class IntentRecorder(object):
+    """ Append the intents received to a JSON lines file, one object per
+    intent: {"time": 1546300800.0, "intent": "ericvde31830:thermostatMode",
+    "session_id": ..., "site_id": ..., "slots": {"thermostat_mode": "nuit"}}
+    """
+
+    def __init__(self, path):
+        """ Initialisation.
+
+        :param path: the file to append to.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, intent_message):
+        """ Append an intent message, as received from hermes. """
+        slots = {name: values[0].slot_value.value.value
+                 for name, values in intent_message.slots.items()}
+        line = json.dumps({
+            'time': time.time(),
+            'intent': intent_message.intent.intent_name,
+            'session_id': intent_message.session_id,
+            'site_id': intent_message.site_id,
+            'slots': slots
+        }, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_intents(path):
+    """ Return the intents recorded in a file, oldest first, skipping the
+    lines that cannot be read.
+    """
+    intents = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                intents.append(json.loads(line))
+            except ValueError:
+                logger.warning("{}:{}: invalid intent ignored".format(
+                    path, number))
+    intents.sort(key=lambda intent: intent.get('time', 0))
+    return intents
@@ -0,0 +1,97 @@
+# -*-: coding utf-8 -*-
+""" Incremental parsing of large JSON responses. """
+
+import codecs
+import json
+import re
+
+# Consumed text is dropped from the buffer once it is that long
+_TRIM_SIZE = 65536
+
+# Text kept when trimming the buffer before the array: the scalar members,
+# and the array key, split between two chunks are shorter than that
+_TAIL_SIZE = 1024
+
+_WHITESPACE = re.compile(r'[\s,]*')
+_SCALAR_MEMBER = re.compile(
+    r'"(\w+)"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?'
+    r'|true|false|null)')
+
+
+def iter_array(chunks, key='result', members=None):
+    """ Yield the objects of the array found under key in a JSON document
+    read as a sequence of byte chunks, e.g. the "result" list of a
+    Domoticz response. Only the object being decoded and one chunk are
+    held in memory.
+
+    :param chunks: an iterable of bytes.
+    :param key: the name of the array member.
+    :param members: a dict filled with the scalar members found outside
+                    the array, e.g. {'status': 'OK', 'ActTime': 1546300800},
+                    once the generator is exhausted.
+    :raise ValueError: when the document ends in the middle of the array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    start = re.compile(r'"{}"\s*:\s*\['.format(re.escape(key)))
+    chunks = iter(chunks)
+    buffer = ''
+    pos = None
+
+    def more():
+        for chunk in chunks:
+            text = text_decoder.decode(chunk)
+            if text:
+                return text
+        return None
+
+    def collect(text):
+        if members is not None:
+            members.update((name, json.loads(value)) for name, value in
+                           _SCALAR_MEMBER.findall(text))
+
+    # Look for the beginning of the array
+    while pos is None:
+        text = more()
+        if text is None:
+            collect(buffer)
+            return
+        buffer += text
+        match = start.search(buffer)
+        if match:
+            collect(buffer[:match.start()])
+            pos = match.end()
+        elif len(buffer) > _TRIM_SIZE:
+            # A member cut at the end is collected again, whole, with the
+            # next chunks
+            collect(buffer)
+            buffer = buffer[-_TAIL_SIZE:]
+
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == ']':
+            break
+        try:
+            if pos == len(buffer):
+                raise ValueError('Need more data')
+            item, pos = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            text = more()
+            if text is None:
+                raise ValueError('Truncated JSON array "{}"'.format(key))
+            buffer = buffer[pos:] + text
+            pos = 0
+            continue
+        yield item
+        if pos > _TRIM_SIZE:
+            buffer = buffer[pos:]
+            pos = 0
+
+    # The members following the array are small, e.g. "status". Reading
+    # them to the end also lets the connection be reused.
+    rest = [buffer[pos + 1:]]
+    text = more()
+    while text is not None:
+        rest.append(text)
+        text = more()
+    collect(''.join(rest))
@@ -0,0 +1,223 @@
+# -*-: coding utf-8 -*-
+""" Counters and latency histograms, exposed in the Prometheus text format. """
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .thread_handler import ThreadHandler
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets upper bounds, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in pairs) + '}'
+
+
+class Counter(object):
+    """ Monotonic counter, one value per label set. """
+
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=None, value=1):
+        """ Add value to the counter of labels. """
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, labels=None):
+        return self._values.get(_labels_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name + _format_labels(key), value
+
+
+class Histogram(object):
+    """ Distribution of observed values, one per label set. """
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=None):
+        """ Record one value for labels. """
+        key = _labels_key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, labels=None):
+        counts, _ = self._values.get(_labels_key(labels), ([], 0.0))
+        return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total)
+                      for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulated = 0
+            for bound, count in zip(self.buckets + ('+Inf', ), counts):
+                cumulated += count
+                yield self.name + '_bucket' + _format_labels(
+                    key, (('le', bound), )), cumulated
+            yield self.name + '_sum' + _format_labels(key), total
+            yield self.name + '_count' + _format_labels(key), cumulated
+
+
+class Gauge(object):
+    """ Value read from a function when the metrics are collected. """
+
+    kind = 'gauge'
+
+    def __init__(self, name, description, function):
+        self.name = name
+        self.description = description
+        self.function = function
+
+    def samples(self):
+        try:
+            yield self.name, self.function()
+        except Exception as e:
+            logger.debug("Gauge {} failed: {}".format(self.name, e))
+
+
+class Metrics(object):
+    """ Set of metrics. """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._job = None
+
+    def counter(self, name, description=''):
+        """ Return the counter called name, creating it on first use. """
+        return self._get(name, lambda: Counter(name, description))
+
+    def histogram(self, name, description='', buckets=DEFAULT_BUCKETS):
+        """ Return the histogram called name, creating it on first use. """
+        return self._get(name, lambda: Histogram(name, description, buckets))
+
+    def gauge(self, name, function, description=''):
+        """ Register a gauge reading its value from function(). """
+        gauge = Gauge(name, description, function)
+        with self._lock:
+            self._metrics[name] = gauge
+        return gauge
+
+    def exposition(self):
+        """ Return every metric in the Prometheus text format. """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for name, metric in metrics:
+            if metric.description:
+                lines.append('# HELP {} {}'.format(name, metric.description))
+            lines.append('# TYPE {} {}'.format(name, metric.kind))
+            for sample, value in metric.samples():
+                lines.append('{} {}'.format(sample, value))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """ Expose the metrics on http://host:port/metrics. """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = metrics.exposition().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, int(port)), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logger.info("Metrics exposed on http://{}:{}/metrics".format(
+            host, port))
+
+    def dump_every(self, interval, output=None):
+        """ Write the metrics every interval seconds, to the output function
+            or to the log.
+        """
+        output = output or logger.info
+        self._job = ThreadHandler().every(
+            float(interval), lambda: output(self.exposition()), jitter=0)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+
+    def _get(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = factory()
+                self._metrics[name] = metric
+            return metric
+
+
+class CallScope(object):
+    """ Count the calls made by the current thread between begin() and
+        end(), e.g. the Domoticz calls made while handling one intent.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def begin(self):
+        self._local.count = 0
+
+    def add(self):
+        if getattr(self._local, 'count', None) is not None:
+            self._local.count += 1
+
+    def end(self):
+        count = getattr(self._local, 'count', None) or 0
+        self._local.count = None
+        return count
+
+
+# Metrics of the process
+metrics = Metrics()
+api_calls = CallScope()
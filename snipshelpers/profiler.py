@@ -0,0 +1,292 @@
+# -*-: coding utf-8 -*-
+""" On demand profiling of the intents: per phase timings, cProfile stats
+and tracemalloc allocations.
+"""
+
+import cProfile
+import glob
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Phase of an intent not spent in a named one
+DEFAULT_PHASE = 'handler'
+
+# Allocation sites written for each sampled intent
+TOP_ALLOCATIONS = 30
+
+
+class IntentRecord(object):
+    """ Timings of one intent, per phase. Phases are exclusive: the time
+        spent in a nested phase is not counted in the enclosing one.
+    """
+
+    def __init__(self, name, session_id, queued=0.0):
+        self.name = name
+        self.session_id = session_id
+        self.start = time.monotonic()
+        self.duration = None
+        self.phases = {'queue': queued} if queued else {}
+        self.files = []
+        self._current = DEFAULT_PHASE
+        self._mark = self.start
+
+    def switch(self, phase):
+        """ Enter phase, returning the phase left. """
+        now = time.monotonic()
+        previous = self._current
+        self.phases[previous] = self.phases.get(previous, 0.0) + \
+            now - self._mark
+        self._current = phase
+        self._mark = now
+        return previous
+
+    def finish(self):
+        self.switch(DEFAULT_PHASE)
+        self.duration = time.monotonic() - self.start + \
+            self.phases.get('queue', 0.0)
+
+    def __lt__(self, other):
+        return self.duration < other.duration
+
+    def describe(self):
+        phases = ', '.join('{} {:.1f}'.format(phase, seconds * 1000)
+                           for phase, seconds in sorted(
+                               self.phases.items(), key=lambda item: -item[1])
+                           if seconds >= 0.00005)
+        line = '{:8.1f} ms  {}  {}  [{}]'.format(
+            self.duration * 1000, self.name, self.session_id, phases)
+        if self.files:
+            line += '  ' + ' '.join(os.path.basename(f) for f in self.files)
+        return line
+
+
+class Timed(object):
+    """ Proxy of an object whose method calls are timed as a phase, e.g.
+        the hermes calls of an intent.
+    """
+
+    def __init__(self, target, phase, profiler):
+        self._target = target
+        self._phase = phase
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return attribute
+
+        def timed(*args, **kwargs):
+            with self._profiler.phase(self._phase):
+                return attribute(*args, **kwargs)
+        return timed
+
+
+class IntentProfiler(object):
+    """ Profiling of the intents handled by the worker threads.
+
+    While enabled, the phases of every intent are timed, and the slowest
+    ones are kept in a summary. A sampled fraction of the intents is also
+    run under cProfile and tracemalloc, and their stats are written to
+    directory, keeping the most recent files only. Only one intent at a
+    time is sampled: the profilers are process wide.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.sampleRate = 0.0
+        self.slowestCount = 10
+        self.keep = 20
+        self.memory = True
+        self.enabled = False
+        self._slowest = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sampling = threading.Lock()
+
+    def configure(self, directory=None, sampleRate=0.0, slowest=10, keep=20,
+                  memory=True, enabled=None):
+        """ :param directory: where to write the stats, nothing is written
+                              without it.
+            :param sampleRate: fraction of the intents profiled, 0 to 1.
+            :param slowest: number of intents kept in the summary.
+            :param keep: number of stats files of each kind kept.
+            :param memory: whether to trace the allocations of the sampled
+                           intents.
+            :param enabled: enable profiling, by default when sampleRate is
+                            positive.
+        """
+        self.directory = directory
+        self.sampleRate = float(sampleRate)
+        self.slowestCount = int(slowest)
+        self.keep = int(keep)
+        self.memory = memory
+        self.enabled = self.sampleRate > 0 if enabled is None else enabled
+
+    def toggle(self):
+        """ Enable profiling, or disable it, e.g. on a signal. While enabled
+            this way without a configured sample rate, every intent is
+            sampled.
+        """
+        self.enabled = not self.enabled
+        logger.info("Intent profiling {}".format(
+            'enabled' if self.enabled else 'disabled'))
+        if not self.enabled:
+            logger.info("Slowest intents:\n{}".format(self.summary()))
+
+    def begin(self, name, session_id, queued=0.0):
+        """ Start recording the intent handled by the current thread.
+
+        :param queued: seconds the intent waited for a worker.
+        :return: the IntentRecord, or None while disabled.
+        """
+        if not self.enabled:
+            self._local.record = None
+            return None
+        record = IntentRecord(name, session_id, queued)
+        self._local.record = record
+        self._local.profile = None
+        self._local.tracing = False
+        rate = self.sampleRate or 1.0
+        if self.directory and random.random() < rate and \
+                self._sampling.acquire(blocking=False):
+            try:
+                profile = cProfile.Profile()
+                profile.enable()
+                self._local.profile = profile
+            except ValueError as e:
+                # Another profiler is active, e.g. a debugger
+                logger.debug("Intent not profiled: {}".format(e))
+                self._sampling.release()
+                return record
+            if self.memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._local.tracing = True
+        return record
+
+    def end(self):
+        """ Stop recording the intent of the current thread. """
+        record = getattr(self._local, 'record', None)
+        if record is None:
+            return None
+        self._local.record = None
+        profile, self._local.profile = self._local.profile, None
+        record.finish()
+        if profile is not None:
+            try:
+                profile.disable()
+                self._write(record, profile)
+            finally:
+                self._sampling.release()
+        with self._lock:
+            if len(self._slowest) < self.slowestCount:
+                heapq.heappush(self._slowest, record)
+            elif self._slowest and record.duration > self._slowest[0].duration:
+                heapq.heapreplace(self._slowest, record)
+            else:
+                return record
+            summary = self._summary()
+        if self.directory:
+            self._save('slowest.txt', summary)
+        return record
+
+    @contextmanager
+    def phase(self, name):
+        """ Count the time spent in the block in phase name. """
+        record = getattr(self._local, 'record', None)
+        if record is None:
+            yield
+            return
+        previous = record.switch(name)
+        try:
+            yield
+        finally:
+            record.switch(previous)
+
+    def timed(self, target, phase):
+        """ Return target, whose method calls are counted in phase while an
+            intent is recorded.
+        """
+        if getattr(self._local, 'record', None) is None:
+            return target
+        return Timed(target, phase, self)
+
+    def slowest(self):
+        """ The slowest intents recorded, slowest first. """
+        with self._lock:
+            return sorted(self._slowest, reverse=True)
+
+    def summary(self):
+        """ The slowest intents, one per line, with their phases in ms. """
+        with self._lock:
+            return self._summary()
+
+    def reset(self):
+        with self._lock:
+            self._slowest = []
+
+    def _summary(self):
+        return '\n'.join(record.describe() for record in
+                         sorted(self._slowest, reverse=True))
+
+    def _write(self, record, profile):
+        now = time.time()
+        base = os.path.join(self.directory, 'intent-{}-{:03d}-{}'.format(
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+            int(now * 1000) % 1000, record.name.rsplit(':', 1)[-1]))
+        snapshot = None
+        try:
+            if self._local.tracing:
+                # Allocations still held when the intent ended, of every
+                # thread
+                _, peak = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot().filter_traces([
+                    tracemalloc.Filter(False, cProfile.__file__),
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, __file__)])
+        finally:
+            # Tracing slows every allocation down, it never outlives the
+            # sampled intent
+            if self._local.tracing:
+                tracemalloc.stop()
+                self._local.tracing = False
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(base + '.prof')
+            record.files.append(base + '.prof')
+            if snapshot is not None:
+                stats = snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+                self._save(os.path.basename(base) + '.mem.txt', '\n'.join(
+                    ['Peak traced memory: {:.1f} kB'.format(peak / 1024)] +
+                    [str(stat) for stat in stats]))
+                record.files.append(base + '.mem.txt')
+        except OSError as e:
+            logger.error("Unable to write profile {}: {}".format(base, e))
+            return
+        for pattern in ('intent-*.prof', 'intent-*.mem.txt'):
+            for old in sorted(glob.glob(os.path.join(
+                    self.directory, pattern)))[:-self.keep or None]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def _save(self, name, text):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, name), 'w',
+                      encoding='utf-8') as f:
+                f.write(text + '\n')
+        except OSError as e:
+            logger.error("Unable to write {}: {}".format(name, e))
+
+
+# Profiler of the process
+profiler = IntentProfiler()
@@ -0,0 +1,145 @@
+# -*-: coding utf-8 -*-
+""" Deadlines, retry delays and circuit breaker for calls to a backend. """
+
+import random
+import threading
+import time
+
+
+class DeadlineExceeded(Exception):
+    """ The time budget of the current operation is spent. """
+
+
+class Deadline(object):
+    """ Point in time by which an operation must be done. """
+
+    def __init__(self, seconds):
+        self.expires = time.monotonic() + float(seconds)
+
+    def remaining(self):
+        """ Seconds left, never negative. """
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+
+class DeadlineScope(object):
+    """ Deadline of the operation run by the current thread, e.g. the
+        handling of one intent.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def begin(self, deadline):
+        """ Start an operation.
+
+        :param deadline: a Deadline, or its budget in seconds.
+        :return: the Deadline.
+        """
+        if not isinstance(deadline, Deadline):
+            deadline = Deadline(deadline)
+        self._local.deadline = deadline
+        return deadline
+
+    def current(self):
+        """ Deadline of the current thread, or None outside an operation. """
+        return getattr(self._local, 'deadline', None)
+
+    def end(self):
+        self._local.deadline = None
+
+    def timeout(self, cap):
+        """ Timeout of a call: what is left of the current deadline, at
+            most cap seconds.
+
+        :raise DeadlineExceeded: if the deadline has already expired.
+        """
+        deadline = self.current()
+        if deadline is None:
+            return cap
+        remaining = deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return remaining if cap is None else min(cap, remaining)
+
+
+def backoff_delay(attempt, base=0.1, cap=2.0):
+    """ Delay before retry number attempt (starting at 0), with full
+        jitter: uniform between 0 and base * 2 ** attempt, at most cap.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """ Stop calling a backend after consecutive failures.
+
+    After failures consecutive failures the circuit opens and calls are
+    refused for reset_timeout seconds. Then one trial call is let through:
+    its success closes the circuit, its failure opens it again. A trial that
+    ends without either, e.g. when no time was left to send it, is given to
+    the next call.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failures=5, reset_timeout=30):
+        self.failures = int(failures)
+        self.reset_timeout = float(reset_timeout)
+        self.state = self.CLOSED
+        self._count = 0
+        self._opened = None
+        # Thread making the trial call
+        self._trial = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """ Whether a call may be made now. """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and \
+                    time.monotonic() - self._opened >= self.reset_timeout:
+                # Let one trial call through
+                self.state = self.HALF_OPEN
+                self._trial = threading.get_ident()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._count = 0
+            self.state = self.CLOSED
+            self._trial = None
+
+    def failure(self):
+        """ Record a failed call.
+
+        :return: True if this failure opened the circuit.
+        """
+        with self._lock:
+            self._count += 1
+            self._trial = None
+            if self.state == self.HALF_OPEN or \
+                    self.state == self.CLOSED and self._count >= self.failures:
+                self.state = self.OPEN
+                self._opened = time.monotonic()
+                return True
+            return False
+
+    def abort(self):
+        """ Record that the call allowed to the current thread ended without
+            success nor failure. Safe to call after any call.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN and \
+                    self._trial == threading.get_ident():
+                self.state = self.OPEN
+                self._trial = None
+
+
+# Deadline of the operations run by each thread
+deadlines = DeadlineScope()
@@ -0,0 +1,229 @@
+# -*-: coding utf-8 -*-
+""" Devices state shared between processes through shared memory. """
+
+import logging
+import math
+import os
+import re
+import struct
+import tempfile
+import time
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Python < 3.8
+    resource_tracker = shared_memory = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SVT1'
+
+# magic, capacity, sequence, count, owner pid, update time
+HEADER = struct.Struct('<4sIQIId')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+
+# idx, present fields, Level, Temp, Status, SetPoint
+SLOT = struct.Struct('<iIid16s8s4x')
+
+# Device fields held by a slot, with their present bit
+LEVEL = 1
+TEMP = 2
+STATUS = 4
+SETPOINT = 8
+FIELDS = ('idx', 'Level', 'Temp', 'Status', 'SetPoint')
+
+# Attempts of a reader racing with the writer
+READ_ATTEMPTS = 100
+
+
+def available():
+    """ Whether shared memory tables are supported here. """
+    return shared_memory is not None and fcntl is not None
+
+
+def table_name(ip, port):
+    """ Shared memory name of the table of a Domoticz server. """
+    return 'svt_' + re.sub(r'\W', '_', '{}_{}'.format(ip, port))
+
+
+class SharedDeviceTable(object):
+    """ Fixed layout table of devices state in shared memory.
+
+    One process, the owner, refreshes the table from Domoticz; every other
+    process reads it without lock. Ownership is an exclusive lock on a file,
+    released by the system when the owner exits, so that a reader can take
+    over.
+
+    Writes are versioned seqlock style: the owner makes the sequence odd,
+    writes the slots, then makes it even again. A reader copies the slots
+    between two reads of the same even sequence, or tries again.
+
+    The segment outlives the processes, so that readers attached to it keep
+    seeing the updates of the next owner. unlink() removes it.
+    """
+
+    def __init__(self, name, capacity=4096):
+        """ Attach to the table, creating it if needed.
+
+        :param name: the shared memory name, see table_name().
+        :param capacity: the number of slots of a new table.
+        """
+        self.name = name
+        self.owner = False
+        self._lock = None
+        self._sequence = 0
+        size = HEADER.size + capacity * SLOT.size
+        try:
+            self._shm = self._open(name, True, size)
+            HEADER.pack_into(self._shm.buf, 0, MAGIC, capacity, 0, 0, 0, 0.0)
+        except FileExistsError:
+            self._shm = self._open(name, False, 0)
+        self.capacity = (self._shm.size - HEADER.size) // SLOT.size
+
+    @staticmethod
+    def _open(name, create, size):
+        try:
+            return shared_memory.SharedMemory(name, create, size, track=False)
+        except TypeError:
+            # Before Python 3.13 every process attached to a segment would
+            # unlink it on exit.
+            shm = shared_memory.SharedMemory(name, create, size)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            return shm
+
+    def acquire(self):
+        """ Become the owner if no other process is.
+
+        :return: True if this process owns the table.
+        """
+        if self.owner:
+            return True
+        path = os.path.join(tempfile.gettempdir(), self.name + '.lock')
+        lock = open(path, 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        self._lock = lock
+        self._sequence = SEQUENCE.unpack_from(
+            self._shm.buf, SEQUENCE_OFFSET)[0] & ~1
+        self.owner = True
+        logger.info("Owning shared devices table {}".format(self.name))
+        return True
+
+    def release(self):
+        """ Let another process own the table. """
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+        self.owner = False
+
+    def publish(self, devices):
+        """ Replace the content of the table, owner only.
+
+        :param devices: an iterable of device dicts.
+        """
+        slots = []
+        for device in devices:
+            if len(slots) == self.capacity:
+                logger.warning("Shared devices table {} full, {} slots".format(
+                    self.name, self.capacity))
+                break
+            try:
+                slots.append(self._pack(device))
+            except (KeyError, TypeError, ValueError, struct.error):
+                logger.debug("Device not shared: {}".format(device))
+        buf = self._shm.buf
+        self._sequence += 1
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self._sequence)
+        buf[HEADER.size:HEADER.size + len(slots) * SLOT.size] = b''.join(slots)
+        HEADER.pack_into(buf, 0, MAGIC, self.capacity, self._sequence,
+                         len(slots), os.getpid(), time.time())
+        self._sequence += 1
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self._sequence)
+
+    def sequence(self):
+        """ Version of the table, changed by every write. """
+        return SEQUENCE.unpack_from(self._shm.buf, SEQUENCE_OFFSET)[0]
+
+    def read(self, idxs=None):
+        """ Return the {idx: device} map of the table, of the idx of idxs
+        only if given, the time it was written and its sequence, or None
+        while the table was never written or the owner keeps writing it.
+        """
+        buf = self._shm.buf
+        for _ in range(READ_ATTEMPTS):
+            before = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0]
+            if before & 1:
+                time.sleep(0)
+                continue
+            magic, _, _, count, _, updated = HEADER.unpack_from(buf, 0)
+            data = bytes(buf[HEADER.size:HEADER.size +
+                             min(count, self.capacity) * SLOT.size])
+            if SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET)[0] == before:
+                break
+        else:
+            return None
+        if magic != MAGIC or not updated:
+            return None
+        devices = {}
+        for slot in SLOT.iter_unpack(data):
+            if idxs is None or slot[0] in idxs:
+                devices[slot[0]] = self._unpack(slot)
+        return devices, updated, before
+
+    def age(self):
+        """ Seconds since the table was last written, inf if never. """
+        updated = HEADER.unpack_from(self._shm.buf, 0)[5]
+        return time.time() - updated if updated else math.inf
+
+    def close(self):
+        self.release()
+        self._shm.close()
+
+    def unlink(self):
+        """ Remove the table from the system. """
+        self._shm.unlink()
+
+    @staticmethod
+    def _pack(device):
+        present = 0
+        level = 0
+        temp = 0.0
+        status = setpoint = b''
+        if device.get('Level') is not None:
+            present |= LEVEL
+            level = int(device['Level'])
+        if device.get('Temp') is not None:
+            present |= TEMP
+            temp = float(device['Temp'])
+        if device.get('Status') is not None:
+            present |= STATUS
+            status = str(device['Status']).encode('utf-8')[:16]
+        if device.get('SetPoint') is not None:
+            present |= SETPOINT
+            setpoint = str(device['SetPoint']).encode('ascii')[:8]
+        return SLOT.pack(int(device['idx']), present, level, temp, status,
+                         setpoint)
+
+    @staticmethod
+    def _unpack(slot):
+        idx, present, level, temp, status, setpoint = slot
+        device = {'idx': str(idx)}
+        if present & LEVEL:
+            device['Level'] = level
+        if present & TEMP:
+            device['Temp'] = temp
+        if present & STATUS:
+            device['Status'] = status.rstrip(b'\0').decode('utf-8', 'replace')
+        if present & SETPOINT:
+            device['SetPoint'] = setpoint.rstrip(b'\0').decode('ascii')
+        return device
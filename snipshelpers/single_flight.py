@@ -0,0 +1,67 @@
+# -*-: coding utf-8 -*-
+""" Concurrent identical calls sharing a single execution. """
+
+import threading
+
+
+class Flight(object):
+    """ A call in progress, and its outcome once done. """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Run a function once for all the threads asking for the same key at
+    the same time: the first caller runs it, the ones coming while it runs
+    wait and get the same result, or exception. The result is shared as is,
+    callers must not modify it.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, timeout=None):
+        """ Return function(), or the result of the call of key in progress.
+
+        :param timeout: seconds to wait for a call in progress, forever by
+                        default.
+        :return: the result, and whether it came from another caller.
+        :raise TimeoutError: when the call in progress did not end in time.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise TimeoutError("Call {} still in progress".format(key))
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+        try:
+            flight.result = function()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self.forget(lambda other: other == key, flight)
+            flight.done.set()
+        return flight.result, False
+
+    def forget(self, predicate, flight=None):
+        """ Let the next callers of the keys matching predicate start a new
+            call, e.g. once the data they read changed. The callers already
+            waiting still get the result of the call in progress.
+        """
+        with self._lock:
+            for key in [key for key in self._flights if predicate(key)]:
+                if flight is None or self._flights[key] is flight:
+                    del self._flights[key]
+
+    def __len__(self):
+        return len(self._flights)
@@ -1,49 +1,201 @@
 # -*-: coding utf-8 -*-
-""" Thread handler. """
+""" Thread handler: scheduler of one-shot and periodic jobs. """
 
+import heapq
+import itertools
+import logging
+import random
 import threading
 import time
 
-from singleton import Singleton
+from .singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+# Job priorities, lower runs first
+HIGH = 0
+NORMAL = 10
+LOW = 20
+
+
+class Job(object):
+    """ Function scheduled on the thread handler. """
+
+    def __init__(self, target, args, priority, interval=None, jitter=0.0):
+        self.target = target
+        self.args = args
+        self.priority = priority
+        self.interval = interval
+        self.jitter = jitter
+        self.cancelled = False
+
+    def cancel(self):
+        """ Do not run the job again. A run in progress is not interrupted. """
+        self.cancelled = True
+
+    def next_delay(self):
+        """ Delay before the next run of a periodic job, jittered so that
+            jobs started together do not stay in step.
+        """
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
 
 
 class ThreadHandler(Singleton):
-    """ Thread handler. """
+    """ Runs jobs on a fixed number of worker threads.
+
+    Jobs are run by priority once due. Workers sleep until a job is added or
+    the next one is due, nothing is polled. Workers are started with the
+    first job.
+    """
 
-    def __init__(self):
-        """ Initialisation. """
-        self.thread_pool = []
-        self.run_events = []
+    def __init__(self, workers=4):
+        """ Initialisation, done once for the shared instance.
+
+        :param workers: the number of worker threads.
+        """
+        if getattr(self, '_condition', None) is not None:
+            return
+        self.workers = int(workers)
+        # Run loop and long running jobs wait on this event
+        self.stopping = threading.Event()
+        self._condition = threading.Condition()
+        self._timers = []
+        self._ready = []
+        self._sequence = itertools.count()
+        self._threads = []
+        self._running = 0
 
-    def run(self, target, args=()):
-        """ Run a function in a separate thread.
+    def run(self, target, args=(), priority=NORMAL):
+        """ Run a function as soon as a worker is free.
 
         :param target: the function to run.
         :param args: the parameters to pass to the function.
+        :param priority: HIGH, NORMAL or LOW.
+        :return: the Job.
         """
-        run_event = threading.Event()
-        run_event.set()
-        thread = threading.Thread(target=target, args=args + (run_event, ))
-        thread.daemon = True
-        self.thread_pool.append(thread)
-        self.run_events.append(run_event)
-        thread.start()
+        return self.schedule(0, target, args, priority)
+
+    def schedule(self, delay, target, args=(), priority=NORMAL):
+        """ Run a function once, in delay seconds.
+
+        :return: the Job, whose cancel() prevents it from running.
+        """
+        job = Job(target, args, priority)
+        self._add(job, delay)
+        return job
+
+    def every(self, interval, target, args=(), priority=LOW, jitter=0.1,
+              delay=None):
+        """ Run a function every interval seconds, the next run being
+        scheduled when the previous one is over.
+
+        :param jitter: relative random variation of each interval, e.g. 0.1
+                       for +/- 10%.
+        :param delay: seconds before the first run, by default one
+                      jittered interval.
+        :return: the Job, whose cancel() stops it.
+        """
+        job = Job(target, args, priority, float(interval), jitter)
+        self._add(job, job.next_delay() if delay is None else delay)
+        return job
+
+    def pending(self):
+        """ Number of jobs waiting to run, periodic ones included. """
+        with self._condition:
+            return len(self._timers) + len(self._ready)
 
     def start_run_loop(self):
-        """ Start the thread handler, ensuring that everything stops property
-            when sending a keyboard interrupt.
+        """ Block until stop() is called, ensuring that everything stops
+            properly when sending a keyboard interrupt.
         """
         try:
-            while 1:
-                time.sleep(.1)
+            self.stopping.wait()
         except (KeyboardInterrupt, SystemExit):
             self.stop()
 
-    def stop(self):
-        """ Stop all functions running in the thread handler."""
-        for run_event in self.run_events:
-            run_event.clear()
+    def stop(self, timeout=None):
+        """ Stop the periodic and delayed jobs, let the workers finish the
+        due ones for at most timeout seconds, then return.
+
+        :return: True if every worker stopped in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self.stopping.set()
+            for _, _, job in self._timers:
+                job.cancel()
+            self._timers = []
+            self._condition.notify_all()
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join(None if deadline is None
+                        else max(0, deadline - time.monotonic()))
+        stopped = not any(thread.is_alive() for thread in threads)
+        if not stopped:
+            logger.warning("Thread handler stopped with jobs still running")
+        return stopped
+
+    def _add(self, job, delay):
+        with self._condition:
+            if self.stopping.is_set():
+                logger.debug("Thread handler stopped, {} not scheduled".format(
+                    getattr(job.target, '__name__', job.target)))
+                job.cancel()
+                return
+            if delay > 0:
+                heapq.heappush(self._timers, (
+                    time.monotonic() + delay, next(self._sequence), job))
+            else:
+                heapq.heappush(self._ready, (
+                    job.priority, next(self._sequence), job))
+            self._grow()
+            self._condition.notify()
+
+    def _grow(self):
+        # One more worker when the due jobs outnumber the idle workers, and
+        # always one to wait for the delayed jobs.
+        if len(self._threads) < self.workers and (
+                not self._threads or
+                self._running + len(self._ready) > len(self._threads)):
+            thread = threading.Thread(
+                target=self._work,
+                name='thread-handler-{}'.format(len(self._threads)))
+            thread.daemon = True
+            self._threads.append(thread)
+            thread.start()
 
-        for thread in self.thread_pool:
-            thread.join()
+    def _next(self):
+        # Return the next job to run, or None when stopping
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    _, sequence, job = heapq.heappop(self._timers)
+                    heapq.heappush(self._ready, (job.priority, sequence, job))
+                self._grow()
+                if self._ready:
+                    job = heapq.heappop(self._ready)[2]
+                    if job.cancelled:
+                        continue
+                    self._running += 1
+                    return job
+                if self.stopping.is_set():
+                    return None
+                timeout = self._timers[0][0] - now if self._timers else None
+                self._condition.wait(timeout)
 
+    def _work(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            try:
+                job.target(*job.args)
+            except Exception:
+                logger.exception("Job {} failed".format(
+                    getattr(job.target, '__name__', job.target)))
+            finally:
+                with self._condition:
+                    self._running -= 1
+            if job.interval is not None and not job.cancelled:
+                self._add(job, job.next_delay())
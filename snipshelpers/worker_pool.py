@@ -0,0 +1,108 @@
+# -*-: coding utf-8 -*-
+""" Bounded worker pool keeping tasks ordered per key. """
+
+import collections
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedWorkerPool(object):
+    """ Fixed number of worker threads sharing a bounded queue.
+
+    Tasks submitted with the same key run one after the other, in
+    submission order: a task waits for the previous one of its key, not
+    for the tasks of other keys. The first free worker takes the next task
+    of the queue, and runs the tasks chained behind it for the same key.
+    """
+
+    def __init__(self, workers=4, queue_size=16, name='worker'):
+        """ Initialisation.
+
+        :param workers: the number of worker threads.
+        :param queue_size: the maximum number of waiting tasks per worker.
+        :param name: prefix of the worker thread names.
+        """
+        self._capacity = workers * queue_size
+        # Tasks ready to run, and None to stop a worker
+        self._tasks = queue.Queue()
+        # Tasks waiting for the one of their key in progress: {key: deque}
+        self._chains = {}
+        self._pending = 0
+        self._room = threading.Condition()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work,
+                                      name='{}-{}'.format(name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, key, target, args=(), timeout=None):
+        """ Queue target(*args) behind the tasks already submitted for key.
+
+        Blocks while the queue is full.
+
+        :param key: the ordering key, e.g. a session id.
+        :param target: the function to run.
+        :param args: the parameters to pass to the function.
+        :param timeout: seconds to wait for room in the queue.
+        :raises queue.Full: if the queue is still full after timeout.
+        """
+        with self._room:
+            if not self._room.wait_for(
+                    lambda: self._pending < self._capacity, timeout):
+                raise queue.Full
+            self._pending += 1
+            chain = self._chains.get(key)
+            if chain is not None:
+                chain.append((target, args))
+                return
+            self._chains[key] = collections.deque()
+        self._tasks.put((key, target, args))
+
+    def depth(self):
+        """ Number of tasks waiting to run. """
+        return self._pending
+
+    def capacity(self):
+        """ Maximum number of tasks that can wait to run. """
+        return self._capacity
+
+    def stop(self, timeout=None):
+        """ Let the workers finish the queued tasks, then stop them.
+
+        :param timeout: seconds to wait for all the workers, forever by
+                        default.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for _ in self._threads:
+            self._tasks.put_nowait(None)
+        for thread in self._threads:
+            thread.join(None if deadline is None else
+                        max(0, deadline - time.monotonic()))
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            key, target, args = task
+            while True:
+                with self._room:
+                    self._pending -= 1
+                    self._room.notify()
+                try:
+                    target(*args)
+                except Exception:
+                    logger.exception("Task {} failed".format(target.__name__))
+                # Next task of the same key, if any
+                with self._room:
+                    chain = self._chains[key]
+                    if not chain:
+                        del self._chains[key]
+                        break
+                    target, args = chain.popleft()
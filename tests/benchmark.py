@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Benchmark of SVT and of the intent handlers against an in-process fake
+# Domoticz. Results are written as JSON, to compare runs over time:
+#
+#   python3 tests/benchmark.py --devices 1000 --latency 0.005 -o bench.json
+#
+# Import required Python libraries
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from fake_domoticz import FakeDomoticz
+from fake_hermes import FakeHermes, FakeIntentMessage, load_action
+
+from SVT import SVT
+from SVTRegistry import SVTRegistry
+from snipshelpers.json_stream import iter_array
+from snipshelpers.worker_pool import KeyedWorkerPool
+
+PROPERTIES = ('mode', 'state', 'pause', 'indoorTemp', 'outdoorTemp',
+              'setpointNormal', 'setpointEconomy', 'isOn')
+
+# Intent branches: (name, intent, slots, control level, mode level)
+BRANCHES = (
+    ('mode jour', 'ericvde31830:thermostatMode',
+     {'thermostat_mode': 'jour'}, 20, 20),
+    ('mode nuit', 'ericvde31830:thermostatMode',
+     {'thermostat_mode': 'nuit'}, 10, 10),
+    ('mode forcé', 'ericvde31830:thermostatMode',
+     {'thermostat_mode': 'forcé'}, 10, 10),
+    ('turn off', 'ericvde31830:thermostatTurnOff',
+     {'temperature_device': 'chauffage'}, 10, 10),
+    ('shift up jour', 'ericvde31830:thermostatShift',
+     {'up_down': 'up'}, 10, 10),
+    ('shift up nuit', 'ericvde31830:thermostatShift',
+     {'up_down': 'up'}, 10, 20),
+    ('shift up stop', 'ericvde31830:thermostatShift',
+     {'up_down': 'up'}, 0, 10),
+    ('shift down jour', 'ericvde31830:thermostatShift',
+     {'up_down': 'down'}, 10, 10),
+    ('shift down nuit', 'ericvde31830:thermostatShift',
+     {'up_down': 'down'}, 10, 20),
+    ('shift down forcé', 'ericvde31830:thermostatShift',
+     {'up_down': 'down'}, 20, 10),
+)
+
+
+def summary(samples):
+    """ Latency statistics of a list of durations, in milliseconds. """
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {
+        'count': len(samples),
+        'mean_ms': statistics.mean(samples) * 1000,
+        'p50_ms': samples[len(samples) // 2] * 1000,
+        'p90_ms': samples[min(len(samples) - 1, int(len(samples) * 0.90))] * 1000,
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        'max_ms': samples[-1] * 1000
+    }
+
+
+def bench_discovery(args):
+    results = {}
+    for devices in args.device_counts:
+        fake = FakeDomoticz(devices=devices, latency=args.latency).start()
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            SVT(fake.ip, fake.port)
+            samples.append(time.perf_counter() - start)
+        results[str(devices)] = summary(samples)
+        fake.stop()
+    return results
+
+
+def traced(parse, repeat):
+    """ Durations of parse() and its peak of allocated memory in kB. """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse()
+        samples.append(time.perf_counter() - start)
+    tracemalloc.start()
+    parse()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dict(summary(samples), peak_kb=peak / 1024)
+
+
+def bench_parsing(args):
+    """ Decoding of the getlightswitches response the discovery reads:
+        whole document with json.loads, or streamed keeping the SVT
+        devices only.
+    """
+    fields = ('idx', 'Name')
+    results = {}
+    for devices in args.device_counts:
+        fake = FakeDomoticz(devices=devices)
+        body = json.dumps(fake.answer(
+            {'type': 'command', 'param': 'getlightswitches'})).encode('utf-8')
+        chunks = [body[i:i + 65536] for i in range(0, len(body), 65536)]
+
+        def loads():
+            return [{field: device[field] for field in fields}
+                    for device in json.loads(body.decode('utf-8'))['result']
+                    if device['Name'].startswith('SVT')]
+
+        def stream():
+            return [{field: device[field] for field in fields}
+                    for device in iter_array(iter(chunks))
+                    if device['Name'].startswith('SVT')]
+
+        assert loads() == stream()
+        results[str(devices)] = {
+            'bytes': len(body),
+            'loads': traced(loads, args.repeat),
+            'stream': traced(stream, args.repeat)
+        }
+    return results
+
+
+def bench_properties(args):
+    fake = FakeDomoticz(devices=args.devices, latency=args.latency).start()
+    thermostat = SVT(fake.ip, fake.port)
+    results = {}
+    for name in PROPERTIES:
+        cold, warm = [], []
+        for _ in range(args.repeat):
+            thermostat.client.snapshot.invalidate()
+            start = time.perf_counter()
+            getattr(thermostat, name)
+            cold.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            getattr(thermostat, name)
+            warm.append(time.perf_counter() - start)
+        results[name] = {'cold': summary(cold), 'warm': summary(warm)}
+    fake.stop()
+    return results
+
+
+def new_action(action, fake, workers=None, **options):
+    options.setdefault('serveStale', action.OPTIMISTIC)
+    action.registry = SVTRegistry([{'ip': fake.ip, 'port': fake.port}],
+                                  coalesceWindow=0, **options)
+    action.workers = workers
+    return action.registry
+
+
+def bench_intents(action, args):
+    """ HTTP calls and latency of each intent branch, on a warm registry. """
+    results = {}
+    for name, intent, slots, control, mode in BRANCHES:
+        fake = FakeDomoticz(devices=args.devices, latency=args.latency).start()
+        fake.devices[1]['Level'] = control
+        fake.devices[3]['Level'] = mode
+        registry = new_action(action, fake)
+        registry.route().snapshot()
+        fake.reset()
+
+        hermes = FakeHermes()
+        message = FakeIntentMessage(intent, slots)
+        start = time.monotonic()
+        action.run_intent(action.INTENT_HANDLERS[intent], hermes, message)
+        # Until the answer, the writes of an optimistic one come after
+        elapsed = hermes.ended.get(message.session_id, start) - start
+        results[name] = {
+            'http_calls': fake.count(),
+            'calls': {verb: fake.count(verb) for verb in set(fake.calls)},
+            'latency_ms': elapsed * 1000,
+            'sentence': hermes.sentences.get(message.session_id)
+        }
+        fake.stop()
+    return results
+
+
+def bench_throughput(action, args):
+    """ Intents per second through intent_received and the worker pool. """
+    fake = FakeDomoticz(devices=args.devices, latency=args.latency).start()
+    results = {}
+    for concurrency in args.concurrency:
+        registry = new_action(action, fake,
+                              KeyedWorkerPool(concurrency, args.intents),
+                              poolSize=concurrency)
+        registry.route().snapshot()
+        fake.reset()
+        hermes = FakeHermes()
+        sent = {}
+        start = time.perf_counter()
+        for i in range(args.intents):
+            intent, slots = BRANCHES[i % len(BRANCHES)][1:3]
+            message = FakeIntentMessage(intent, slots, 'session-{}'.format(i))
+            sent[message.session_id] = time.monotonic()
+            action.intent_received(hermes, message)
+        hermes.wait(args.intents, timeout=300)
+        elapsed = time.perf_counter() - start
+        action.workers.stop()
+        latencies = [hermes.ended[session] - sent[session]
+                     for session in hermes.ended]
+        results[str(concurrency)] = {
+            'intents': args.intents,
+            'completed': len(hermes.ended),
+            'intents_per_s': len(hermes.ended) / elapsed,
+            'http_calls': fake.count(),
+            'latency': summary(latencies)
+        }
+    fake.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark SVT against a fake Domoticz')
+    parser.add_argument('--devices', type=int, default=200,
+                        help='filler devices on the fake Domoticz')
+    parser.add_argument('--device-counts', type=int, nargs='+',
+                        default=[0, 100, 1000, 5000],
+                        help='device counts of the discovery benchmark')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='seconds added to every fake Domoticz response')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--intents', type=int, default=200,
+                        help='intents sent by the throughput benchmark')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 4, 8], help='worker counts')
+    parser.add_argument('--optimistic', action='store_true',
+                        help='answer intents before writing to domoticz')
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    action = load_action()
+    action.OPTIMISTIC = args.optimistic
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'parameters': vars(args),
+        'discovery': bench_discovery(args),
+        'parsing': bench_parsing(args),
+        'properties': bench_properties(args),
+        'intents': bench_intents(action, args),
+        'throughput': bench_throughput(action, args)
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
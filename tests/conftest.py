@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Shared fixtures of the unit tests: python3 -m pytest tests
+#
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from fake_domoticz import FakeDomoticz  # noqa: E402
+from fake_hermes import load_action  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+
+@pytest.fixture
+def fake():
+    """ A fake Domoticz server with one SVT zone and a few other devices. """
+    server = FakeDomoticz(devices=20).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def config(fake, tmp_path):
+    """ Configuration of the action, with the fake server as domoticz. """
+    return {'global': {
+        'ip_domoticz': fake.ip, 'port': str(fake.port),
+        'discovery_cache': str(tmp_path / 'discovery.json'),
+        'discovery_refresh': '0', 'heating_model_refresh': '0'}}
+
+
+@pytest.fixture
+def action():
+    """ The action module, its zones stopped after the test. """
+    action = load_action()
+    yield action
+    action.stop_zones(action.registry, action.discovery, action.feed,
+                      action.learner)
+    action.DomoticzClient.reset()
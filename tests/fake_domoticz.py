@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# In-process fake Domoticz JSON API, for benchmarks and load tests.
+# It serves SVT zones plus any number of filler devices, with an optional
+# latency injected in every response, and counts the calls it receives.
+#
+# Import required Python libraries
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeDomoticz:
+    'Fake Domoticz server'
+
+    def __init__(self, zones=1, devices=0, latency=0.0, jitter=0.0):
+        """ :param zones: number of SVT hardware, the first one is 'SVT' and
+                          the next ones 'SVT Zone <n>'.
+            :param devices: number of filler devices.
+            :param latency: seconds added to every response.
+            :param jitter: random extra seconds added to every response.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.devices = {}
+        self.hardware = []
+        self.calls = []
+        # Temperature logs served by 'type=graph': {idx: [records]}
+        self.logs = {}
+        # Switch logs served by 'type=lightlog': {idx: [records]}
+        self.switchLogs = {}
+        # Rooms served by 'type=plans': {idx: name}
+        self.plans = {}
+        # Timers served by 'type=timers': {idx: [timers]}
+        self.timers = {}
+        self._lock = threading.Lock()
+        self._nextIdx = 1
+
+        for zone in range(zones):
+            name = 'SVT' if zone == 0 else 'SVT Zone {}'.format(zone)
+            self.addZone(name)
+        for i in range(devices):
+            self._add('Light/Switch' if i % 2 else 'Temp',
+                      'Device {}'.format(i),
+                      {'Status': 'Off', 'SwitchType': 'On/Off'}
+                      if i % 2 else {'Temp': 20.0})
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.ip, self.port = self._server.server_address
+
+    def addZone(self, name):
+        """ Add the hardware and devices of an SVT zone. """
+        control = self._add('Light/Switch', name + ' - Thermostat Control',
+                            {'SwitchType': 'Selector', 'Level': 10})
+        self._add('Light/Switch', name + ' - Thermostat Pause',
+                  {'SwitchType': 'On/Off', 'Status': 'Off'})
+        self._add('Light/Switch', name + ' - Thermostat Mode',
+                  {'SwitchType': 'Selector', 'Level': 10})
+        self._add('Thermostat', name + ' - Setpoint Normal',
+                  {'SubType': 'SetPoint', 'SetPoint': '20.5'})
+        self._add('Thermostat', name + ' - Setpoint Economy',
+                  {'SubType': 'SetPoint', 'SetPoint': '18.0'})
+        indoor = self._add('Temp', name + ' Indoor', {'Temp': 19.5})
+        outdoor = self._add('Temp', name + ' Outdoor', {'Temp': 8.0})
+        heater = self._add('Light/Switch', name + ' Heater',
+                           {'SwitchType': 'On/Off', 'Status': 'On'})
+        self.hardware.append({'idx': str(len(self.hardware) + 1),
+                              'Name': name, 'Extra': 'SVT',
+                              'Mode1': str(indoor), 'Mode2': str(outdoor),
+                              'Mode3': str(heater)})
+        return control
+
+    def start(self):
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        """ Forget the calls received so far. """
+        with self._lock:
+            self.calls = []
+
+    def count(self, verb=None):
+        """ Number of calls received, of one verb only if given. """
+        with self._lock:
+            return sum(1 for call in self.calls if verb in (None, call))
+
+    def rename(self, idx, name):
+        """ Rename a device. As in Domoticz, its last update time is left
+            unchanged.
+        """
+        with self._lock:
+            self.devices[idx]['Name'] = name
+
+    def touch(self, idx, **fields):
+        """ Update a device and its last update time. """
+        with self._lock:
+            self.devices[idx].update(fields)
+            self._touch(self.devices[idx])
+
+    def _touch(self, device):
+        device['LastUpdate'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    def _add(self, dtype, name, fields):
+        idx = self._nextIdx
+        self._nextIdx += 1
+        device = {'idx': str(idx), 'Name': name, 'Type': dtype,
+                  'PlanIDs': [0]}
+        self._touch(device)
+        device.update(fields)
+        self.devices[idx] = device
+        return idx
+
+    def answer(self, query):
+        """ Return the JSON response of a json.htm query dict. """
+        kind = query.get('type')
+        param = query.get('param')
+        if kind == 'command' and param == 'getlightswitches':
+            return self._result(lambda d: d['Type'] == 'Light/Switch')
+        if kind == 'command' and param == 'switchlight':
+            device = self.devices[int(query['idx'])]
+            if query.get('switchcmd') == 'Set Level':
+                device['Level'] = int(query['level'])
+            else:
+                device['Status'] = query.get('switchcmd')
+            self._touch(device)
+            return {'status': 'OK'}
+        if kind == 'command' and param == 'setsetpoint':
+            device = self.devices[int(query['idx'])]
+            device['SetPoint'] = query['setpoint']
+            self._touch(device)
+            return {'status': 'OK'}
+        if kind == 'hardware':
+            return {'status': 'OK', 'result': self.hardware}
+        if kind == 'plans':
+            return {'status': 'OK',
+                    'result': [{'idx': str(idx), 'Name': name}
+                               for idx, name in sorted(self.plans.items())]}
+        if kind == 'timers':
+            return {'status': 'OK',
+                    'result': self.timers.get(int(query['idx']), [])}
+        if kind == 'graph':
+            return {'status': 'OK',
+                    'result': self.logs.get(int(query['idx']), [])}
+        if kind == 'lightlog':
+            return {'status': 'OK',
+                    'result': self.switchLogs.get(int(query['idx']), [])}
+        if kind == 'devices' and 'rid' in query:
+            device = self.devices.get(int(query['rid']))
+            return {'status': 'OK', 'result': [device] if device else []}
+        if kind == 'devices':
+            filters = {
+                'utility': lambda d: d['Type'] == 'Thermostat',
+                'temp': lambda d: d['Type'] == 'Temp',
+                'light': lambda d: d['Type'] == 'Light/Switch'
+            }
+            keep = filters.get(query.get('filter'), lambda d: True)
+            if 'lastupdate' in query:
+                # Devices updated strictly after the lastupdate timestamp
+                since = int(query['lastupdate'])
+                return self._result(lambda d: keep(d) and time.mktime(
+                    time.strptime(d['LastUpdate'], '%Y-%m-%d %H:%M:%S')) > since)
+            return self._result(keep)
+        return {'status': 'ERR'}
+
+    def _result(self, keep):
+        return {'ActTime': int(time.time()), 'status': 'OK',
+                'result': [d for d in self.devices.values() if keep(d)]}
+
+    @staticmethod
+    def verb(query):
+        """ Name of an API call, e.g. 'switchlight' or 'devices&rid'. """
+        if query.get('type') == 'command':
+            return query.get('param')
+        if query.get('type') == 'devices' and 'rid' in query:
+            return 'devices&rid'
+        return query.get('type')
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = {key: values[0] for key, values in
+                         parse_qs(urlparse(self.path).query).items()}
+                with fake._lock:
+                    fake.calls.append(fake.verb(query))
+                    body = json.dumps(fake.answer(query)).encode('utf-8')
+                delay = fake.latency + random.uniform(0, fake.jitter)
+                if delay:
+                    time.sleep(delay)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
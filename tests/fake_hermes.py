@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Fake Hermes and intent messages, mimicking the parts of hermes_python
+# used by the action, so that its handlers can run without a broker.
+#
+# Import required Python libraries
+import importlib.util
+import os
+import sys
+import threading
+import time
+import types
+
+
+class FakeHermes:
+    'Records the sessions ended by the action'
+
+    def __init__(self):
+        self.sentences = {}
+        self.notifications = []
+        self.ended = {}
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+
+    def publish_end_session(self, session_id, text):
+        with self._lock:
+            self.sentences[session_id] = text
+            self.ended[session_id] = time.monotonic()
+            self._done.notify_all()
+
+    def publish_start_session_notification(self, site_id, text, custom_data=None):
+        with self._lock:
+            self.notifications.append((site_id, text))
+
+    def wait(self, count, timeout=None):
+        """ Wait until count sessions have been ended. """
+        with self._lock:
+            return self._done.wait_for(lambda: len(self.ended) >= count,
+                                       timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class _Value:
+    def __init__(self, value):
+        self.value = value
+
+
+class _SlotValue:
+    def __init__(self, value, raw_value):
+        self.raw_value = raw_value
+        self.slot_value = types.SimpleNamespace(value=_Value(value))
+
+
+class _SlotValues(list):
+    def first(self):
+        return self[0].slot_value.value
+
+
+class _Slots:
+    def __init__(self, slots):
+        self._slots = {name: _SlotValues([_SlotValue(value, str(value))])
+                       for name, value in slots.items()}
+
+    def items(self):
+        return self._slots.items()
+
+    def __getattr__(self, name):
+        # hermes_python returns an empty, falsy, list for missing slots
+        return self.__dict__['_slots'].get(name, _SlotValues())
+
+
+class FakeIntentMessage:
+    'Intent message with the attributes the action reads'
+
+    def __init__(self, intent_name, slots=None, session_id='session',
+                 site_id='default'):
+        self.intent = types.SimpleNamespace(intent_name=intent_name)
+        self.slots = _Slots(slots or {})
+        self.session_id = session_id
+        self.site_id = site_id
+
+
+def load_action(path=None):
+    """ Import action-thermostat-domoticz.py as a module, backed by a fake
+        hermes_python when the real one is not installed.
+    """
+    if 'hermes_python' not in sys.modules:
+        try:
+            import hermes_python.hermes  # noqa: F401
+        except ImportError:
+            hermes_python = types.ModuleType('hermes_python')
+            hermes_module = types.ModuleType('hermes_python.hermes')
+            hermes_module.Hermes = FakeHermes
+            hermes_python.hermes = hermes_module
+            sys.modules['hermes_python'] = hermes_python
+            sys.modules['hermes_python.hermes'] = hermes_module
+
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    path = path or os.path.join(root, 'action-thermostat-domoticz.py')
+    spec = importlib.util.spec_from_file_location('action', path)
+    action = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(action)
+    return action
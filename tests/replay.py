@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Author: Eric Vandecasteele 2019
+# http://blog.onlinux.fr
+#
+# Load test of the action: intents recorded with intent_capture (see
+# config.ini), or synthetic ones, are fed through intent_received at
+# increasing rates, against a fake Hermes and a fake Domoticz. Latency
+# percentiles are reported for each rate, and the saturation point: the
+# first rate the action cannot keep up with.
+#
+#   python3 tests/replay.py --rates 5 10 20 40 80 --count 400
+#   python3 tests/replay.py --input intents.jsonl --rates 10 20 40
+#   python3 tests/replay.py --input intents.jsonl --as-recorded --speed 10
+#
+# Intents are sent from a single thread, as hermes does, at their scheduled
+# time whatever the previous ones became. Latencies are measured from that
+# scheduled time, so that a blocked sender does not hide queueing delays.
+#
+# Import required Python libraries
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+from benchmark import BRANCHES, new_action, summary
+from fake_domoticz import FakeDomoticz
+from fake_hermes import FakeHermes, FakeIntentMessage, load_action
+
+from snipshelpers.intent_recorder import read_intents
+from snipshelpers.worker_pool import KeyedWorkerPool
+
+BUSY = "Désolée, je suis occupée. Réessaie dans un instant."
+UNAVAILABLE = "Désolée, Domoticz ne répond pas."
+
+
+def recorded(path):
+    """ Traffic of a capture file: [(seconds since the first intent,
+        intent name, slots, site id)].
+    """
+    intents = read_intents(path)
+    if not intents:
+        return []
+    first = intents[0].get('time', 0)
+    return [(intent.get('time', first) - first, intent['intent'],
+             intent.get('slots', {}), intent.get('site_id', 'default'))
+            for intent in intents]
+
+
+def synthetic():
+    """ Traffic cycling through the intent branches of the benchmark. """
+    return [(0, intent, slots, 'default')
+            for _, intent, slots, _, _ in BRANCHES]
+
+
+def schedule(traffic, count, rate=None, speed=1.0):
+    """ [(due offset in seconds, intent, slots, site id)] of count intents,
+        sent every 1 / rate seconds, or at their recorded offsets divided
+        by speed without rate.
+    """
+    if rate is None:
+        return [(offset / speed, intent, slots, site)
+                for offset, intent, slots, site in traffic[:count]]
+    return [(i / rate, intent, slots, site)
+            for i, (_, intent, slots, site) in
+            zip(range(count), itertools.cycle(traffic))]
+
+
+def run(action, sends, args):
+    """ Send intents to a fresh action and report how it coped. """
+    fake = FakeDomoticz(zones=args.zones, devices=args.devices,
+                        latency=args.latency, jitter=args.jitter).start()
+    workers = KeyedWorkerPool(args.workers, args.queue_size, 'intent')
+    registry = new_action(action, fake, workers, poolSize=args.workers)
+    registry.route().snapshot()
+    fake.reset()
+
+    hermes = FakeHermes()
+    due = {}
+    start = time.monotonic() + 0.1
+    for i, (offset, intent, slots, site) in enumerate(sends):
+        delay = start + offset - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        message = FakeIntentMessage(intent, slots, 'replay-{}'.format(i), site)
+        due[message.session_id] = start + offset
+        action.intent_received(hermes, message)
+    sent = time.monotonic()
+    hermes.wait(len(sends), timeout=args.timeout)
+    workers.stop()
+    fake.stop()
+
+    ended = dict(hermes.ended)
+    sentences = dict(hermes.sentences)
+    latencies = [ended[session] - due[session] for session in ended]
+    # Answers per second from the first answer to the last one, the
+    # offered rate when the action keeps up
+    first, last = min(ended.values(), default=0), max(ended.values(), default=0)
+    offered = sends[-1][0] if sends else 0
+    return {
+        'sent': len(sends),
+        'completed': len(ended),
+        'rejected': sum(1 for text in sentences.values() if text == BUSY),
+        'unavailable': sum(1 for text in sentences.values()
+                           if text == UNAVAILABLE),
+        'offered_per_s': (len(sends) - 1) / offered if offered else None,
+        'achieved_per_s': (len(ended) - 1) / (last - first)
+        if last > first else None,
+        'send_lag_ms': max(0, sent - start - offered) * 1000,
+        'http_calls': fake.count(),
+        'latency': summary(latencies)
+    }
+
+
+def saturated(result, rate, slo):
+    """ Whether the action did not keep up with an offered rate. """
+    latency = result['latency']
+    return result['completed'] < result['sent'] or result['rejected'] > 0 \
+        or result['achieved_per_s'] is None \
+        or result['achieved_per_s'] < 0.95 * rate \
+        or latency.get('p99_ms', 0) > slo
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay intents against a fake Domoticz')
+    parser.add_argument('-i', '--input',
+                        help='intents recorded with intent_capture, '
+                             'synthetic ones by default')
+    parser.add_argument('--rates', type=float, nargs='+',
+                        default=[5, 10, 20, 40, 80],
+                        help='intents per second, one run each')
+    parser.add_argument('--count', type=int, default=200,
+                        help='intents sent per run')
+    parser.add_argument('--as-recorded', action='store_true',
+                        help='one run with the recorded timing')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='speed up factor of the recorded timing')
+    parser.add_argument('--slo', type=float, default=1000,
+                        help='p99 latency in ms above which a rate is '
+                             'saturated')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--queue-size', type=int, default=16)
+    parser.add_argument('--zones', type=int, default=1)
+    parser.add_argument('--devices', type=int, default=200,
+                        help='filler devices on the fake Domoticz')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='seconds added to every fake Domoticz response')
+    parser.add_argument('--jitter', type=float, default=0.005,
+                        help='random seconds added to every response')
+    parser.add_argument('--optimistic', action='store_true',
+                        help='answer intents before writing to domoticz')
+    parser.add_argument('--timeout', type=float, default=120,
+                        help='seconds to wait for the answers of a run')
+    parser.add_argument('-o', '--output', default='replay_results.json')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    action = load_action()
+    action.OPTIMISTIC = args.optimistic
+    traffic = recorded(args.input) if args.input else synthetic()
+    if not traffic:
+        parser.error('no intent in {}'.format(args.input))
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'parameters': vars(args),
+        'runs': {}
+    }
+    if args.as_recorded:
+        sends = schedule(traffic, args.count, speed=args.speed)
+        results['runs']['recorded'] = run(action, sends, args)
+    else:
+        results['saturation_per_s'] = None
+        results['sustained_per_s'] = None
+        for rate in sorted(args.rates):
+            result = run(action, schedule(traffic, args.count, rate), args)
+            results['runs'][str(rate)] = result
+            latency = result['latency']
+            print("{:>8.1f}/s: {} answered, p50 {:.0f} ms, p99 {:.0f} ms, "
+                  "{} rejected".format(rate, result['completed'],
+                                       latency.get('p50_ms', 0),
+                                       latency.get('p99_ms', 0),
+                                       result['rejected']))
+            if saturated(result, rate, args.slo):
+                results['saturation_per_s'] = rate
+                break
+            results['sustained_per_s'] = rate
+        print("Sustained: {} intents/s, saturated at: {}".format(
+            results['sustained_per_s'], results['saturation_per_s']))
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+
+def test_zones_found_later_get_a_history_and_a_schedule(fake, config,
+                                                        action):
+    # The temperature history requires numpy
+    pytest.importorskip('numpy')
+    assert action.apply_config(config)
+    first = action.registry.route()
+    assert set(action.histories) == set(action.schedules) == {first}
+    # Found by the periodic discovery
+    fake.addZone('SVT Zone 1')
+    action.registry.rediscover()
+    second = action.registry.route('zone 1')
+    assert second is not None
+    assert set(action.histories) == set(action.schedules) == {first, second}
+    assert action.schedules[second].thermostat is second
+
+
+def test_reload_replaces_the_histories_and_schedules(fake, config, action):
+    assert action.apply_config(config)
+    old = action.registry.route()
+    config['global']['history_interval'] = '0'
+    assert action.apply_config(config)
+    new = action.registry.route()
+    assert new is not old
+    assert action.histories == {}
+    assert set(action.schedules) == {new}
+    fake.addZone('SVT Zone 1')
+    action.registry.rediscover()
+    assert len(action.schedules) == 2
+
+
+def test_start_does_not_wait_for_domoticz(fake, config, action):
+    # Discovery is cached by a first start
+    action.open_registry(config).close()
+    action.DomoticzClient.reset()
+    fake.latency = 2
+    start = time.monotonic()
+    action.registry = action.open_registry(config)
+    assert time.monotonic() - start < 1
+    assert action.registry.route() is not None
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os
+
+from fake_domoticz import FakeDomoticz
+from snipshelpers.config_watcher import ConfigWatcher
+
+
+def write(path, text, mtime):
+    path.write_text(text)
+    # Changes within the same clock tick are still seen
+    os.utime(str(path), ns=(mtime, mtime))
+
+
+def test_watcher_applies_a_settled_change(tmp_path):
+    path = tmp_path / 'config.ini'
+    write(path, '[global]\nport=8080\n', 1000)
+    changes = []
+    watcher = ConfigWatcher(str(path), changes.append, interval=60)
+    assert not watcher.check()
+    write(path, '[global]\nport=8081\n', 2000)
+    # Still being written, maybe
+    assert not watcher.check()
+    assert watcher.check()
+    assert changes == [{'global': {'port': '8081'}}]
+    assert not watcher.check()
+
+
+def test_watcher_ignores_saves_without_change(tmp_path):
+    path = tmp_path / 'config.ini'
+    write(path, '[global]\nport=8080\n', 1000)
+    changes = []
+    watcher = ConfigWatcher(str(path), changes.append, interval=60)
+    watcher._config = {'global': {'port': '8080'}}
+    write(path, '[global]\nport = 8080\n', 2000)
+    watcher.check()
+    assert not watcher.check()
+    # Unreadable
+    write(path, 'port=8081\n', 3000)
+    watcher.check()
+    assert not watcher.check()
+    assert changes == []
+
+
+def test_reload_moves_to_the_new_server(fake, config, action):
+    assert action.apply_config(config)
+    old = action.registry
+    other = FakeDomoticz(zones=0)
+    other.addZone('SVT Etage')
+    other.start()
+    try:
+        config['global']['port'] = str(other.port)
+        assert action.apply_config(config)
+        assert action.registry is not old and old.closed
+        assert action.registry.route('etage').port == str(other.port)
+        assert action.registry.route('etage').indoorTemp == 19.5
+    finally:
+        other.stop()
+
+
+def test_bad_config_keeps_the_current_zones(fake, config, action):
+    assert action.apply_config(config)
+    current = action.registry
+    thermostat = current.route()
+    bad = {'global': dict(config['global'], pool_size='many')}
+    assert not action.apply_config(bad)
+    assert action.registry is current and not current.closed
+    # The current zones still reach Domoticz
+    fake.reset()
+    thermostat.client.snapshot.invalidate()
+    assert thermostat.indoorTemp == 19.5
+    assert 'devices' in fake.calls
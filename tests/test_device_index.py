@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from DeviceIndex import DeviceIndex, namePrefixes
+from SVT import DomoticzClient
+
+
+@pytest.fixture
+def index(fake):
+    # Devices last updated an hour ago, so that delta syncs only fetch the
+    # ones changed by the test
+    for device in fake.devices.values():
+        device['LastUpdate'] = time.strftime(
+            '%Y-%m-%d %H:%M:%S', time.localtime(time.time() - 3600))
+    fake.plans = {1: 'Salon', 2: 'Chambre'}
+    fake.devices[1]['PlanIDs'] = [1]
+    fake.devices[2]['PlanIDs'] = [1, 2]
+    index = DeviceIndex(DomoticzClient(fake.ip, fake.port).select)
+    assert index.sync() == len(fake.devices)
+    return index
+
+
+def test_name_prefixes():
+    assert namePrefixes('SVT - Mode') == ['SVT', 'SVT -', 'SVT - Mode']
+    assert namePrefixes('Salon') == ['Salon']
+
+
+def test_lookups(fake, index):
+    assert index.find('SVT - Thermostat Mode') == 3
+    assert index.get(3)['Name'] == 'SVT - Thermostat Mode'
+    # Only the indexed fields are kept
+    assert 'Level' not in index.get(3)
+    assert [d['idx'] for d in index.byPrefix('SVT -')] == \
+        [str(idx) for idx in range(1, 6)]
+    assert len(index.byPrefix('SVT')) == 8
+    assert index.byPrefix('SVT - Therm') == []
+    assert len(index.byType('Thermostat')) == 2
+    assert [d['idx'] for d in index.byRoom('salon')] == ['1', '2']
+    assert [d['idx'] for d in index.byRoom(2)] == ['2']
+    assert index.rooms() == {1: 'Salon', 2: 'Chambre'}
+
+
+def test_delta_sync(fake, index):
+    fake.touch(3, Name='SVT - Mode')
+    fake.addZone('SVT Zone 1')
+    assert index.sync() == 1 + 8
+    assert index.find('SVT - Mode') == 3
+    assert index.find('SVT - Thermostat Mode') is None
+    assert len(index.byPrefix('SVT Zone 1')) == 8
+    assert fake.calls[-1] == 'devices'
+
+
+def test_recreated_device(fake, index):
+    # Deleted then created again under a new idx
+    fake.devices.pop(3)
+    created = fake._add('Light/Switch', 'SVT - Thermostat Mode', {})
+    index.sync()
+    assert index.find('SVT - Thermostat Mode') == created
+    # Deleted devices are only dropped by a full sync
+    assert index.get(3) is not None
+    index.sync(full=True)
+    assert index.get(3) is None
+    assert index.find('SVT - Thermostat Mode') == created
+
+
+def test_renamed_device_needs_a_full_sync(fake, index):
+    fake.rename(3, 'Mode')
+    assert index.sync() == 0
+    assert index.find('Mode') is None
+    assert index.sync(full=True) == len(fake.devices)
+    assert index.find('Mode') == 3
+
+
+def test_full_sync_interval(fake, index):
+    index.fullInterval = 0
+    fake.reset()
+    assert index.sync() == len(fake.devices)
+    assert fake.calls == ['devices', 'plans']
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from SVT import DeviceSnapshot, DomoticzClient
+
+
+def snapshot(fake, **kwargs):
+    client = DomoticzClient(fake.ip, fake.port)
+    snapshot = DeviceSnapshot(client.DomoticzAPI, 0.05, client.select,
+                              **kwargs)
+    snapshot.track(1, '2,3')
+    return snapshot
+
+
+def test_one_call_within_ttl(fake):
+    devices = snapshot(fake)
+    fake.reset()
+    assert set(devices.get()) == {1, 2}
+    assert devices.device(1)['Level'] == 10
+    assert fake.calls == ['devices']
+    time.sleep(0.06)
+    devices.get()
+    assert fake.calls == ['devices'] * 2
+
+
+def test_stale_snapshot_is_served_while_fetched_again(fake):
+    devices = snapshot(fake, serveStale=True)
+    devices.get()
+    fake.touch(1, Level=20)
+    fake.latency = 0.2
+    time.sleep(0.06)
+    started = time.monotonic()
+    assert devices.device(1)['Level'] == 10
+    assert time.monotonic() - started < 0.1
+    deadline = time.monotonic() + 2
+    while devices.device(1)['Level'] != 20 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert devices.device(1)['Level'] == 20
+
+
+def test_invalidate(fake):
+    devices = snapshot(fake, serveStale=True)
+    devices.get()
+    fake.touch(1, Level=20)
+    devices.invalidate()
+    # Served at once, fetched again in the background
+    devices.get()
+    deadline = time.monotonic() + 2
+    while devices.device(1)['Level'] != 20 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert devices.device(1)['Level'] == 20
+    assert devices.device(1, fresh=True)['Level'] == 20
+
+
+def test_stale_reads_do_not_wait_for_the_revalidation(fake):
+    devices = snapshot(fake, serveStale=True)
+    devices.get()
+    fake.latency = 0.5
+    time.sleep(0.06)
+    # The first read starts the revalidation, the next ones come while it
+    # is running
+    devices.get()
+    time.sleep(0.05)
+    started = time.monotonic()
+    for _ in range(3):
+        assert devices.device(1)['Level'] == 10
+    assert time.monotonic() - started < 0.1
+
+
+def test_invalidated_while_fetched(fake):
+    devices = snapshot(fake)
+    devices.get()
+    fake.touch(1, Level=20)
+    fake.latency = 0.2
+    time.sleep(0.06)
+    fetch = threading.Thread(target=devices.get)
+    fetch.start()
+    time.sleep(0.05)
+    # Written while the fetch is in flight
+    devices.invalidate()
+    fetch.join()
+    fake.reset()
+    devices.get()
+    assert fake.calls == ['devices']
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+import pytest
+
+from DomoticzFeed import DomoticzFeed, feedFields
+from SVT import DeviceSnapshot, DomoticzClient
+
+
+def message(idx, **fields):
+    fields['idx'] = idx
+    return json.dumps(fields).encode('utf-8')
+
+
+@pytest.fixture
+def snapshot(fake):
+    client = DomoticzClient(fake.ip, fake.port)
+    snapshot = DeviceSnapshot(client.DomoticzAPI, 0.1, client.select)
+    snapshot.track(*fake.devices)
+    yield snapshot
+    DomoticzClient.reset()
+
+
+def test_feed_fields():
+    assert feedFields({'dtype': 'Light/Switch', 'switchType': 'Selector',
+                       'svalue1': '20', 'nvalue': 2}) == {'Level': 20}
+    assert feedFields({'dtype': 'Light/Switch', 'switchType': 'On/Off',
+                       'nvalue': 1}) == {'Status': 'On'}
+    assert feedFields({'dtype': 'Light/Switch', 'nvalue': 0}) == \
+        {'Status': 'Off'}
+    assert feedFields({'dtype': 'Thermostat', 'svalue1': '21.5'}) == \
+        {'SetPoint': '21.5'}
+    assert feedFields({'dtype': 'Temp + Humidity', 'svalue1': '19.3'}) == \
+        {'Temp': 19.3}
+    assert feedFields({'dtype': 'P1 Smart Meter'}) == {}
+
+
+def test_pushed_updates_replace_polling(fake, snapshot):
+    feed = DomoticzFeed(quiet=60)
+    feed.attach(snapshot)
+    assert snapshot.feedTimeout == 60
+    snapshot.get()
+    fake.reset()
+    feed.handle(message(4, dtype='Thermostat', svalue1='22.0'))
+    time.sleep(0.2)
+    # Past the ttl, the pushed value is served without polling
+    assert snapshot.device(4)['SetPoint'] == '22.0'
+    assert fake.calls == []
+
+
+def test_untracked_devices_are_not_stored(snapshot):
+    feed = DomoticzFeed()
+    feed.attach(snapshot)
+    snapshot.get()
+    feed.handle(message(999, dtype='Temp', svalue1='5.0'))
+    assert 999 not in snapshot.get()
+    assert snapshot.feedAlive()
+
+
+def test_other_messages_keep_the_feed_alive(fake, snapshot):
+    feed = DomoticzFeed(quiet=60)
+    feed.attach(snapshot)
+    snapshot.get()
+    feed.handle(b'not json')
+    assert snapshot.feedAlive()
+    feed.handle(message(4, dtype='P1 Smart Meter', svalue1='12'))
+    assert snapshot.feedAlive()
+    time.sleep(0.2)
+    fake.reset()
+    snapshot.get()
+    assert fake.calls == []
+
+
+def test_quiet_feed_falls_back_to_polling(fake, snapshot):
+    feed = DomoticzFeed(quiet=0.1)
+    feed.attach(snapshot)
+    snapshot.get()
+    feed.handle(message(4, dtype='Thermostat', svalue1='22.0'))
+    time.sleep(0.2)
+    assert not snapshot.feedAlive()
+    fake.reset()
+    assert snapshot.device(4)['SetPoint'] == '20.5'
+    assert fake.calls == ['devices']
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import datetime
+import time
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from HeatingModel import HeatingModel, fitZone, ingestGraph, preheat  # noqa: E402,E501
+from SVT import DomoticzClient  # noqa: E402
+
+LOSS = 0.1
+POWER = 2.0
+
+
+def simulate(step, count, heatingEvery, start=19.0, outdoor=5.0,
+             power=POWER):
+    """ Temperatures of a zone following the model, heating one period out
+        of two.
+    """
+    times = numpy.arange(count) * step
+    indoor = [start]
+    for i in range(1, count):
+        rate = (power if heating(i - 1, heatingEvery) else 0) + \
+            LOSS * (outdoor - indoor[-1])
+        indoor.append(indoor[-1] + rate * step / 3600.0)
+    return times, numpy.array(indoor), times, numpy.full(count, outdoor)
+
+
+def heating(i, heatingEvery):
+    return (i // heatingEvery) % 2 == 0
+
+
+def dates(times):
+    start = numpy.datetime64('2026-10-19T00:00:00')
+    return [str(start + numpy.timedelta64(int(t), 's')).replace('T', ' ')
+            for t in times]
+
+
+def test_fit_short_log():
+    model = HeatingModel.fit(*simulate(300, 288, 12))
+    assert model.loss == pytest.approx(LOSS, rel=0.05)
+    assert model.power == pytest.approx(POWER, rel=0.05)
+    assert model.samples == 287
+
+
+def test_fit_needs_both_periods():
+    times, indoor, outdoorTimes, outdoor = simulate(300, 288, 1000)
+    # Heating only
+    assert HeatingModel.fit(times, indoor, outdoorTimes, outdoor) is None
+    assert HeatingModel.fit(times[:2], indoor[:2], outdoorTimes,
+                            outdoor) is None
+
+
+def test_fit_daily_samples():
+    data = simulate(86400, 60, 3)
+    # Daily samples are too far apart for the short log gap
+    assert HeatingModel.fit(*data) is None
+    assert HeatingModel.fit(*data, maxGap=2 * 86400) is not None
+
+
+def test_fit_with_the_heater_state():
+    # The heater is too weak for the temperature to rise when the zone is
+    # warm: only its switch tells the heating periods
+    times, indoor, outdoorTimes, outdoor = simulate(300, 288, 12,
+                                                    outdoor=-10, power=1.0)
+    switches = times[::12]
+    on = numpy.array([heating(i, 12) for i in range(0, 288, 12)])
+    model = HeatingModel.fit(times, indoor, outdoorTimes, outdoor,
+                             heaterTimes=switches, heaterOn=on)
+    assert model.loss == pytest.approx(LOSS, rel=0.05)
+    assert model.power == pytest.approx(1.0, rel=0.05)
+    guessed = HeatingModel.fit(times, indoor, outdoorTimes, outdoor)
+    assert guessed.loss != pytest.approx(LOSS, rel=0.05)
+
+
+def test_hours_to():
+    model = HeatingModel(LOSS, POWER)
+    # Heating tends to 5 + 2 / 0.1 = 25°C
+    assert model.hoursTo(20, 15, 5) == pytest.approx(
+        numpy.log(10 / 5) / LOSS)
+    assert model.hoursTo(26, 15, 5) is None
+    assert model.hoursTo(10, 15, 5) == pytest.approx(
+        numpy.log(10 / 5) / LOSS)
+
+
+def test_preheat_start():
+    model = HeatingModel(LOSS, POWER)
+    at = 1000000.0
+    assert model.preheatStart(20, at, 15, 5) == pytest.approx(
+        at - numpy.log(10 / 5) / LOSS * 3600)
+    assert model.preheatStart(20, at, 21, 5) == at
+    assert model.preheatStart(26, at, 15, 5) is None
+
+
+class Thermostat:
+    name = 'Salon'
+    switchId = None
+
+    def __init__(self, client, indoorProbeId, outdoorProbeId):
+        self.client = client
+        self.indoorProbeId = indoorProbeId
+        self.outdoorProbeId = outdoorProbeId
+
+
+def test_ingest_reads_the_daily_average(fake):
+    fake.logs[41] = [{'d': '2026-10-19', 'ta': 19.0, 'te': 21.5, 'tm': 17.0},
+                     {'d': '2026-10-20 00:00:00', 'te': 20.0}]
+    client = DomoticzClient(fake.ip, fake.port)
+    times, temps = ingestGraph(Thermostat(client, '41', '42'), 41, 'month')
+    assert list(temps) == [19.0, 20.0]
+    assert times[1] - times[0] == 86400
+
+
+def test_fit_zone_from_logs(fake):
+    times, indoor, _, outdoor = simulate(300, 288, 12)
+    fake.logs[41] = [{'d': d, 'te': round(float(t), 3)}
+                     for d, t in zip(dates(times), indoor)]
+    fake.logs[42] = [{'d': d, 'te': float(t)}
+                     for d, t in zip(dates(times), outdoor)]
+    client = DomoticzClient(fake.ip, fake.port)
+    # Probes as written in the SVT hardware
+    model = fitZone(Thermostat(client, '41,43', '42'))
+    assert model.loss == pytest.approx(LOSS, rel=0.05)
+    assert model.power == pytest.approx(POWER, rel=0.05)
+
+
+def test_fit_zone_from_the_heater_log(fake):
+    times, indoor, _, outdoor = simulate(300, 288, 12, outdoor=-10,
+                                         power=1.0)
+    fake.logs[41] = [{'d': d, 'te': round(float(t), 3)}
+                     for d, t in zip(dates(times), indoor)]
+    fake.logs[42] = [{'d': d, 'te': float(t)}
+                     for d, t in zip(dates(times), outdoor)]
+    # Newest first, as Domoticz does
+    fake.switchLogs[44] = [
+        {'Date': d, 'Status': 'On' if heating(i * 12, 12) else 'Off'}
+        for i, d in reversed(list(enumerate(dates(times[::12]))))]
+    thermostat = Thermostat(DomoticzClient(fake.ip, fake.port), '41', '42')
+    thermostat.switchId = '44'
+    model = fitZone(thermostat)
+    assert model.power == pytest.approx(1.0, rel=0.05)
+    assert 'lightlog' in fake.calls
+
+
+class Schedule:
+    def __init__(self, change):
+        self.change = change
+
+    def nextChange(self, mode=None, after=None):
+        assert mode == 'jour'
+        return self.change
+
+
+def test_preheat_before_the_next_day_mode():
+    thermostat = Thermostat(None, '41', '42')
+    thermostat.indoorTemp, thermostat.outdoorTemp = '15.0', '5.0'
+    thermostat.setpointNormal = '20.0'
+    model = HeatingModel(LOSS, POWER)
+    start, change = preheat(thermostat, model, Schedule((100000.0, 'jour')))
+    assert change == 100000.0
+    assert start == pytest.approx(change - numpy.log(2) / LOSS * 3600)
+    assert preheat(thermostat, model, Schedule(None)) is None
+    thermostat.indoorTemp = None
+    assert preheat(thermostat, model, Schedule((100000.0, 'jour'))) is None
+
+
+def test_schedule_answer_tells_when_to_preheat(fake, config, action):
+    from fake_hermes import FakeHermes, FakeIntentMessage
+    assert action.apply_config(config)
+    thermostat = action.registry.route()
+    action.models[thermostat] = HeatingModel(LOSS, POWER)
+    # Night since an hour ago, day in 6 hours
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+    day = now + datetime.timedelta(hours=6)
+    action.schedules[thermostat].load([
+        timer(now - datetime.timedelta(hours=1), 20), timer(day, 10)])
+    hermes = FakeHermes()
+    action.thermostat_schedule(hermes, FakeIntentMessage(
+        action.THERMOSTATSCHEDULE, {'thermostat_mode': 'jour'}))
+    # From 19.5 to 20.5 degrees with 8 degrees outside
+    start = time.localtime(day.timestamp() - 3600 * numpy.log(
+        (19.5 - 28) / (20.5 - 28)) / LOSS)
+    assert hermes.sentences['session'].endswith(
+        "Pour être à 20,5 degrés, le chauffage devra démarrer {} à {} "
+        "heures {:02d}.".format(
+            "aujourd'hui" if start.tm_mday == now.day else 'demain',
+            start.tm_hour, start.tm_min))
+
+
+def timer(when, level):
+    return {'Active': 'true', 'Type': 2, 'Time': when.strftime('%H:%M'),
+            'Days': 0x80, 'Level': level, 'Cmd': 0, 'Randomness': 'false'}
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from AsyncSVT import AsyncSVT
+from SVT import DomoticzClient
+from snipshelpers.http_pool import AsyncConnectionPool
+
+RESPONSE = (b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+            b'Content-Length: 2\r\n\r\n{}')
+
+
+async def read_request(reader):
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return line != b''
+
+
+async def serve(handler):
+    server = await asyncio.start_server(handler, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_stale_connection_is_replaced():
+    connections = []
+
+    async def handler(reader, writer):
+        connections.append(writer)
+        # The first request is answered, the second one finds the
+        # connection closed, as after the server idle timeout
+        if await read_request(reader):
+            writer.write(RESPONSE)
+            await writer.drain()
+        await read_request(reader)
+        writer.close()
+
+    async def run():
+        server, port = await serve(handler)
+        pool = AsyncConnectionPool('127.0.0.1', port)
+        first = await pool.request('GET', '/')
+        second = await pool.request('GET', '/')
+        pool.close()
+        server.close()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == (200, b'{}')
+    assert second == (200, b'{}')
+    assert len(connections) == 2
+
+
+def test_timeout_closes_the_connection():
+    closed = []
+
+    async def handler(reader, writer):
+        await read_request(reader)
+        # Never answered, the client gives up
+        closed.append(await reader.read() == b'')
+        writer.close()
+
+    async def run():
+        server, port = await serve(handler)
+        pool = AsyncConnectionPool('127.0.0.1', port)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.request('GET', '/'), 0.2)
+        await asyncio.sleep(0.1)
+        idle = len(pool._idle)
+        server.close()
+        return idle
+
+    assert asyncio.run(run()) == 0
+    assert closed == [True]
+
+
+def test_pool_outlives_event_loops(fake):
+    # Each asyncio.run has its own loop, the connections of the previous
+    # one cannot be reused
+    for _ in range(2):
+        values = asyncio.run(read_mode(fake))
+        assert values == {'mode': 'jour', 'state': 'automatique'}
+
+
+async def read_mode(fake):
+    thermostat = await AsyncSVT.create(fake.ip, fake.port)
+    return await thermostat.read('mode', 'state')
+
+
+def test_reset_builds_new_clients_and_pools(fake):
+    client = DomoticzClient.shared(fake.ip, fake.port, poolSize=2)
+    assert client.DomoticzAPI('type=devices&filter=all&used=true')
+    forgotten = DomoticzClient.reset()
+    assert list(forgotten.values()) == [client]
+    other = DomoticzClient.shared(fake.ip, fake.port, poolSize=3)
+    assert other is not client
+    assert other._pool is not client._pool
+    assert other._pool.size == 3
+    # The old client keeps working until closed
+    assert client.DomoticzAPI('type=devices&filter=all&used=true')
+    client.close()
+    assert client._pool._idle == []
+    for old in DomoticzClient.reset(forgotten).values():
+        old.close()
+    assert DomoticzClient.shared(fake.ip, fake.port) is client
+    DomoticzClient.reset()
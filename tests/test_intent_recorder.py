@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+from fake_hermes import FakeIntentMessage
+from snipshelpers.intent_recorder import IntentRecorder, read_intents
+
+
+def test_record_and_read(tmp_path):
+    path = str(tmp_path / 'intents.jsonl')
+    recorder = IntentRecorder(path)
+    recorder.record(FakeIntentMessage(
+        'ericvde31830:thermostatMode', {'thermostat_mode': 'nuit'},
+        session_id='s1', site_id='salon'))
+    recorder.record(FakeIntentMessage('ericvde31830:thermostatShift',
+                                      {'temperature': 1.5}))
+    recorder.close()
+    intents = read_intents(path)
+    assert [intent['intent'] for intent in intents] == [
+        'ericvde31830:thermostatMode', 'ericvde31830:thermostatShift']
+    first = intents[0]
+    assert first['session_id'] == 's1' and first['site_id'] == 'salon'
+    assert first['slots'] == {'thermostat_mode': 'nuit'}
+    assert intents[1]['slots'] == {'temperature': 1.5}
+    assert first['time'] <= intents[1]['time']
+
+
+def test_records_are_appended(tmp_path):
+    path = str(tmp_path / 'intents.jsonl')
+    for session in ('s1', 's2'):
+        recorder = IntentRecorder(path)
+        recorder.record(FakeIntentMessage('thermostatMode',
+                                          session_id=session))
+        recorder.close()
+    assert [intent['session_id'] for intent in read_intents(path)] == \
+        ['s1', 's2']
+
+
+def test_closed_recorder_drops_intents(tmp_path):
+    path = str(tmp_path / 'intents.jsonl')
+    recorder = IntentRecorder(path)
+    recorder.close()
+    recorder.record(FakeIntentMessage('thermostatMode'))
+    recorder.close()
+    assert read_intents(path) == []
+
+
+def test_concurrent_records_keep_whole_lines(tmp_path):
+    path = str(tmp_path / 'intents.jsonl')
+    recorder = IntentRecorder(path)
+
+    def record(thread):
+        for i in range(50):
+            recorder.record(FakeIntentMessage(
+                'thermostatMode', {'thermostat_mode': 'x' * 500},
+                session_id='{}-{}'.format(thread, i)))
+    threads = [threading.Thread(target=record, args=(t,)) for t in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.close()
+    with open(path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == 200
+
+
+def test_read_sorts_and_skips_invalid_lines(tmp_path):
+    path = tmp_path / 'intents.jsonl'
+    path.write_text('{"time": 2, "intent": "b"}\n'
+                    'not json\n'
+                    '\n'
+                    '{"time": 1, "intent": "a"}\n', encoding='utf-8')
+    assert [intent['intent'] for intent in read_intents(str(path))] == \
+        ['a', 'b']
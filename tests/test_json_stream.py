@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from snipshelpers import json_stream
+from snipshelpers.json_stream import iter_array
+
+DOCUMENT = {'status': 'OK', 'ActTime': 1546300800, 'title': 'Devices',
+            'result': [{'idx': '1', 'Name': 'Salon', 'Temp': 19.5},
+                       {'idx': '2', 'Name': 'Chambre été', 'Data': 'a]b'},
+                       {'idx': '3', 'Name': 'Entrée', 'Level': 10}],
+            'ServerTime': '2026-10-19 12:00:00'}
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 1000])
+def test_objects_split_anywhere(size):
+    data = json.dumps(DOCUMENT, ensure_ascii=False).encode('utf-8')
+    members = {}
+    assert list(iter_array(chunked(data, size), members=members)) == \
+        DOCUMENT['result']
+    assert members == {'status': 'OK', 'ActTime': 1546300800,
+                       'title': 'Devices', 'ServerTime': '2026-10-19 12:00:00'}
+
+
+def test_other_key():
+    data = b'{"status": "OK", "timers": [{"idx": "4"}], "result": [{}]}'
+    assert list(iter_array([data], key='timers')) == [{'idx': '4'}]
+
+
+def test_empty_and_missing_array():
+    assert list(iter_array([b'{"result": [ ], "status": "OK"}'])) == []
+    members = {}
+    assert list(iter_array([b'{"status": "ERR", ', b'"message": "x"}'],
+                           members=members)) == []
+    assert members == {'status': 'ERR', 'message': 'x'}
+
+
+def test_truncated_array():
+    data = json.dumps(DOCUMENT).encode('utf-8')
+    items = iter_array(chunked(data[:data.index(b'"idx": "2"') + 4], 16))
+    assert next(items) == DOCUMENT['result'][0]
+    with pytest.raises(ValueError):
+        next(items)
+
+
+def test_long_array(monkeypatch):
+    # The consumed text is dropped along the way
+    monkeypatch.setattr(json_stream, '_TRIM_SIZE', 512)
+    monkeypatch.setattr(json_stream, '_TAIL_SIZE', 256)
+    devices = [{'idx': str(i), 'Name': 'Device {}'.format(i)}
+               for i in range(500)]
+    data = json.dumps({'text': 'x' * 2000, 'ActTime': 1546300800,
+                       'title': 'y' * 200, 'result': devices,
+                       'status': 'OK'}).encode('utf-8')
+    members = {}
+    assert list(iter_array(chunked(data, 50), members=members)) == devices
+    # Members longer than the text kept are not collected
+    assert members == {'ActTime': 1546300800, 'title': 'y' * 200,
+                       'status': 'OK'}
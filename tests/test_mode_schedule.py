@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import ModeSchedule
+from ModeSchedule import expand
+from SVT import SVT, DomoticzClient
+
+# Monday 2026-10-19, noon
+MONDAY = datetime.datetime(2026, 10, 19, 12, 0)
+
+
+def at(day, hour, minute=0):
+    """ Epoch time of a day after MONDAY (0 for Monday itself). """
+    return (datetime.datetime.combine(
+        MONDAY.date() + datetime.timedelta(days=day),
+        datetime.time(hour, minute))).timestamp()
+
+
+def timer(time, level=0, kind=2, days=0x80, cmd=0, **fields):
+    timer = {'Active': 'true', 'Type': kind, 'Time': time, 'Days': days,
+             'Level': level, 'Cmd': cmd, 'Randomness': 'false'}
+    timer.update(fields)
+    return timer
+
+
+# 'type=timers' result: day at 7:00, night at 22:00, off on weekend nights
+TIMERS = [timer('07:00', 10), timer('22:00', 20),
+          timer('23:30', 20, days=0x200, cmd=1)]
+
+
+class Thermostat:
+    name = 'Salon'
+    schedule = None
+
+
+def test_expand_everyday_timers():
+    changes, exact = expand(TIMERS[:2], MONDAY.timestamp(), days=2)
+    assert exact
+    # From the day before
+    assert changes == [(at(-1, 7), 10), (at(-1, 22), 20),
+                       (at(0, 7), 10), (at(0, 22), 20),
+                       (at(1, 7), 10), (at(1, 22), 20)]
+
+
+def test_expand_off_command():
+    changes, _ = expand(TIMERS, MONDAY.timestamp())
+    # Weekends only, from the Sunday before, the Off command goes to
+    # level 0
+    assert [(when, level) for when, level in changes if level == 0] == \
+        [(at(-1, 23, 30), 0), (at(5, 23, 30), 0), (at(6, 23, 30), 0)]
+
+
+def test_expand_days_and_dates():
+    timers = [timer('08:00', 10, days=0x01 | 0x04),
+              timer('09:00', 20, kind=5, Date='2026-10-21'),
+              timer('10:00', 20, kind=5, Date='10-22-2026'),
+              timer('11:00', 10, Active='false')]
+    changes, exact = expand(timers, MONDAY.timestamp(), days=6)
+    assert exact
+    assert changes == [(at(0, 8), 10), (at(2, 8), 10), (at(2, 9), 20),
+                       (at(3, 10), 20)]
+
+
+def test_expand_inexact_timers():
+    # Before sunrise timers are not expanded
+    changes, exact = expand([timer('00:10', 10, kind=0)],
+                            MONDAY.timestamp())
+    assert changes == [] and not exact
+    changes, exact = expand([timer('07:00', 10, Randomness='true')],
+                            MONDAY.timestamp())
+    assert changes and not exact
+
+
+def test_level_and_next_change():
+    schedule = ModeSchedule.ModeSchedule(Thermostat())
+    schedule.load(TIMERS, MONDAY.timestamp())
+    assert schedule.exact
+    assert schedule.levelAt(at(0, 12)) == 10
+    assert schedule.modeAt(at(0, 23)) == 'nuit'
+    assert schedule.nextChange(after=at(0, 12)) == (at(0, 22), 'nuit')
+    assert schedule.nextChange('jour', after=at(0, 12)) == (at(1, 7), 'jour')
+    assert schedule.nextChange('Off', after=at(0, 12)) == \
+        (at(5, 23, 30), 'Off')
+    # Past the horizon
+    assert schedule.levelAt(at(30, 12)) is None
+
+
+def test_mode_set_by_hand_holds_until_next_change():
+    schedule = ModeSchedule.ModeSchedule(Thermostat())
+    schedule.load(TIMERS, MONDAY.timestamp())
+    schedule.observe(20, at(0, 13))
+    assert schedule.levelAt(at(0, 14)) == 20
+    assert schedule.levelAt(at(1, 8)) == 10
+    # The next change is the one to a different mode
+    assert schedule.nextChange(after=at(0, 14)) == (at(1, 7), 'jour')
+
+
+def test_reads_just_after_a_change_are_ignored():
+    schedule = ModeSchedule.ModeSchedule(Thermostat())
+    schedule.load(TIMERS, MONDAY.timestamp())
+    # Read before the 22:00 timer ran
+    schedule.observe(10, at(0, 22) + 30)
+    assert schedule.levelAt(at(0, 22, 5)) == 20
+    schedule.observe(10, at(0, 22) + ModeSchedule.CHANGE_GRACE + 1)
+    assert schedule.levelAt(at(0, 22, 5)) == 10
+
+
+def test_writes_just_after_a_change_are_recorded():
+    schedule = ModeSchedule.ModeSchedule(Thermostat())
+    schedule.load(TIMERS, MONDAY.timestamp())
+    # Set by voice a minute after the 22:00 timer
+    schedule.observe(10, at(0, 22, 1), written=True)
+    assert schedule.levelAt(at(0, 22, 5)) == 10
+    assert schedule.levelAt(at(1, 7, 5)) == 10
+
+
+def test_mode_set_right_after_a_scheduled_change(fake):
+    thermostat = SVT(fake.ip, fake.port, revalidate=False)
+    thermostat.applyIds(thermostat.discover())
+    schedule = ModeSchedule.ModeSchedule(thermostat)
+    thermostat.schedule = schedule
+    # Night since a minute ago, day in 12 hours
+    since = datetime.datetime.now() - datetime.timedelta(minutes=1)
+    until = since + datetime.timedelta(hours=12)
+    schedule.load([timer(since.strftime('%H:%M'), 20),
+                   timer(until.strftime('%H:%M'), 10)])
+    try:
+        thermostat.mode = 'jour'
+        assert schedule.current() == 'jour'
+    finally:
+        DomoticzClient.reset()
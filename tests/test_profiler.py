@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import tracemalloc
+
+from snipshelpers.profiler import IntentProfiler
+
+
+def profiled(directory):
+    profiler = IntentProfiler()
+    profiler.configure(str(directory), sampleRate=1.0, keep=2)
+    return profiler
+
+
+def run(profiler, name='ericvde31830:thermostatTrend'):
+    profiler.begin(name, 'session')
+    with profiler.phase('domoticz'):
+        time.sleep(0.01)
+    return profiler.end()
+
+
+def test_phases_and_stats(tmp_path):
+    profiler = profiled(tmp_path)
+    record = run(profiler)
+    assert record.phases['domoticz'] >= 0.01
+    assert record.duration >= record.phases['domoticz']
+    assert [os.path.basename(f).rsplit('-', 1)[-1] for f in record.files] == \
+        ['thermostatTrend.prof', 'thermostatTrend.mem.txt']
+    assert not tracemalloc.is_tracing()
+    assert (tmp_path / 'slowest.txt').exists()
+
+
+def test_old_stats_are_removed(tmp_path):
+    profiler = profiled(tmp_path)
+    for i in range(4):
+        run(profiler)
+        time.sleep(0.002)
+    assert len(list(tmp_path.glob('intent-*.prof'))) == 2
+    assert len(profiler.slowest()) == 4
+
+
+def test_tracing_stops_when_stats_cannot_be_written(tmp_path):
+    # The directory cannot be created
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    profiler = profiled(blocker / 'profiles')
+    record = run(profiler)
+    assert record.files == []
+    assert not tracemalloc.is_tracing()
+    # The next intent is sampled again
+    assert profiler._sampling.acquire(blocking=False)
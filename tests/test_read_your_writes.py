@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from SVT import SVT, DomoticzClient
+
+
+@pytest.fixture
+def thermostat(fake):
+    thermostat = SVT(fake.ip, fake.port, revalidate=False,
+                     reconcileTimeout=0.3)
+    thermostat.applyIds(thermostat.discover())
+    yield thermostat
+    DomoticzClient.reset()
+
+
+def test_written_value_is_read_until_reported(fake, thermostat):
+    idx = thermostat.setpointNormalId
+    assert thermostat.set('setpointNormal', 22)
+    # Domoticz has not applied it yet
+    fake.devices[idx]['SetPoint'] = '20.5'
+    assert float(thermostat.setpointNormal) == 22
+    assert idx in thermostat._written
+
+
+def test_reported_value_ends_the_written_one(fake, thermostat):
+    idx = thermostat.setpointNormalId
+    assert thermostat.set('setpointNormal', 22)
+    # The next snapshot, fetched for another device, has it
+    assert float(thermostat.setpointEconomy) == 18.0
+    assert idx not in thermostat._written
+    assert float(thermostat.setpointNormal) == 22
+    # Domoticz is trusted again
+    fake.touch(idx, SetPoint='19.0')
+    thermostat.client.snapshot.invalidate()
+    assert float(thermostat.setpointNormal) == 19.0
+
+
+def test_written_value_expires(fake, thermostat):
+    idx = thermostat.setpointNormalId
+    assert thermostat.set('setpointNormal', 22)
+    fake.devices[idx]['SetPoint'] = '20.5'
+    assert float(thermostat.setpointNormal) == 22
+    time.sleep(0.4)
+    assert float(thermostat.setpointNormal) == 20.5
+    assert idx not in thermostat._written
+
+
+def test_written_value_is_kept_per_field(fake, thermostat):
+    idx = thermostat.modeId
+    thermostat._remember(idx, 'Level', 20)
+    assert thermostat._read(idx, 'Level') == 20
+    # Other fields of the device come from Domoticz
+    assert thermostat._read(idx, 'Name') == fake.devices[idx]['Name']
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from SVT import DomoticzClient, DomoticzUnavailable
+from snipshelpers.resilience import CircuitBreaker, Deadline, deadlines
+
+
+def open_breaker(reset=0.05):
+    breaker = CircuitBreaker(failures=2, reset_timeout=reset)
+    assert breaker.allow()
+    assert not breaker.failure()
+    assert breaker.failure()
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = open_breaker(reset=10)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_success_resets_the_count():
+    breaker = CircuitBreaker(failures=2, reset_timeout=10)
+    breaker.failure()
+    breaker.success()
+    assert not breaker.failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_trial_success_closes():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # A single trial at a time
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_trial_failure_opens_again():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_aborted_trial_is_given_to_the_next_call():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.abort()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_abort_of_another_thread_is_ignored():
+    breaker = open_breaker()
+    time.sleep(0.06)
+    assert breaker.allow()
+    thread = threading.Thread(target=breaker.abort)
+    thread.start()
+    thread.join()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+def test_abort_while_closed_is_ignored():
+    breaker = CircuitBreaker()
+    breaker.abort()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def open_client(fake):
+    client = DomoticzClient(fake.ip, fake.port, retries=0,
+                            breakerFailures=1, breakerReset=0.05)
+    assert client.breaker.failure()
+    time.sleep(0.06)
+    return client
+
+
+def test_expired_deadline_does_not_leave_the_breaker_half_open(fake):
+    client = open_client(fake)
+    deadlines.begin(Deadline(0))
+    try:
+        with pytest.raises(DomoticzUnavailable):
+            client.DomoticzAPI("type=hardware")
+    finally:
+        deadlines.end()
+    assert client.breaker.state == CircuitBreaker.OPEN
+    assert client.breaker.allow()
+
+
+def test_abandoned_stream_does_not_leave_the_breaker_half_open(fake):
+    client = open_client(fake)
+    devices = client.stream("type=devices&filter=all&used=true")
+    next(devices)
+    devices.close()
+    assert client.breaker.state == CircuitBreaker.OPEN
+    assert client.breaker.allow()
+
+
+def test_trial_call_closes_the_breaker(fake):
+    client = open_client(fake)
+    assert client.DomoticzAPI("type=hardware") is not None
+    assert client.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retries_stop_once_another_thread_opened_the_breaker(fake):
+    client = DomoticzClient(fake.ip, fake.port, retries=3,
+                            breakerFailures=2)
+    calls = []
+
+    def call(timeout):
+        calls.append(timeout)
+        # The calls of other threads fail meanwhile
+        other = threading.Thread(target=lambda: [
+            client.breaker.failure() for _ in range(2)])
+        other.start()
+        other.join()
+        return None, True
+    assert client._retry('hardware', 'url', call) is None
+    assert client.breaker.state == CircuitBreaker.OPEN
+    assert len(calls) == 1
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from SVT import SVT, DomoticzClient
+
+
+@pytest.fixture
+def thermostat(fake):
+    thermostat = SVT(fake.ip, fake.port, revalidate=False, coalesceWindow=0.2)
+    thermostat.applyIds(thermostat.discover())
+    yield thermostat
+    DomoticzClient.reset()
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_close_shifts_are_written_once(fake, thermostat):
+    idx = thermostat.setpointNormalId
+    fake.reset()
+    assert thermostat.shiftSetpoint('normal', 0.5) == 21.0
+    assert thermostat.shiftSetpoint('normal', 0.5) == 21.5
+    assert thermostat.shiftSetpoint('normal', -1.5) == 20.0
+    # Read before being written
+    assert float(thermostat.setpointNormal) == 20.0
+    assert fake.count('setsetpoint') == 0
+    assert wait_for(lambda: fake.count('setsetpoint') == 1)
+    time.sleep(0.3)
+    assert fake.count('setsetpoint') == 1
+    assert fake.devices[idx]['SetPoint'] == '20.0'
+
+
+def test_shifts_of_each_setpoint_are_kept_apart(fake, thermostat):
+    assert thermostat.shiftSetpoint('normal', 1) == 21.5
+    assert thermostat.shiftSetpoint('economy', -1) == 17.0
+    thermostat.flush()
+    assert fake.devices[thermostat.setpointNormalId]['SetPoint'] == '21.5'
+    assert fake.devices[thermostat.setpointEconomyId]['SetPoint'] == '17.0'
+
+
+def test_flush_writes_the_pending_shifts_now(fake, thermostat):
+    fake.reset()
+    thermostat.shiftSetpoint('normal', 1)
+    thermostat.flush()
+    assert fake.count('setsetpoint') == 1
+    assert fake.devices[thermostat.setpointNormalId]['SetPoint'] == '21.5'
+    # The cancelled job does not write it again
+    time.sleep(0.3)
+    assert fake.count('setsetpoint') == 1
+
+
+def test_shift_without_window_is_written_at_once(fake, thermostat):
+    thermostat.coalesceWindow = 0
+    fake.reset()
+    assert thermostat.shiftSetpoint('economy', 0.5) == 18.5
+    assert fake.count('setsetpoint') == 1
+    assert fake.devices[thermostat.setpointEconomyId]['SetPoint'] == '18.5'
+
+
+def test_failed_shift_is_reported_and_forgotten(fake, thermostat,
+                                                monkeypatch):
+    answer = fake.answer
+    monkeypatch.setattr(fake, 'answer', lambda query: {'status': 'ERR'} if
+                        query.get('param') == 'setsetpoint' else answer(query))
+    failed = []
+    thermostat.shiftSetpoint('normal', 1, onError=failed.append)
+    assert float(thermostat.setpointNormal) == 21.5
+    assert wait_for(lambda: failed)
+    assert failed == [21.5]
+    # Back to the value of Domoticz
+    assert float(thermostat.setpointNormal) == 20.5
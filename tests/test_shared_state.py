@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import uuid
+
+import pytest
+
+from SVT import DeviceSnapshot, DomoticzClient
+from snipshelpers import shared_state
+
+pytestmark = pytest.mark.skipif(not shared_state.available(),
+                                reason='shared memory tables unsupported')
+
+DEVICES = [{'idx': '1', 'Level': 10, 'Status': 'Set Level: 10 %'},
+           {'idx': '2', 'Temp': 19.5},
+           {'idx': '3', 'SetPoint': '21.0', 'Name': 'not shared'}]
+
+
+@pytest.fixture
+def name():
+    name = 'svt_test_{}_{}'.format(os.getpid(), uuid.uuid4().hex[:8])
+    yield name
+    table = shared_state.SharedDeviceTable(name)
+    table.close()
+    table.unlink()
+
+
+def test_publish_and_read(name):
+    owner = shared_state.SharedDeviceTable(name, capacity=8)
+    reader = shared_state.SharedDeviceTable(name)
+    try:
+        assert reader.read() is None
+        assert reader.age() == float('inf')
+        assert owner.acquire()
+        owner.publish(DEVICES)
+        devices, updated, sequence = reader.read()
+        assert devices == {
+            1: {'idx': '1', 'Level': 10, 'Status': 'Set Level: 10 %'},
+            2: {'idx': '2', 'Temp': 19.5},
+            3: {'idx': '3', 'SetPoint': '21.0'}}
+        assert sequence == reader.sequence() == 2
+        assert reader.age() < 1
+        assert set(reader.read({2})[0]) == {2}
+        owner.publish(DEVICES[:1])
+        assert reader.sequence() == 4
+        assert list(reader.read()[0]) == [1]
+    finally:
+        owner.close()
+        reader.close()
+
+
+def test_read_while_written(name):
+    owner = shared_state.SharedDeviceTable(name, capacity=8)
+    try:
+        assert owner.acquire()
+        owner.publish(DEVICES)
+        # The owner is between the two sequence updates of a write
+        shared_state.SEQUENCE.pack_into(owner._shm.buf,
+                                        shared_state.SEQUENCE_OFFSET, 3)
+        assert owner.read() is None
+    finally:
+        owner.close()
+
+
+def test_single_owner(name):
+    first = shared_state.SharedDeviceTable(name)
+    second = shared_state.SharedDeviceTable(name)
+    try:
+        assert first.acquire()
+        assert not second.acquire()
+        first.release()
+        assert second.acquire()
+        assert second.owner and not first.owner
+    finally:
+        first.close()
+        second.close()
+
+
+def test_full_table(name):
+    owner = shared_state.SharedDeviceTable(name, capacity=2)
+    try:
+        assert owner.acquire()
+        owner.publish(DEVICES)
+        assert list(owner.read()[0]) == [1, 2]
+    finally:
+        owner.close()
+
+
+def test_snapshots_share_the_devices(fake, name):
+    client = DomoticzClient(fake.ip, fake.port)
+    idx = sorted(fake.devices)[0]
+    owner = DeviceSnapshot(client.DomoticzAPI, 1, client.select,
+                           shared=shared_state.SharedDeviceTable(name))
+    reader = DeviceSnapshot(client.DomoticzAPI, 1, client.select,
+                            shared=shared_state.SharedDeviceTable(name))
+    try:
+        assert owner.shared.owner and not reader.shared.owner
+        # The owner publishes as soon as it is built
+        deadline = time.monotonic() + 5
+        while owner.shared.age() > 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        fake.reset()
+        reader.track(idx)
+        assert reader.device(idx)['idx'] == str(idx)
+        assert fake.calls == []
+    finally:
+        owner.close()
+        reader.close()
+
+
+def test_owner_publishes_once_built(fake, name, monkeypatch):
+    # The publisher may run before the constructor returns
+    published = []
+    monkeypatch.setattr(DeviceSnapshot, '_publish',
+                        lambda self: published.append(self.get(True)))
+    client = DomoticzClient(fake.ip, fake.port)
+    owner = DeviceSnapshot(client.DomoticzAPI, 1, client.select,
+                           shared=shared_state.SharedDeviceTable(name))
+    try:
+        assert published == [{}]
+        assert owner.shared.read() is not None
+    finally:
+        owner.close()
+
+
+def test_devices_left_out_of_a_full_table_are_fetched(fake, name):
+    client = DomoticzClient(fake.ip, fake.port)
+    owner = shared_state.SharedDeviceTable(name, capacity=2)
+    assert owner.acquire()
+    reader = DeviceSnapshot(client.DomoticzAPI, 60, client.select,
+                            shared=shared_state.SharedDeviceTable(name))
+    try:
+        owner.publish(fake.devices.values())
+        last = max(fake.devices)
+        reader.track(1, last)
+        fake.reset()
+        assert reader.device(last)['idx'] == str(last)
+        assert fake.calls == ['devices']
+        # Fetched once per ttl, not on every read
+        assert reader.device(1) is not None
+        assert fake.calls == ['devices']
+    finally:
+        owner.close()
+        reader.close()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from SVT import DomoticzClient, apiReads
+from snipshelpers.single_flight import SingleFlight
+
+
+def concurrently(count, function):
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = function()
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target=run, args=(i, ))
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return {'result': len(calls)}
+    results = concurrently(5, lambda: flights.do('key', slow))
+    assert len(calls) == 1
+    assert [result for result, _ in results] == [{'result': 1}] * 5
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+    assert len(flights) == 0
+    # Once done, the next call runs again
+    assert flights.do('key', slow) == ({'result': 2}, False)
+
+
+def test_errors_reach_every_caller():
+    flights = SingleFlight()
+
+    def failing():
+        time.sleep(0.1)
+        raise ValueError('down')
+    results = concurrently(3, lambda: flights.do('key', failing))
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(flights) == 0
+
+
+def test_waiting_times_out():
+    flights = SingleFlight()
+    started = threading.Event()
+    thread = threading.Thread(target=flights.do, args=(
+        'key', lambda: started.set() or time.sleep(0.2)))
+    thread.start()
+    started.wait()
+    with pytest.raises(TimeoutError):
+        flights.do('key', lambda: None, timeout=0.01)
+    thread.join()
+
+
+def test_forget_starts_a_new_call():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def first():
+        started.set()
+        release.wait()
+        return 'old'
+    thread = threading.Thread(target=flights.do, args=('key', first))
+    thread.start()
+    started.wait()
+    flights.forget(lambda key: key == 'key')
+    assert flights.do('key', lambda: 'new') == ('new', False)
+    release.set()
+    thread.join()
+    assert len(flights) == 0
+
+
+def test_api_reads():
+    assert apiReads('type=devices&rid=12', 12)
+    assert not apiReads('type=devices&rid=13', 12)
+    assert apiReads('type=timers&idx=12', 12)
+    assert apiReads('type=devices&filter=all&used=true', 12)
+    assert not apiReads('type=hardware', 12)
+
+
+def test_client_coalesces_identical_reads(fake):
+    client = DomoticzClient(fake.ip, fake.port)
+    fake.latency = 0.1
+    fake.reset()
+    results = concurrently(4, lambda: client.DomoticzAPI(
+        'type=devices&filter=all&used=true'))
+    assert all(result == results[0] for result in results)
+    assert results[0]['status'] == 'OK'
+    assert len(fake.calls) == 1
+
+
+def test_write_is_not_merged_with_reads_in_progress(fake):
+    client = DomoticzClient(fake.ip, fake.port)
+    idx = sorted(fake.devices)[0]
+    read = 'type=devices&rid={}'.format(idx)
+    fake.latency = 0.2
+    first = threading.Thread(target=client.DomoticzAPI, args=(read, ))
+    first.start()
+    time.sleep(0.05)
+    fake.latency = 0
+    client.DomoticzAPI(
+        'type=command&param=switchlight&idx={}&switchcmd=Set Level&level=20'
+        .format(idx))
+    fake.reset()
+    # The read started before the write is not shared with the next one
+    client.DomoticzAPI(read)
+    first.join()
+    assert fake.calls == ['devices&rid']
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from SVT import (SVT, DomoticzClient, FAILED, SKIPPED, UNCHANGED, UNDONE,
+                 WRITTEN)
+
+
+@pytest.fixture
+def thermostat(fake):
+    thermostat = SVT(fake.ip, fake.port, revalidate=False)
+    thermostat.applyIds(thermostat.discover())
+    yield thermostat
+    DomoticzClient.reset()
+
+
+def failing(fake, monkeypatch, idx):
+    """ Make the writes of a device fail. """
+    answer = fake.answer
+
+    def refuse(query):
+        if query.get('type') == 'command' and query.get('idx') == str(idx):
+            return {'status': 'ERR'}
+        return answer(query)
+    monkeypatch.setattr(fake, 'answer', refuse)
+
+
+def test_plan_leaves_known_values_out(fake, thermostat):
+    fake.reset()
+    # Automatique, jour, 20.5 and 18.0 already
+    assert thermostat.plan(state='automatique', mode='nuit',
+                           setpointNormal=20.5, setpointEconomy='17',
+                           pause=None) == [('setpointEconomy', '18.0', 17.0),
+                                           ('mode', 10, 20)]
+    # A single read of the devices
+    assert fake.calls == ['devices']
+    assert thermostat.plan(mode='jour', pause=False) == []
+
+
+def test_plan_pauses_first(thermostat):
+    assert thermostat.plan(pause=True, setpointNormal=21) == [
+        ('pause', 'Off', 'On'), ('setpointNormal', '20.5', 21.0)]
+    assert thermostat.plan(pause='On', state=0)[0][0] == 'pause'
+
+
+def test_plan_rejects_unknown_values(thermostat):
+    with pytest.raises(ValueError):
+        thermostat.plan(mode='soir')
+    with pytest.raises(ValueError):
+        thermostat.plan(outdoorTemp=12)
+
+
+def test_apply(fake, thermostat):
+    assert thermostat.apply(state='forcé', mode='jour',
+                            setpointNormal=21) == {
+        'state': WRITTEN, 'mode': UNCHANGED, 'setpointNormal': WRITTEN}
+    assert fake.devices[thermostat.controlId]['Level'] == 20
+    assert fake.devices[thermostat.setpointNormalId]['SetPoint'] == '21.0'
+    assert thermostat.state == 'forcé'
+
+
+def test_apply_undoes_the_writes_made_when_one_fails(fake, monkeypatch,
+                                                     thermostat):
+    failing(fake, monkeypatch, thermostat.controlId)
+    assert thermostat.apply(setpointEconomy=17, state='stop',
+                            mode='nuit') == {
+        'setpointEconomy': UNDONE, 'state': FAILED, 'mode': SKIPPED}
+    assert fake.devices[thermostat.setpointEconomyId]['SetPoint'] == '18.0'
+    assert fake.devices[thermostat.controlId]['Level'] == 10
+    assert fake.devices[thermostat.modeId]['Level'] == 10
+    assert thermostat.setpointEconomy == 18.0
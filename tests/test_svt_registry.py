@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import socket
+import threading
+import time
+
+import pytest
+
+import SVT
+from fake_domoticz import FakeDomoticz
+from snipshelpers.resilience import Deadline, deadlines
+from SVTRegistry import SVTRegistry, zoneName
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def upstairs():
+    """ A second Domoticz server, with an 'SVT Etage' zone only. """
+    server = FakeDomoticz(zones=0)
+    server.addZone('SVT Etage')
+    yield server.start()
+    server.stop()
+
+
+@pytest.fixture
+def registry(fake, upstairs):
+    fake.addZone('SVT Zone 1')
+    registry = SVTRegistry([{'ip': fake.ip, 'port': fake.port},
+                            {'ip': upstairs.ip, 'port': upstairs.port}])
+    yield registry
+    registry.close()
+    SVT.DomoticzClient.reset()
+
+
+def test_zone_name():
+    assert zoneName('SVT') == ''
+    assert zoneName('SVT - Salon') == 'salon'
+    assert zoneName('SVT_Zone 1') == 'zone 1'
+    assert zoneName('Chauffage Salon', 'Chauffage') == 'salon'
+    assert zoneName('Salon') == 'salon'
+
+
+def test_route_across_hosts(fake, upstairs, registry):
+    assert sorted(registry.zones()) == ['', 'etage', 'zone 1']
+    assert registry.route('Etage').port == upstairs.port
+    assert registry.route('SVT Zone 1').port == fake.port
+    assert registry.route('zone 1').name == 'SVT Zone 1'
+    assert registry.route('garage') is None
+    # The zone without name is the default one
+    assert registry.route() is registry.zones()['']
+
+
+def test_route_without_default_zone(upstairs):
+    registry = SVTRegistry([{'ip': upstairs.ip, 'port': upstairs.port}])
+    try:
+        # The only zone is the default one
+        assert registry.route() is registry.route('etage')
+        upstairs.addZone('SVT Grenier')
+        registry.rediscover()
+        assert registry.route('grenier') is not None
+        assert registry.route() is None
+    finally:
+        registry.close()
+        SVT.DomoticzClient.reset()
+
+
+def test_each_drives_the_zones_concurrently(registry):
+    # Every zone waits for the others
+    barrier = threading.Barrier(3, timeout=2)
+    results = registry.each(lambda thermostat: barrier.wait() is not None and
+                            thermostat.name)
+    assert results == {'': 'SVT', 'etage': 'SVT Etage',
+                       'zone 1': 'SVT Zone 1'}
+
+
+def test_each_shares_the_deadline(registry):
+    deadline = Deadline(5)
+    deadlines.begin(deadline)
+    try:
+        results = registry.each(lambda thermostat: deadlines.current())
+    finally:
+        deadlines.end()
+    assert set(results.values()) == {deadline}
+    assert set(registry.each(lambda thermostat: deadlines.current())
+               .values()) == {None}
+
+
+def test_close_stops_the_discovery_retries(monkeypatch):
+    monkeypatch.setattr(SVT, 'DISCOVERY_RETRY_MIN', 0.05)
+    attempts = []
+    discover = SVTRegistry._discoverHost
+
+    def counted(self, host):
+        attempts.append(time.monotonic())
+        return discover(self, host)
+    monkeypatch.setattr(SVTRegistry, '_discoverHost', counted)
+    registry = SVTRegistry([{'ip': '127.0.0.1', 'port': closed_port()}],
+                           timeout=0.2, retries=0)
+    try:
+        deadline = time.monotonic() + 2
+        while len(attempts) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(attempts) >= 2
+        registry.close()
+        count = len(attempts)
+        time.sleep(0.5)
+        assert len(attempts) <= count + 1
+        assert len(registry) == 0
+    finally:
+        registry.close()
+        SVT.DomoticzClient.reset()
+
+
+def test_cancelled_retries():
+    attempts = []
+    retries = SVT.retryWithBackoff(lambda: attempts.append(1), False)
+    retries.cancel()
+    time.sleep(0.05)
+    assert attempts == [1]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from snipshelpers.thread_handler import HIGH, LOW, NORMAL, Job, ThreadHandler
+
+
+@pytest.fixture
+def handler():
+    """ A thread handler of its own, not the shared one. """
+    handler = type('Handler', (ThreadHandler,), {'_instance': None})(1)
+    yield handler
+    handler.stop(2)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_due_jobs_run_by_priority(handler):
+    release = threading.Event()
+    done = []
+    handler.run(release.wait)
+    assert wait_for(lambda: handler.pending() == 0)
+    for priority, name in ((LOW, 'low'), (NORMAL, 'normal'), (HIGH, 'high'),
+                           (NORMAL, 'normal again')):
+        handler.run(done.append, (name,), priority)
+    release.set()
+    assert wait_for(lambda: len(done) == 4)
+    assert done == ['high', 'normal', 'normal again', 'low']
+
+
+def test_scheduled_job_runs_once_due(handler):
+    done = []
+    start = time.monotonic()
+    handler.schedule(0.2, lambda: done.append(time.monotonic() - start))
+    cancelled = handler.schedule(0.1, done.append, ('cancelled',))
+    cancelled.cancel()
+    assert wait_for(lambda: done)
+    time.sleep(0.1)
+    assert len(done) == 1 and done[0] >= 0.2
+    assert handler.pending() == 0
+
+
+def test_every_runs_until_cancelled(handler):
+    done = []
+    job = handler.every(0.05, done.append, (1,), delay=0)
+    assert wait_for(lambda: len(done) >= 3)
+    job.cancel()
+    time.sleep(0.1)
+    count = len(done)
+    time.sleep(0.2)
+    assert len(done) == count
+    assert handler.pending() == 0
+
+
+def test_every_is_jittered():
+    job = Job(None, (), LOW, interval=100, jitter=0.1)
+    delays = [job.next_delay() for _ in range(200)]
+    assert all(90 <= delay <= 110 for delay in delays)
+    assert len(set(delays)) > 1
+    assert Job(None, (), LOW, interval=100).next_delay() == 100
+
+
+def test_failing_job_does_not_stop_the_worker(handler):
+    done = []
+    handler.run(lambda: 1 / 0)
+    handler.run(done.append, ('after',))
+    assert wait_for(lambda: done == ['after'])
+
+
+def test_stop_cancels_the_delayed_jobs(handler):
+    periodic = handler.every(10, lambda: None)
+    delayed = handler.schedule(10, lambda: None)
+    assert handler.pending() == 2
+    assert handler.stop(2)
+    assert periodic.cancelled and delayed.cancelled
+    assert handler.pending() == 0
+    # Nothing is scheduled once stopped
+    assert handler.run(lambda: None).cancelled
+
+
+def test_stop_waits_for_running_jobs_at_most_timeout(handler):
+    release = threading.Event()
+    handler.run(release.wait)
+    assert wait_for(lambda: handler.pending() == 0)
+    start = time.monotonic()
+    assert not handler.stop(0.2)
+    assert time.monotonic() - start < 1
+    release.set()
+    assert handler.stop(2)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import time
+
+import pytest
+
+from snipshelpers.worker_pool import KeyedWorkerPool
+
+
+def test_tasks_of_a_key_keep_their_order():
+    pool = KeyedWorkerPool(4, 16)
+    done = []
+    for i in range(20):
+        pool.submit('session', lambda i=i: time.sleep(0.001) or done.append(i))
+    pool.stop(5)
+    assert done == list(range(20))
+    assert pool.depth() == 0
+
+
+def test_slow_task_does_not_stall_other_keys():
+    pool = KeyedWorkerPool(2, 4)
+    release = threading.Event()
+    done = []
+    pool.submit('slow', release.wait)
+    pool.submit('slow', lambda: done.append('after slow'))
+    for key in ('a', 'b', 'c'):
+        pool.submit(key, lambda key=key: done.append(key))
+    deadline = time.monotonic() + 2
+    while len(done) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sorted(done) == ['a', 'b', 'c']
+    release.set()
+    pool.stop(2)
+    assert done[-1] == 'after slow'
+
+
+def test_full_queue():
+    pool = KeyedWorkerPool(1, 2)
+    release = threading.Event()
+    pool.submit('a', release.wait)
+    time.sleep(0.05)
+    pool.submit('b', lambda: None)
+    pool.submit('c', lambda: None)
+    assert pool.depth() == pool.capacity() == 2
+    with pytest.raises(queue.Full):
+        pool.submit('d', lambda: None, timeout=0.05)
+    release.set()
+    pool.stop(2)
+
+
+def test_failed_task_does_not_stop_the_chain():
+    pool = KeyedWorkerPool(1, 4)
+    done = []
+    pool.submit('a', lambda: 1 / 0)
+    pool.submit('a', lambda: done.append(1))
+    pool.stop(2)
+    assert done == [1]
+
+
+def test_stop_is_bounded_with_a_full_queue():
+    pool = KeyedWorkerPool(2, 1)
+    release = threading.Event()
+    for key in ('a', 'b', 'c', 'd'):
+        pool.submit(key, release.wait, timeout=1)
+    started = time.monotonic()
+    pool.stop(0.2)
+    assert time.monotonic() - started < 0.5
+    release.set()